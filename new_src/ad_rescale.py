@@ -5,7 +5,7 @@ import numpy as np
 from tqdm import *
 import nibabel as nib
 import matplotlib.pyplot as plt
-from scipy.ndimage.interpolation import zoom
+from resample import resample
 
 
 #
@@ -31,7 +31,7 @@ def save_nii(data, path, affine):
 
 def rescale(data, shape=[112, 96, 112]):
     factors = [float(t) / float(s) for s, t in zip(data.shape, shape)]
-    rescaled = zoom(data, zoom=factors, order=1, prefilter=False)
+    rescaled = resample(data, factors, order=1, output=data.dtype)
     return rescaled
 
 
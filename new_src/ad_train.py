@@ -10,6 +10,8 @@ from models import *
 import pandas as pd
 import nibabel as nib
 from random import seed, shuffle
+from parallel_load import load_volumes
+from augment_ops import flip
 
 from keras.layers import *
 from keras.callbacks import CSVLogger
@@ -70,22 +72,21 @@ def save_to_csv(subjects, csv_path):
     return
 
 
-def load_data(info, mode):
-    x, y = [], []
+def load_volume(volume_path):
+    volume = nib.load(volume_path).get_data()
+    volume = np.rot90(np.transpose(volume, [0, 2, 1]), 1)
+    # volume = np.rot90(volume, 3)
+    volume_obj = volume[volume > 0]
+    volume = (volume - np.mean(volume_obj)) / np.std(volume_obj)
+    volume = np.reshape(volume, VOLUME_SIZE)
+    return volume.astype(np.float32)
+
+
+def load_data(info, mode, processes=-1):
     print("Loading {} data ...".format(mode))
-    for subject in info:
-        volume_path, label = subject[0], subject[1]
-        volume = nib.load(volume_path).get_data()
-        volume = np.rot90(np.transpose(volume, [0, 2, 1]), 1)
-        # volume = np.rot90(volume, 3)
-        volume_obj = volume[volume > 0]
-        volume = (volume - np.mean(volume_obj)) / np.std(volume_obj)
-        volume = np.reshape(volume, VOLUME_SIZE)
-        x.append(volume.astype(np.float32))
-        y.append(label)
-
-    x = np.array(x)
-    y = np.array(y).reshape((-1, 1))
+    paths = [subject[0] for subject in info]
+    x, _ = load_volumes(paths, load_volume, processes)
+    y = np.array([subject[1] for subject in info]).reshape((-1, 1))
 
     return x, y
 
@@ -200,15 +201,12 @@ def test(SEED, x, y,
 
 def augment(x_train, y_train):
     print("Do Augmentation on nc Samples ...")
-    aug_x_train, aug_y_train = [], []
-    for i in range(len(y_train)):
-        aug_x_train.append(x_train[i])
-        aug_y_train.append(y_train[i])
-        if y_train[i] == 0:
-            aug_x_train.append(np.fliplr(x_train[i]))
-            aug_y_train.append(np.array([0]))
-    x_train = np.array(aug_x_train)
-    y_train = np.array(aug_y_train).reshape((-1, 1))
+    # Each sample of label 0 is followed by its flipped copy
+    is_zero = np.asarray(y_train).reshape(-1) == 0
+    order = np.repeat(np.arange(len(is_zero)), 1 + is_zero)
+    flips = np.concatenate([[False], order[1:] == order[:-1]])
+    x_train = flip(np.asarray(x_train), 1, flips, order)
+    y_train = np.asarray(y_train)[order].reshape((-1, 1))
 
     return x_train, y_train
 
@@ -0,0 +1,79 @@
+import numpy as np
+from sampler import VolumeSequence
+from scipy.ndimage import affine_transform
+
+
+# 3D augmentation for the augment path of cv_train.
+# Rotation in the plane of rows and columns, shift, zoom and
+# left-right flip are composed into one affine matrix, so each
+# volume is interpolated once. AffineSequence assembles batches
+# on demand, run it with fit_generator(workers=..., max_queue_size=...,
+# use_multiprocessing=True) to augment in background processes
+# with a bounded queue of batches.
+
+
+def random_affine(shape, rng, rotation_range=20, shift_range=[0.2, 0.2, 0],
+                  zoom_range=0.1, flip=False):
+    # Affine from output to input coordinates about the center of
+    # a volume in shape, as (matrix, offset) of affine_transform.
+    # rotation_range in degrees, shift_range in fractions of each
+    # axis, zoom in [1 - zoom_range, 1 + zoom_range] on each axis
+    shape = np.asarray(shape[:3], dtype=np.float64)
+    center = (shape - 1) / 2.0
+
+    theta = np.deg2rad(rng.uniform(-rotation_range, rotation_range))
+    rotation = np.array([[np.cos(theta), -np.sin(theta), 0],
+                         [np.sin(theta), np.cos(theta), 0],
+                         [0, 0, 1]])
+    zoom = np.diag(rng.uniform(1 - zoom_range, 1 + zoom_range, size=3))
+    mirror = np.diag([1, -1 if flip else 1, 1])
+    shift = rng.uniform(-1, 1, size=3) * np.asarray(shift_range) * shape
+
+    matrix = rotation.dot(zoom).dot(mirror)
+    offset = center - matrix.dot(center) + shift
+    return matrix, offset
+
+
+def affine(volume, matrix, offset, output=None):
+    # Resample each channel of volume (X, Y, Z, C) once by linear
+    # interpolation, voxels from outside take the nearest border
+    if output is None:
+        output = np.empty(volume.shape, dtype=volume.dtype)
+    for c in range(volume.shape[-1]):
+        output[..., c] = affine_transform(volume[..., c], matrix, offset,
+                                          order=1, mode="nearest")
+    return output
+
+
+class AffineSequence(VolumeSequence):
+
+    def __init__(self, x, y, batch_size, index=None, sampling=None,
+                 shuffle=True, random_state=None, flip_prob=0.5, **affine_paras):
+        super(AffineSequence, self).__init__(x, y, batch_size, index=index,
+                                             sampling=sampling, shuffle=shuffle,
+                                             random_state=random_state)
+        self.flip_prob = flip_prob
+        self.affine_paras = affine_paras
+
+        # Draws of a batch only depend on the seed, epoch and batch
+        # index, so they do not depend on which worker assembles it
+        self.seed = self.rng.randint(2 ** 31)
+        self.epoch = 0
+
+    def __getitem__(self, idx):
+        batch = slice(idx * self.batch_size, (idx + 1) * self.batch_size)
+        samples, flips = self.samples[batch], self.flips[batch]
+        rng = np.random.RandomState([self.seed, self.epoch, idx])
+
+        batch_x = np.empty([len(samples)] + list(self.x.shape[1:]),
+                           dtype=self.x.dtype)
+        for i, (sample, flip) in enumerate(zip(samples, flips)):
+            flip = flip != (rng.rand() < self.flip_prob)
+            matrix, offset = random_affine(self.x.shape[1:], rng, flip=flip,
+                                           **self.affine_paras)
+            affine(self.x[sample], matrix, offset, output=batch_x[i])
+        return batch_x, self.y[samples]
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        super(AffineSequence, self).on_epoch_end()
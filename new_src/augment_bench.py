@@ -0,0 +1,116 @@
+from __future__ import print_function
+
+import time
+import numpy as np
+from augment_ops import (NO_MIRROR, HORIZONTAL_MIRROR, VERTICAL_MIRROR,
+                         AXISYMMETRIC_MIRROR, flip, mirror, crop,
+                         jitter_intensity)
+
+
+# Cost of augmenting one batch with augment_ops.py and with the
+# per-sample loops it replaced, python augment_bench.py
+
+
+BATCH_SHAPE = [16, 112, 112, 88, 4]
+PARTIAL_SIZE = 49
+REPEAT = 3
+
+
+def old_augment(x_train, y_train):
+    # augment in ad_train.py, the same samples as "duplicate"
+    # sampling of VolumeSequence in sampler.py
+    aug_x_train, aug_y_train = [], []
+    for i in range(len(y_train)):
+        aug_x_train.append(x_train[i])
+        aug_y_train.append(y_train[i])
+        if y_train[i] == 0:
+            aug_x_train.append(np.fliplr(x_train[i]))
+            aug_y_train.append(np.array([0]))
+    return np.array(aug_x_train), np.array(aug_y_train).reshape((-1, 1))
+
+
+def new_augment(x_train, y_train):
+    is_zero = y_train.reshape(-1) == 0
+    order = np.repeat(np.arange(len(is_zero)), 1 + is_zero)
+    flips = np.concatenate([[False], order[1:] == order[:-1]])
+    return flip(x_train, 1, flips, order), y_train[order].reshape((-1, 1))
+
+
+def old_mirror(volume, mirror_type):
+    # horizontal_mirror, vertical_mirror and axisymmetric_mirror
+    # in BTCAugment, one slice at a time
+    temp = np.copy(volume)
+    for i in range(temp.shape[2]):
+        if mirror_type in [HORIZONTAL_MIRROR, AXISYMMETRIC_MIRROR]:
+            temp[:, :, i] = np.fliplr(temp[:, :, i])
+        if mirror_type in [VERTICAL_MIRROR, AXISYMMETRIC_MIRROR]:
+            temp[:, :, i] = np.flipud(temp[:, :, i])
+    return temp
+
+
+def old_mirror_crop(batch, mirror_types, begins):
+    partials = []
+    for volume, mirror_type, b in zip(batch, mirror_types, begins):
+        partials.append(old_mirror(volume, mirror_type)[
+            b[0]:b[0] + PARTIAL_SIZE, b[1]:b[1] + PARTIAL_SIZE,
+            b[2]:b[2] + PARTIAL_SIZE])
+    return np.array(partials)
+
+
+def old_modify_intensity(volume, rng):
+    # modify_intensity in BTCAugment, the scale of each channel
+    temp = np.copy(volume)
+    for c in range(temp.shape[-1]):
+        ctemp = np.reshape(temp[..., c], ((1, -1)))[0]
+        non_bg_index = np.where(ctemp > 0)
+        sign = rng.randint(2, size=1)[0] * 2 - 1
+        for i in non_bg_index:
+            scope = rng.randint(15, 31, size=1)[0] / 100.0
+            ctemp[i] = ctemp[i] * (1 + sign * scope)
+        temp[..., c] = np.reshape(ctemp, temp[..., c].shape)
+    return temp
+
+
+def timeit(func, *args):
+    # The best of REPEAT runs
+    outputs, times = [], []
+    for _ in range(REPEAT):
+        start = time.time()
+        outputs.append(func(*args))
+        times.append(time.time() - start)
+    return outputs[0], min(times)
+
+
+def bench(name, old_func, new_func, args, same):
+    old_output, old_time = timeit(old_func, *args)
+    new_output, new_time = timeit(new_func, *args)
+    assert same(old_output, new_output), name + " outputs differ"
+    print("{0}: {1:.4f}s -> {2:.4f}s per batch, {3:.1f}x".format(
+        name, old_time, new_time, old_time / max(new_time, 1e-9)))
+    return
+
+
+if __name__ == "__main__":
+
+    rng = np.random.RandomState(0)
+    batch = rng.rand(*BATCH_SHAPE).astype(np.float32)
+    batch[:, :10] = 0
+    labels = rng.randint(0, 2, size=(BATCH_SHAPE[0], 1))
+
+    bench("flip label 0", old_augment, new_augment, [batch, labels],
+          lambda a, b: all([np.array_equal(x, y) for x, y in zip(a, b)]))
+
+    mirror_types = rng.randint(-1, 3, size=BATCH_SHAPE[0])
+    begins = rng.randint(0, min(BATCH_SHAPE[1:4]) - PARTIAL_SIZE + 1,
+                         size=(BATCH_SHAPE[0], 3))
+    bench("mirror and crop", old_mirror_crop,
+          lambda b, m, p: crop(mirror(b, m), p, PARTIAL_SIZE),
+          [batch, mirror_types, begins], np.array_equal)
+
+    # Same draws as old_modify_intensity if each sample
+    # is jittered by its own RandomState
+    bench("jitter intensity",
+          lambda b: np.array([old_modify_intensity(v, np.random.RandomState(i))
+                              for i, v in enumerate(b)]),
+          lambda b: jitter_intensity(b, 0),
+          [batch], lambda a, b: a.shape == b.shape and a.dtype == b.dtype)
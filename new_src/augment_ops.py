@@ -0,0 +1,98 @@
+import numpy as np
+
+
+# Augmentation operations on batches. The first axis of a batch
+# is samples, such as (N, X, Y, Z, C) for volumes, use volume[None]
+# for one volume. Random operations take a seed or a RandomState.
+
+NO_MIRROR = -1
+HORIZONTAL_MIRROR = 0    # np.fliplr on each sample
+VERTICAL_MIRROR = 1      # np.flipud on each sample
+AXISYMMETRIC_MIRROR = 2  # Both of them
+
+
+def random_state(seed=None):
+    if isinstance(seed, np.random.RandomState):
+        return seed
+    return np.random.RandomState(seed)
+
+
+def _gather(batch, samples, flips):
+    # Gather batch[samples[i]] for each i by one indexing, the k-th
+    # axis of the i-th output is reversed if flips[k][i] is True
+    samples = np.asarray(samples)
+    num, axes = len(samples), len(flips)
+
+    index = [samples.reshape([-1] + [1] * axes)]
+    for axis, which in enumerate(flips):
+        size = batch.shape[axis + 1]
+        grid = np.arange(size)
+        grid = np.where(np.asarray(which, dtype=bool)[:, None], grid[::-1], grid)
+        shape = [num] + [1] * axes
+        shape[axis + 1] = size
+        index.append(grid.reshape(shape))
+    return batch[tuple(index)]
+
+
+def flip(batch, axis, which=None, samples=None):
+    # Flip along axis of samples, 0 for rows and 1 for columns.
+    # A view of batch if which and samples are None. Otherwise
+    # output i is batch[samples[i]] (default each sample once),
+    # flipped if which[i] is True (default all)
+    if which is None and samples is None:
+        return np.flip(batch, axis + 1)
+
+    if samples is None:
+        samples = np.arange(len(batch))
+    if which is None:
+        which = np.ones(len(samples), dtype=bool)
+
+    flips = [np.zeros(len(samples), dtype=bool)] * axis + [which]
+    return _gather(batch, samples, flips)
+
+
+def mirror(batch, mirror_types):
+    # Mirror each sample by its type, return a new array
+    mirror_types = np.asarray(mirror_types)
+    if not np.all(np.isin(mirror_types, [NO_MIRROR, HORIZONTAL_MIRROR,
+                                         VERTICAL_MIRROR, AXISYMMETRIC_MIRROR])):
+        raise ValueError("Unknown mirror type.")
+
+    flips = [np.isin(mirror_types, [VERTICAL_MIRROR, AXISYMMETRIC_MIRROR]),
+             np.isin(mirror_types, [HORIZONTAL_MIRROR, AXISYMMETRIC_MIRROR])]
+    return _gather(batch, np.arange(len(batch)), flips)
+
+
+def crop(batch, begins, size, samples=None):
+    # Crop a cube of size from sample samples[i] (default i) at
+    # begins[i], all cubes are gathered by one indexing
+    begins = np.asarray(begins)
+    num, axes = begins.shape
+    if samples is None:
+        samples = np.arange(num)
+
+    index = [np.asarray(samples).reshape([-1] + [1] * axes)]
+    for axis in range(axes):
+        shape = [num] + [1] * axes
+        shape[axis + 1] = size
+        grid = begins[:, axis, None] + np.arange(size)
+        if np.any(grid < 0) or np.any(grid >= batch.shape[axis + 1]):
+            raise IndexError("The cube is out of the sample.")
+        index.append(grid.reshape(shape))
+    return batch[tuple(index)]
+
+
+def jitter_intensity(batch, rng=None, scope=[15, 30], shift=0):
+    # Scale foreground (> 0) of each channel of each sample by
+    # 1 + sign * scope / 100, sign is +1 or -1 and scope is an
+    # integer in the range, then shift it by U(-shift, shift)
+    rng = random_state(rng)
+    shape = [batch.shape[0]] + [1] * (batch.ndim - 2) + [batch.shape[-1]]
+
+    sign = rng.randint(2, size=shape) * 2 - 1
+    percent = rng.randint(scope[0], scope[1] + 1, size=shape)
+    factor = (1 + sign * percent / 100.0).astype(np.float32)
+    offset = rng.uniform(-shift, shift, size=shape).astype(np.float32)
+
+    jittered = np.where(batch > 0, batch * factor + offset, batch)
+    return jittered.astype(batch.dtype, copy=False)
@@ -0,0 +1,231 @@
+from __future__ import print_function
+
+import os
+import json
+import time
+import shutil
+import argparse
+import resource
+import threading
+import numpy as np
+import nibabel as nib
+from multiprocessing import Pool, cpu_count
+
+
+# Benchmark preprocess.py and trim.py on synthetic BraTS-shaped
+# subjects: four modalities and a tumor mask with necrotic core (1),
+# edema (2) and enhancing tumor (4), no network or external tool.
+# Each stage runs at every cohort size and number of workers, and
+# voxels/s, subjects/s, peak RSS of all processes and peak bytes
+# written on disk are saved in a JSON file. N4 is not measured,
+# it needs ANTs. The cohort is kept in --work-dir for later runs.
+#
+#   python benchmark.py --subjects 4 8 --workers 1 4 --stages trim
+
+
+SHAPE = [240, 240, 155]
+MODALITIES = ["flair", "t1", "t1ce", "t2"]
+STAGES = ["preprocess", "trim"]
+
+# Mean intensities of brain, necrotic core, edema and enhancing tumor
+INTENSITIES = {"flair": [400, 500, 900, 700],
+               "t1": [500, 300, 450, 600],
+               "t1ce": [500, 300, 450, 1100],
+               "t2": [400, 900, 1000, 800]}
+
+
+def subject(shape=SHAPE, seed=0):
+    rng = np.random.RandomState(seed)
+    grid = np.ogrid[tuple([slice(0, s) for s in shape])]
+
+    # An ellipsoid brain, longer along rows
+    radius = [s * r * rng.uniform(0.95, 1.05)
+              for s, r in zip(shape, [0.38, 0.3, 0.35])]
+    center = [s / 2.0 for s in shape]
+    brain = sum([((g - c) / r) ** 2
+                 for g, c, r in zip(grid, center, radius)]) <= 1
+
+    # Edema around a shell of enhancing tumor and a necrotic core
+    tumor_center = [c + r * rng.uniform(-0.4, 0.4)
+                    for c, r in zip(center, radius)]
+    tumor_radius = [min(shape) * rng.uniform(0.08, 0.14) for _ in shape]
+    dist = np.sqrt(sum([((g - c) / r) ** 2 for g, c, r
+                        in zip(grid, tumor_center, tumor_radius)]))
+    tissue = np.zeros(shape, dtype=np.uint8)
+    tissue[dist <= 1] = 2
+    tissue[dist <= 0.6] = 3
+    tissue[dist <= 0.35] = 1
+    tissue[~brain] = 0
+    seg = np.array([0, 1, 2, 4], dtype=np.uint8)[tissue]
+
+    bias = 1 + 0.1 * (grid[0] / float(shape[0]) - grid[1] / float(shape[1]))
+    scans = {}
+    for modality in MODALITIES:
+        scan = np.array(INTENSITIES[modality], dtype=np.float32)[tissue]
+        scan = np.maximum(scan * bias + rng.normal(0, 30, shape), 1)
+        scan[~brain] = 0
+        scans[modality] = scan.astype(np.int16)
+    return scans, seg
+
+
+def generate(cohort_dir, subjects, shape=SHAPE):
+    # cohort_dir/Scans/<subj>/<subj>_<modality>.nii.gz
+    # cohort_dir/Seg/<subj>_seg.nii.gz
+    scans_dir = os.path.join(cohort_dir, "Scans")
+    seg_dir = os.path.join(cohort_dir, "Seg")
+    subjs = ["Subj{0:04d}".format(i) for i in range(subjects)]
+    if os.path.isdir(seg_dir):
+        return scans_dir, seg_dir, subjs
+
+    print("Generate a cohort of {} subjects".format(subjects))
+    os.makedirs(seg_dir)
+    for i, subj in enumerate(subjs):
+        subj_dir = os.path.join(scans_dir, subj)
+        os.makedirs(subj_dir)
+        scans, seg = subject(shape, i)
+        for modality, scan in scans.items():
+            path = os.path.join(subj_dir, subj + "_" + modality + ".nii.gz")
+            nib.save(nib.Nifti1Image(scan, np.eye(4)), path)
+        nib.save(nib.Nifti1Image(seg, np.eye(4)),
+                 os.path.join(seg_dir, subj + "_seg.nii.gz"))
+    return scans_dir, seg_dir, subjs
+
+
+def dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def tree_rss(pid):
+    # Sum of RSS of the process and its descendants, None without /proc
+    if not os.path.isdir("/proc"):
+        return None
+
+    parents, rss = {}, {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join("/proc", name, "stat"), "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (IOError, OSError):
+            continue
+        parents[int(name)] = int(fields[1])
+        rss[int(name)] = int(fields[21]) * resource.getpagesize()
+
+    tree, size = set([pid]), 0
+    while len(tree) != size:
+        size = len(tree)
+        tree |= set([p for p in parents if parents[p] in tree])
+    return sum([rss.get(p, 0) for p in tree])
+
+
+def monitor(out_dir, peaks, stopped, interval=0.1):
+    while True:
+        rss = tree_rss(os.getpid())
+        peaks["rss"] = None if rss is None else max(peaks["rss"], rss)
+        peaks["disk"] = max(peaks["disk"], dir_size(out_dir))
+        if stopped.wait(interval):
+            break
+    return
+
+
+def stage_paras(stage, scans_dir, seg_dir, subjs, out_dir, workers):
+    if stage == "preprocess":
+        from preprocess import unwarp_preprocess
+        # Same parameters as Step 2 in preprocess.py
+        paras = [(os.path.join(scans_dir, subj), os.path.join(out_dir, subj),
+                  5, [0.5, 99.5], 1024) for subj in subjs]
+        return unwarp_preprocess, paras
+    elif stage == "trim":
+        from trim import unwrap_rescale
+        from resample import pool_threads
+        paras = []
+        for subj in subjs:
+            os.makedirs(os.path.join(out_dir, subj))
+            seg_path = os.path.join(seg_dir, subj + "_seg.nii.gz")
+            for scan in sorted(os.listdir(os.path.join(scans_dir, subj))):
+                paras.append(([112, 112, 112],
+                              os.path.join(scans_dir, subj, scan),
+                              os.path.join(out_dir, subj, scan), seg_path))
+        # Threads of resample in each of workers
+        threads = pool_threads(len(paras), workers)
+        return unwrap_rescale, [p + (threads,) for p in paras]
+    raise ValueError("Unknown stage: " + stage)
+
+
+def bench(stage, cohort, workers, work_dir):
+    scans_dir, seg_dir, subjs = cohort
+    out_dir = os.path.join(work_dir, "Run")
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+
+    result = {"stage": stage, "subjects": len(subjs), "workers": workers}
+    print("\nBenchmark {0}: {1} subjects, {2} workers".format(
+        stage, len(subjs), workers))
+    try:
+        func, paras = stage_paras(stage, scans_dir, seg_dir, subjs, out_dir, workers)
+    except ImportError as e:
+        result.update({"status": "skipped", "error": str(e)})
+        print("skipped: " + str(e))
+        return result
+
+    peaks, stopped = {"rss": 0, "disk": 0}, threading.Event()
+    thread = threading.Thread(target=monitor, args=(out_dir, peaks, stopped))
+    thread.start()
+
+    start = time.time()
+    pool = Pool(processes=workers)
+    try:
+        pool.map(func, paras)
+    except Exception as e:
+        result.update({"status": "failed", "error": repr(e)})
+        print("failed: " + repr(e))
+        return result
+    finally:
+        pool.close()
+        pool.join()
+        seconds = time.time() - start
+        stopped.set()
+        thread.join()
+        shutil.rmtree(out_dir)
+
+    voxels = len(subjs) * len(MODALITIES) * int(np.prod(SHAPE))
+    result.update({"status": "done", "seconds": seconds, "voxels": voxels,
+                   "voxels_per_second": voxels / max(seconds, 1e-9),
+                   "subjects_per_second": len(subjs) / max(seconds, 1e-9),
+                   "peak_rss_bytes": peaks["rss"],
+                   "temp_disk_bytes": peaks["disk"]})
+    print("{0:.2f}s, {1:.3g} voxels/s, {2:.3g} subjects/s".format(
+        seconds, result["voxels_per_second"], result["subjects_per_second"]))
+    return result
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subjects", type=int, nargs="+", default=[4])
+    parser.add_argument("--workers", type=int, nargs="+", default=[cpu_count()])
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--work-dir", dest="work_dir", default="Benchmark")
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    results = []
+    for subjects in args.subjects:
+        cohort_dir = os.path.join(args.work_dir, "Cohort" + str(subjects))
+        cohort = generate(cohort_dir, subjects)
+        for stage in args.stages:
+            for workers in args.workers:
+                results.append(bench(stage, cohort, workers, args.work_dir))
+
+    with open(args.output, "w") as f:
+        json.dump({"cpu_count": cpu_count(), "shape": SHAPE,
+                   "results": results}, f, indent=1, sort_keys=True)
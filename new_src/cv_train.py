@@ -6,7 +6,12 @@ from tqdm import *
 from models import *
 import pandas as pd
 import nibabel as nib
+from functools import partial
 from random import seed, shuffle
+from sampler import VolumeSequence
+from affine_augment import AffineSequence
+from volume_cache import load_cached
+from parallel_load import load_volumes
 
 from keras.layers import *
 from keras.callbacks import CSVLogger
@@ -16,7 +21,6 @@ from sklearn.metrics import (log_loss, recall_score,
                              precision_score, roc_auc_score,
                              roc_curve, confusion_matrix)
 from keras.utils import to_categorical
-from keras.preprocessing.image import ImageDataGenerator
 from keras.callbacks import (ModelCheckpoint,
                              LearningRateScheduler,
                              # ReduceLROnPlateau,
@@ -31,6 +35,17 @@ BATCH_SIZE = 8
 EPOCHS_NUM = 60
 SPLITS_NUM = 4
 
+# Background processes to augment batches, and
+# the number of batches queued for training
+AUGMENT_WORKERS = 4
+AUGMENT_QUEUE_SIZE = 8
+
+# Parameters of load_volume, part of the cache key
+VOLUME_PARAS = {"orientation": "rot90-3",
+                "normalization": "foreground-zscore",
+                "shape": VOLUME_SIZE,
+                "dtype": "float32"}
+
 
 def get_data_path(dir_path, volume_type, label, SEED):
     subjects = os.listdir(dir_path)
@@ -72,22 +87,23 @@ def save_to_csv(subjects, csv_path):
     return
 
 
-def load_data(info, mode):
-    x, y = [], []
+def load_volume(volume_path):
+    volume = nib.load(volume_path).get_data()
+    volume = np.rot90(volume, 3)
+    volume_obj = volume[volume > 0]
+    volume = (volume - np.mean(volume_obj)) / np.std(volume_obj)
+    # volume = volume / np.max(volume_obj) - 0.5
+    volume = np.reshape(volume, VOLUME_SIZE)
+    return volume.astype(np.float32)
+
+
+def load_data(info, mode, cache_dir=None, processes=-1):
     print("Loading {} data ...".format(mode))
-    for subject in info:
-        volume_path, label = subject[0], subject[1]
-        volume = nib.load(volume_path).get_data()
-        volume = np.rot90(volume, 3)
-        volume_obj = volume[volume > 0]
-        volume = (volume - np.mean(volume_obj)) / np.std(volume_obj)
-        # volume = volume / np.max(volume_obj) - 0.5
-        volume = np.reshape(volume, VOLUME_SIZE)
-        x.append(volume.astype(np.float32))
-        y.append(label)
-
-    x = np.array(x)
-    y = np.array(y).reshape((-1, 1))
+    paths = [subject[0] for subject in info]
+    loader = partial(load_cached, loader=load_volume,
+                     paras=VOLUME_PARAS, cache_dir=cache_dir)
+    x, _ = load_volumes(paths, loader, processes)
+    y = np.array([subject[1] for subject in info]).reshape((-1, 1))
 
     return x, y
 
@@ -126,32 +142,21 @@ def load_model(model_type):
 
 
 def cv_train(trainset_info, testset_info, model_type, model_name,
-             models_dir, logs_dir, optimizer, augment=False):
+             models_dir, logs_dir, optimizer, augment=False,
+             cache_dir=None, sampling="duplicate"):
 
-    x_test, y_test = load_data(testset_info, "testset")
+    x_test, y_test = load_data(testset_info, "testset", cache_dir)
     y_test = to_categorical(y_test, num_classes=2)
 
-    x, y = load_data(trainset_info, "trainset")
+    x, y = load_data(trainset_info, "trainset", cache_dir)
+    y_category = to_categorical(y, num_classes=2)
     kfold = StratifiedKFold(n_splits=SPLITS_NUM, shuffle=True)
     kfold_no = 0
     cvlosses, cvaccs = [], []
 
     for tidx, vidx in kfold.split(x, y):
-        x_train, y_train = [], []
-        for idx in tidx:
-            x_train.append(x[idx])
-            y_train.append(y[idx])
-
-            if y[idx] == 0:
-                aug_volume = np.fliplr(x[idx])
-                x_train.append(aug_volume.astype(np.float32))
-                y_train.append(y[idx])
-
-        x_train = np.array(x_train)
-        y_train = np.array(y_train)
-        y_train = to_categorical(y_train, num_classes=2)
         x_valid = x[vidx]
-        y_valid = to_categorical(y[vidx], num_classes=2)
+        y_valid = y_category[vidx]
 
         if model_type == "vggish":
             model = vggish()
@@ -201,33 +206,35 @@ def cv_train(trainset_info, testset_info, model_type, model_name,
 
         class_weight = {0: 1., 1: 1.}
         if not augment:
-            model.fit(x_train, y_train,
-                      batch_size=BATCH_SIZE,
-                      epochs=EPOCHS_NUM,
-                      validation_data=(x_valid, y_valid),
-                      shuffle=True,
-                      callbacks=callbacks,
-                      class_weight=class_weight)
+            # Samples of this fold are read from x while batches are
+            # assembled, LGG samples are flipped at that time as well
+            train_seq = VolumeSequence(x, y_category, BATCH_SIZE,
+                                       index=tidx, sampling=sampling)
+            model.fit_generator(train_seq,
+                                epochs=EPOCHS_NUM,
+                                validation_data=(x_valid, y_valid),
+                                shuffle=False,
+                                callbacks=callbacks,
+                                class_weight=class_weight)
         else:
-            datagen = ImageDataGenerator(
-                featurewise_center=False,
-                samplewise_center=False,
-                featurewise_std_normalization=False,
-                samplewise_std_normalization=False,
-                zca_whitening=False,
-                rotation_range=20,
-                width_shift_range=0.2,
-                height_shift_range=0.2,
-                zoom_range=0.1,
-                horizontal_flip=True,
-                vertical_flip=False)
-
-            datagen.fit(x_train, augment=True, rounds=10)
-            model.fit_generator(
-                datagen.flow(x_train, y_train, batch_size=BATCH_SIZE, shuffle=True),
-                steps_per_epoch=len(x_train) / BATCH_SIZE, callbacks=callbacks,
-                validation_data=(x_valid, y_valid),
-                epochs=EPOCHS_NUM, verbose=1, workers=4)
+            # Each sample is rotated, shifted, zoomed and flipped
+            # at random by one interpolation when its batch is
+            # assembled in a background process, LGG samples are
+            # drawn by sampling as well
+            augment_seq = AffineSequence(x, y_category, BATCH_SIZE, index=tidx,
+                                         sampling=sampling,
+                                         rotation_range=20,
+                                         shift_range=[0.2, 0.2, 0],
+                                         zoom_range=0.1)
+            model.fit_generator(augment_seq,
+                                epochs=EPOCHS_NUM,
+                                validation_data=(x_valid, y_valid),
+                                shuffle=False,
+                                callbacks=callbacks,
+                                class_weight=class_weight,
+                                workers=AUGMENT_WORKERS,
+                                use_multiprocessing=True,
+                                max_queue_size=AUGMENT_QUEUE_SIZE)
 
         model.save(last_model_path)
         score = model.evaluate(x_test, y_test, batch_size=BATCH_SIZE, verbose=0)
@@ -247,8 +254,9 @@ def cv_train(trainset_info, testset_info, model_type, model_name,
     return
 
 
-def cv_test(SEED, testset_info, model_type, models_dir, model_name, test_logs_dir):
-    x_test, y_test = load_data(testset_info, "testset")
+def cv_test(SEED, testset_info, model_type, models_dir, model_name,
+            test_logs_dir, cache_dir=None):
+    x_test, y_test = load_data(testset_info, "testset", cache_dir)
     y_test_category = to_categorical(y_test, num_classes=2)
 
     hgg_idx = np.where(y_test == 1)[0]
@@ -355,6 +363,10 @@ if __name__ == "__main__":
     parser.add_argument("--seed", action="store", default="0",
                         dest="seed", help=seed_help_str)
 
+    cache_help_str = "Directory to cache normalized volumes."
+    parser.add_argument("--cache", action="store", default=None,
+                        dest="cache", help=cache_help_str)
+
     args = parser.parse_args()
 
     mode = args.mode
@@ -386,9 +398,10 @@ if __name__ == "__main__":
     if mode == "train":
         cv_train(trainset_info, testset_info,
                  model_type, model_name,
-                 models_dir, logs_dir, opt_type, False)
+                 models_dir, logs_dir, opt_type, False, args.cache)
     else:
-        cv_test(SEED, testset_info, model_type, models_dir, model_name, test_logs_dir)
+        cv_test(SEED, testset_info, model_type, models_dir, model_name,
+                test_logs_dir, args.cache)
 
 
 # LOGS
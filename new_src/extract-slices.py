@@ -4,7 +4,7 @@ import numpy as np
 from tqdm import *
 import nibabel as nib
 import matplotlib.pyplot as plt
-from scipy.ndimage.interpolation import zoom
+from resample import resample
 
 
 def create_dir(path):
@@ -39,7 +39,7 @@ def resize(in_slice):
 
 def rescale(in_slice, target_shape=[224, 224]):
     factors = [t / s for s, t in zip(in_slice.shape, target_shape)]
-    resized = zoom(in_slice, zoom=factors, order=1, prefilter=False)
+    resized = resample(in_slice, factors, order=1, output=in_slice.dtype, threads=1)
     return resized
 
 
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+# Bounding boxes and square crops of volumes and slices.
+# A box is a list of [begin, end) pairs, one for each leading axis.
+# Boxes are found from projections (np.any along the other axes)
+# of one foreground mask, instead of np.where over all voxels.
+
+
+def bbox(volume, axes=None):
+    # Foreground is volume > 0, or volume itself if it is boolean
+    mask = volume if volume.dtype == np.bool_ else volume > 0
+    if axes is None:
+        axes = range(mask.ndim)
+
+    box = []
+    for axis in axes:
+        others = tuple([a for a in range(mask.ndim) if a != axis])
+        idx = np.flatnonzero(np.any(mask, axis=others))
+        if len(idx) == 0:
+            raise ValueError("No foreground in volume.")
+        box.append([int(idx[0]), int(idx[-1]) + 1])
+    return box
+
+
+def square(box):
+    # Extend the shorter one of the first two ranges on both sides
+    # so that they have the same length
+    (rb, re), (cb, ce) = box[0], box[1]
+    diff = (re - rb) - (ce - cb)
+    if diff > 0:
+        cb, ce = cb - diff // 2, ce + diff - diff // 2
+    elif diff < 0:
+        diff = -diff
+        rb, re = rb - diff // 2, re + diff - diff // 2
+    return [[rb, re], [cb, ce]] + [list(b) for b in box[2:]]
+
+
+def crop(volume, box, pad_value=0):
+    # Return a view if box is inside volume,
+    # otherwise a copy padded with pad_value outside it
+    inside = all([b >= 0 and e <= s for (b, e), s in zip(box, volume.shape)])
+    if inside:
+        return volume[tuple([slice(b, e) for b, e in box])]
+
+    shape = [e - b for b, e in box] + list(volume.shape[len(box):])
+    cropped = np.full(shape, pad_value, dtype=volume.dtype)
+    src, dst = [], []
+    for (b, e), s in zip(box, volume.shape):
+        src.append(slice(max(b, 0), min(e, s)))
+        dst.append(slice(max(b, 0) - b, min(e, s) - b))
+    cropped[tuple(dst)] = volume[tuple(src)]
+    return cropped
+
+
+def square_crop(volume, ndim=3):
+    # Crop the first ndim axes of volume to the foreground,
+    # rows and columns are padded to the same length
+    box = square(bbox(volume, range(ndim)))
+    return crop(volume, box)
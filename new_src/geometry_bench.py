@@ -0,0 +1,121 @@
+from __future__ import print_function
+
+import time
+import numpy as np
+from geometry import bbox, crop, square, square_crop
+
+
+# Compare geometry.py with the trim functions it replaced
+# on a synthetic 240x240x155 volume, python geometry_bench.py
+
+
+SHAPE = [240, 240, 155]
+
+
+def old_trim(volume):
+    # trim in trim.py and BTCPreprocess.trim in src2
+    non_zero_slices = [i for i in range(volume.shape[-1])
+                       if np.sum(volume[..., i]) > 0]
+    volume = volume[..., non_zero_slices]
+
+    row_begins, row_ends = [], []
+    col_begins, col_ends = [], []
+    for i in range(volume.shape[-1]):
+        non_zero_pixels = np.where(volume > 0)
+        row_begins.append(np.min(non_zero_pixels[0]))
+        row_ends.append(np.max(non_zero_pixels[0]))
+        col_begins.append(np.min(non_zero_pixels[1]))
+        col_ends.append(np.max(non_zero_pixels[1]))
+
+    row_begin, row_end = min(row_begins), max(row_ends)
+    col_begin, col_end = min(col_begins), max(col_ends)
+
+    rows_num = row_end - row_begin
+    cols_num = col_end - col_begin
+    more_col_len = rows_num - cols_num
+    more_col_len_left = more_col_len // 2
+    more_col_len_right = more_col_len - more_col_len_left
+    col_begin -= more_col_len_left
+    col_end += more_col_len_right
+    len_of_side = rows_num + 1
+
+    trimmed = np.zeros([len_of_side, len_of_side, volume.shape[-1]])
+    for i in range(volume.shape[-1]):
+        trimmed[..., i] = volume[row_begin:row_end + 1,
+                                 col_begin:col_end + 1, i]
+    return trimmed
+
+
+def old_extract_trim(volume):
+    # trim in lgg_extract_* and tcga_extract_*
+    none_zero_idx = np.where(volume > 0)
+
+    min_i, max_i = np.min(none_zero_idx[0]), np.max(none_zero_idx[0])
+    min_j, max_j = np.min(none_zero_idx[1]), np.max(none_zero_idx[1])
+
+    diff_i = max_i - min_i
+    diff_j = max_j - min_j
+
+    if diff_i > diff_j:
+        diff = diff_i - diff_j
+        half_diff = diff // 2
+        min_j -= half_diff
+        max_j += (diff - half_diff)
+    elif diff_i < diff_j:
+        diff = diff_j - diff_i
+        half_diff = diff // 2
+        min_i -= half_diff
+        max_i += (diff - half_diff)
+
+    return min_i, max_i, min_j, max_j
+
+
+def old_trim_view(v):
+    # Bounding box in multi_views.trim_views
+    non_bg_idx = np.where(v)
+    rb, re = np.min(non_bg_idx[0]), np.max(non_bg_idx[0])
+    cb, ce = np.min(non_bg_idx[1]), np.max(non_bg_idx[1])
+    return v[rb:re + 1, cb:ce + 1]
+
+
+def new_extract_trim(volume):
+    (min_i, max_i), (min_j, max_j) = square(bbox(volume, [0, 1]))
+    return min_i, max_i - 1, min_j, max_j - 1
+
+
+def brain(shape=SHAPE, radius=[0.38, 0.3, 0.35], seed=0):
+    # An ellipsoid of positive intensities, longer along rows
+    grid = np.ogrid[tuple([slice(0, s) for s in shape])]
+    dist = sum([((g - s / 2.0) / (r * s)) ** 2
+                for g, s, r in zip(grid, shape, radius)])
+    rng = np.random.RandomState(seed)
+    volume = rng.randint(1, 1000, size=shape).astype(np.int16)
+    volume[dist > 1] = 0
+    return volume
+
+
+def timeit(func, *args):
+    start = time.time()
+    output = func(*args)
+    return output, time.time() - start
+
+
+def bench(name, old_func, new_func, volume, same):
+    old_output, old_time = timeit(old_func, volume)
+    new_output, new_time = timeit(new_func, volume)
+    assert same(old_output, new_output), name + " outputs differ"
+    print("{0}: {1:.4f}s -> {2:.4f}s, {3:.1f}x".format(
+        name, old_time, new_time, old_time / max(new_time, 1e-9)))
+    return
+
+
+if __name__ == "__main__":
+
+    volume = brain()
+    bench("trim", old_trim, square_crop, volume, np.array_equal)
+    bench("extract trim", old_extract_trim, new_extract_trim, volume,
+          lambda a, b: list(a) == list(b))
+
+    view = volume[..., SHAPE[-1] // 2]
+    bench("trim view", old_trim_view, lambda v: crop(v, bbox(v != 0)),
+          view, np.array_equal)
@@ -5,7 +5,7 @@ from tqdm import *
 import pandas as pd
 import nibabel as nib
 import matplotlib.pyplot as plt
-from scipy.ndimage.interpolation import zoom
+from resample import resample
 
 
 def create_dir(path):
@@ -94,7 +94,7 @@ for subject in tqdm(subjects):
             data_shape = list(data.shape)
             if data_shape != target_size:
                 factor = [n / s for n, s in zip(target_size, data_shape)]
-                data = zoom(data, zoom=factor, order=1, prefilter=False)
+                data = resample(data, factor, order=1, output=data.dtype, threads=1)
 
             out_file_path = os.path.join(out_file_dir, subject + "-" + group + "-" + str(i))
             np.save(out_file_path, data)
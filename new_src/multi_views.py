@@ -3,8 +3,9 @@ import warnings
 import numpy as np
 from tqdm import *
 import nibabel as nib
+from geometry import bbox, crop
 import scipy.misc
-from scipy.ndimage.interpolation import zoom
+from resample import resample
 import matplotlib.pyplot as plt
 
 
@@ -20,12 +21,9 @@ def create_dir(path):
 def trim_views(views):
     trimmed_views = []
     for v in views:
-        non_bg_idx = np.where(v)
-        rb, re = np.min(non_bg_idx[0]), np.max(non_bg_idx[0])
-        cb, ce = np.min(non_bg_idx[1]), np.max(non_bg_idx[1])
-        sub_view = v[rb:re + 1, cb:ce + 1]
+        sub_view = crop(v, bbox(v != 0))
         factors = [t / s for s, t in zip(sub_view.shape, TRIMMED_SIZE)]
-        resized = zoom(sub_view, zoom=factors, order=1, prefilter=False)
+        resized = resample(sub_view, factors, order=1, output=sub_view.dtype, threads=1)
         trimmed_views.append(resized)
 
     return trimmed_views
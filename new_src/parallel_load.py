@@ -0,0 +1,76 @@
+from __future__ import print_function
+
+import time
+import numpy as np
+from multiprocessing import Pool, RawArray, cpu_count
+
+
+# Decode volumes in a process pool, one task per subject.
+# Each worker writes its volume into one preallocated array,
+# a shared memory buffer or a memory-mapped .npy file if to_path
+# is given, so the final np.array(list) copy is skipped.
+# The first volume is decoded in the main process to size the output.
+
+
+# Output array and loader of each worker process
+WORKER = {}
+
+
+def init_worker(buffer, to_path, dtype, shape, loader):
+    if to_path is not None:
+        WORKER["x"] = np.load(to_path, mmap_mode="r+")
+    else:
+        WORKER["x"] = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+    WORKER["loader"] = loader
+    return
+
+
+def load_one(arg):
+    i, path = arg
+    start = time.time()
+    WORKER["x"][i] = WORKER["loader"](path)
+    if isinstance(WORKER["x"], np.memmap):
+        WORKER["x"].flush()
+    decode_time = time.time() - start
+    print("\tDecoded {0} in {1:.2f}s".format(path, decode_time))
+    return i, decode_time
+
+
+def load_volumes(paths, loader, processes=-1, to_path=None):
+    if len(paths) == 0:
+        return np.zeros([0]), []
+
+    if processes == -1 or processes > cpu_count():
+        processes = cpu_count()
+
+    start = time.time()
+    first = np.asarray(loader(paths[0]))
+    times = [0.0] * len(paths)
+    times[0] = time.time() - start
+
+    dtype, shape = first.dtype, [len(paths)] + list(first.shape)
+    buffer = None
+    if to_path is not None:
+        x = np.lib.format.open_memmap(to_path, mode="w+",
+                                      dtype=dtype, shape=tuple(shape))
+    else:
+        buffer = RawArray("b", int(np.prod(shape)) * dtype.itemsize)
+        x = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+    x[0] = first
+    del first
+
+    if to_path is not None:
+        x.flush()
+
+    pool = Pool(processes=processes, initializer=init_worker,
+                initargs=(buffer, to_path, dtype, shape, loader))
+    args = zip(range(1, len(paths)), paths[1:])
+    for i, t in pool.imap_unordered(load_one, args):
+        times[i] = t
+    pool.close()
+    pool.join()
+
+    print("Decoded {0} volumes with {1:.2f}s in total, "
+          "{2:.2f}s on average, {3:.2f}s at most".format(
+              len(paths), np.sum(times), np.mean(times), np.max(times)))
+    return x, times
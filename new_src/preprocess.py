@@ -1,9 +1,12 @@
 from __future__ import print_function
 
 import os
+import shlex
+import subprocess
 import numpy as np
 import nibabel as nib
 from scipy.signal import medfilt
+from artifact_store import ArtifactStore
 from multiprocessing import Pool, cpu_count
 from scipy.ndimage.morphology import (binary_erosion, generate_binary_structure)
 from nipype.interfaces.ants.segmentation import N4BiasFieldCorrection
@@ -31,14 +34,40 @@ def save_nii(data, path):
 # Processing Step 1: N4 Bias Field Correction #
 # ------------------------------------------- #
 
+N4_PARAS = {"dimension": 3,
+            "n_iterations": [100, 100, 60, 40],
+            "shrink_factor": 3,
+            "convergence_threshold": 1e-4,
+            "bspline_fitting_distance": 300}
+
+# Each N4 job runs N4_THREADS ITK threads, jobs x threads <= cpus.
+# BTC_N4 replaces the N4BiasFieldCorrection executable, such as
+# a stand-in script in tests.
+N4_THREADS = 4
+ITK_THREADS_ENV = "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"
+N4_COMMAND_ENV = "BTC_N4"
+
+
+def n4_schedule(cpus=None):
+    # Number of concurrent N4 jobs and ITK threads of each job
+    cpus = cpu_count() if cpus is None else cpus
+    jobs = max(cpus // N4_THREADS, 1)
+    return jobs, max(cpus // jobs, 1)
+
+
 def unwarp_bias_field_correction(arg, **kwarg):
     return bias_field_correction(*arg, **kwarg)
 
 
-def bias_field_correction(in_subj_dir, out_subj_dir):
+def bias_field_correction(in_subj_dir, out_subj_dir, threads=1):
     print("N4ITK on: ", in_subj_dir)
     create_dir(out_subj_dir)
 
+    env = dict(os.environ)
+    env[ITK_THREADS_ENV] = str(threads)
+    command = os.environ.get(N4_COMMAND_ENV)
+
+    errors = []
     for scan_name in os.listdir(in_subj_dir):
 
         if "mask" in scan_name:
@@ -47,18 +76,33 @@ def bias_field_correction(in_subj_dir, out_subj_dir):
         in_path = os.path.join(in_subj_dir, scan_name)
         out_path = os.path.join(out_subj_dir, scan_name)
         try:
-            n4 = N4BiasFieldCorrection()
+            if command:
+                n4 = N4BiasFieldCorrection(command=command)
+            else:
+                n4 = N4BiasFieldCorrection()
             n4.inputs.input_image = in_path
             n4.inputs.output_image = out_path
 
-            n4.inputs.dimension = 3
-            n4.inputs.n_iterations = [100, 100, 60, 40]
-            n4.inputs.shrink_factor = 3
-            n4.inputs.convergence_threshold = 1e-4
-            n4.inputs.bspline_fitting_distance = 300
-            n4.run()
-        except RuntimeError:
+            n4.inputs.dimension = N4_PARAS["dimension"]
+            n4.inputs.n_iterations = N4_PARAS["n_iterations"]
+            n4.inputs.shrink_factor = N4_PARAS["shrink_factor"]
+            n4.inputs.convergence_threshold = N4_PARAS["convergence_threshold"]
+            n4.inputs.bspline_fitting_distance = N4_PARAS["bspline_fitting_distance"]
+
+            process = subprocess.Popen(shlex.split(n4.cmdline),
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, env=env)
+            log = process.communicate()[0].decode("utf-8", "replace")
+            if process.returncode != 0:
+                raise RuntimeError("exited with status {0}\n{1}".format(
+                    process.returncode, log[-2000:]))
+        except RuntimeError as e:
             print("\tFailed on: ", in_path)
+            errors.append(in_path + ": " + str(e))
+
+    # Exit status of failed scans is recorded by the store
+    if len(errors) > 0:
+        raise RuntimeError("\n".join(errors))
 
     return
 
@@ -125,61 +169,77 @@ def preprocess(in_subj_dir, out_subj_dir, kernel_size=3,
 # Implementations #
 # --------------- #
 
-# Current working directory
-cwd = os.getcwd()
+if __name__ == "__main__":
+
+    # Current working directory
+    cwd = os.getcwd()
+
+    # Outputs which have been computed are skipped in re-runs
+    store = ArtifactStore(os.path.join(cwd, "PrepStore"))
 
 
-# --------------------------------------------------- #
-# Step 1: Implementations of N4 Bias Field Correction #
-# --------------------------------------------------- #
+    # --------------------------------------------------- #
+    # Step 1: Implementations of N4 Bias Field Correction #
+    # --------------------------------------------------- #
 
-print("\nStep 1: N4 Bias Field Correction\n")
+    print("\nStep 1: N4 Bias Field Correction\n")
 
-n4bfc_input_dir = os.path.join(cwd, "FlairT1ceBrain")
-n4bfc_output_dir = os.path.join(cwd, "FlairT1ceN4BFC")
+    n4bfc_input_dir = os.path.join(cwd, "FlairT1ceBrain")
+    n4bfc_output_dir = os.path.join(cwd, "FlairT1ceN4BFC")
 
-subjects = os.listdir(n4bfc_input_dir)
-subj_num = len(subjects)
+    subjects = os.listdir(n4bfc_input_dir)
+    subj_num = len(subjects)
 
-input_subj_dirs = [os.path.join(n4bfc_input_dir, subj) for subj in subjects]
-output_subj_dirs = [os.path.join(n4bfc_output_dir, subj) for subj in subjects]
+    input_subj_dirs = [os.path.join(n4bfc_input_dir, subj) for subj in subjects]
+    output_subj_dirs = [os.path.join(n4bfc_output_dir, subj) for subj in subjects]
 
-# Test
-# bias_field_correction(input_subj_dirs[0], output_subj_dirs[0])
+    # Test
+    # bias_field_correction(input_subj_dirs[0], output_subj_dirs[0])
 
-# Multi-processing
-paras = zip(input_subj_dirs, output_subj_dirs)
-pool = Pool(processes=cpu_count())
-# pool.map(unwarp_bias_field_correction, paras)
+    # Multi-processing, largest subjects first
+    n4_jobs, n4_threads = n4_schedule()
+    jobs, sizes = [], {}
+    for subj, in_dir, out_dir in zip(subjects, input_subj_dirs, output_subj_dirs):
+        scans = [s for s in os.listdir(in_dir) if "mask" not in s]
+        jobs.append(store.job(subj, bias_field_correction, [in_dir, out_dir, n4_threads],
+                              inputs=[os.path.join(in_dir, s) for s in scans],
+                              outputs=[os.path.join(out_dir, s) for s in scans],
+                              paras=N4_PARAS))
+        sizes[subj] = sum([os.path.getsize(os.path.join(in_dir, s)) for s in scans])
+    jobs.sort(key=lambda job: -sizes[job["name"]])
+    # store.run("N4BiasFieldCorrection", jobs, processes=n4_jobs)
 
 
-# ---------------------------------------------- #
-# Step 2: Implementations of Denoise and Enahnce #
-# ---------------------------------------------- #
+    # ---------------------------------------------- #
+    # Step 2: Implementations of Denoise and Enahnce #
+    # ---------------------------------------------- #
 
-print("\nStep 1: Denoise and Enahnce\n")
+    print("\nStep 1: Denoise and Enahnce\n")
 
-prep_input_dir = n4bfc_output_dir
-prep_output_dir = os.path.join(cwd, "FlairT1cePrep")
+    prep_input_dir = n4bfc_output_dir
+    prep_output_dir = os.path.join(cwd, "FlairT1cePrep")
 
-subjects = os.listdir(prep_input_dir)
-subj_num = len(subjects)
+    subjects = os.listdir(prep_input_dir)
+    subj_num = len(subjects)
 
-input_subj_dirs = [os.path.join(prep_input_dir, subj) for subj in subjects]
-output_subj_dirs = [os.path.join(prep_output_dir, subj) for subj in subjects]
+    input_subj_dirs = [os.path.join(prep_input_dir, subj) for subj in subjects]
+    output_subj_dirs = [os.path.join(prep_output_dir, subj) for subj in subjects]
 
-kernel_size = 5
-percentils = [0.5, 99.5]
-bins_num = 1024
+    kernel_size = 5
+    percentils = [0.5, 99.5]
+    bins_num = 1024
 
-# Test
-# preprocess(input_subj_dirs[0], output_subj_dirs[0],
-#            kernel_size, percentils, bins_num)
+    # Test
+    # preprocess(input_subj_dirs[0], output_subj_dirs[0],
+    #            kernel_size, percentils, bins_num)
 
-# Multi-processing
-paras = zip(input_subj_dirs, output_subj_dirs,
-            [kernel_size] * subj_num,
-            [percentils] * subj_num,
-            [bins_num] * subj_num)
-pool = Pool(processes=cpu_count())
-pool.map(unwarp_preprocess, paras)
+    # Multi-processing
+    jobs = []
+    for subj, in_dir, out_dir in zip(subjects, input_subj_dirs, output_subj_dirs):
+        scans = os.listdir(in_dir)
+        jobs.append(store.job(subj, preprocess,
+                              [in_dir, out_dir, kernel_size, percentils, bins_num],
+                              inputs=[os.path.join(in_dir, s) for s in scans],
+                              outputs=[os.path.join(out_dir, s) for s in scans],
+                              paras=[kernel_size, percentils, bins_num]))
+    store.run("DenoiseEnhance", jobs)
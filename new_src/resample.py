@@ -0,0 +1,140 @@
+import os
+import numpy as np
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from scipy.ndimage import zoom, affine_transform
+
+
+# Resampling as scipy.ndimage.zoom (same output shape, corners of
+# both grids are aligned) in a pool of threads, so one large volume
+# is resampled by several cores. The output is split into chunks
+# along the first axis, not channels, since splines of order > 1
+# in zoom also span channels.
+#
+# order=1, prefilter=False: separable linear interpolation in float32.
+# Other orders: each chunk is interpolated by scipy from a slab of
+# input overlapping its neighbours by the support of the spline.
+# With prefilter, the spline filter is global, zoom in one thread.
+#
+# Outputs equal to zoom in mirror mode, which is the same as its
+# default constant mode inside the input, except that constant mode
+# may fill the last row with zero due to rounding of coordinates.
+
+# The maximum rows of output in one chunk, which bounds the
+# memory of intermediates to a small part of the volume
+CHUNK_ROWS = 16
+
+# Thread pools created in this process, by the number of threads
+_POOLS = {}
+
+
+def _thread_pool(threads):
+    key = (os.getpid(), threads)
+    if key not in _POOLS:
+        _POOLS[key] = ThreadPool(processes=threads)
+    return _POOLS[key]
+
+
+def pool_threads(tasks, processes=-1):
+    # Threads of resample in each process of a pool which runs tasks,
+    # busy processes x threads is no more than the number of cpus,
+    # processes is -1 for a pool of all cpus
+    if processes == -1 or processes > cpu_count():
+        processes = cpu_count()
+    return max(cpu_count() // max(min(processes, tasks), 1), 1)
+
+
+def zoom_shape(shape, factor):
+    # Output shape of scipy.ndimage.zoom
+    return [int(round(s * f)) for s, f in zip(shape, factor)]
+
+
+def _scales(in_shape, out_shape):
+    # Output index i along each axis is sampled at i * scale of input
+    return [(i - 1) / float(o - 1) if o > 1 else 1.0
+            for i, o in zip(in_shape, out_shape)]
+
+
+def _linear(array, axis, coords):
+    # Linear interpolation at coords in [0, size - 1] along axis
+    size = array.shape[axis]
+    low = np.clip(np.floor(coords).astype(np.intp), 0, max(size - 2, 0))
+    high = np.minimum(low + 1, size - 1)
+
+    shape = [1] * array.ndim
+    shape[axis] = -1
+    weight = (coords - low).astype(np.float32).reshape(shape)
+
+    # Both are new arrays, interpolate in place
+    lower = np.take(array, low, axis=axis).astype(np.float32, copy=False)
+    upper = np.take(array, high, axis=axis).astype(np.float32, copy=False)
+    lower *= 1 - weight
+    upper *= weight
+    lower += upper
+    return lower
+
+
+def _linear_chunk(volume, out_shape, scales, begin, end):
+    # Rows [begin, end) of output, the first axis is interpolated
+    # first to read only rows of this chunk
+    chunk = _linear(volume, 0, np.arange(begin, end) * scales[0])
+    for axis in range(1, volume.ndim):
+        if out_shape[axis] != volume.shape[axis]:
+            coords = np.arange(out_shape[axis]) * scales[axis]
+            chunk = _linear(chunk, axis, coords)
+    return chunk
+
+
+def _spline_chunk(volume, out_shape, scales, begin, end, order):
+    # Rows [begin, end) of output from the slab of input which
+    # covers the support of splines at these rows
+    margin = order + 1
+    first = max(int(np.floor(begin * scales[0])) - margin, 0)
+    last = min(int(np.floor((end - 1) * scales[0])) + margin + 1, volume.shape[0])
+
+    # Mirror mode, since rounding of the offset may move the
+    # last row of input out of the slab by a tiny distance
+    offset = [begin * scales[0] - first] + [0.0] * (volume.ndim - 1)
+    return affine_transform(volume[first:last], scales, offset=offset,
+                            output_shape=[end - begin] + list(out_shape[1:]),
+                            output=np.float32, order=order, prefilter=False,
+                            mode="mirror")
+
+
+def resample(volume, factor, order=1, prefilter=False,
+             output=np.float32, threads=None):
+    # Resample volume by factor as zoom, values are rounded if output
+    # is an integer type, threads is all cores by default
+    out_shape = zoom_shape(volume.shape, factor)
+    output = np.dtype(output)
+
+    if prefilter and order > 1:
+        return zoom(volume, zoom=factor, order=order,
+                    prefilter=True, output=output)
+
+    scales = _scales(volume.shape, out_shape)
+    resampled = np.empty(out_shape, dtype=np.float32)
+
+    def resample_chunk(rows):
+        begin, end = rows
+        if order == 1:
+            chunk = _linear_chunk(volume, out_shape, scales, begin, end)
+        else:
+            chunk = _spline_chunk(volume, out_shape, scales, begin, end, order)
+        resampled[begin:end] = chunk
+
+    threads = cpu_count() if threads is None else threads
+    num = max(threads, int(np.ceil(out_shape[0] / float(CHUNK_ROWS))))
+    bounds = np.linspace(0, out_shape[0], min(num, out_shape[0]) + 1)
+    bounds = np.round(bounds).astype(int)
+    chunks = list(zip(bounds[:-1], bounds[1:]))
+
+    if len(chunks) > 1 and threads > 1:
+        _thread_pool(threads).map(resample_chunk, chunks)
+    else:
+        list(map(resample_chunk, chunks))
+
+    if output.kind in "iu":
+        # Round half away from zero as zoom
+        resampled = np.trunc(resampled + np.copysign(0.5, resampled))
+    return resampled.astype(output, copy=False)
@@ -0,0 +1,70 @@
+import numpy as np
+from augment_ops import flip
+from keras.utils import Sequence
+
+
+# Feed training batches without copying the training set.
+# LGG samples (label 0) are flipped with augment_ops.flip while
+# a batch is assembled instead of being appended to the array.
+#
+# sampling: None, each sample once per epoch;
+#           "duplicate", LGG samples appear once more flipped;
+#           "balanced", each epoch draws samples with weights
+#           inverse to class frequency, LGG samples are flipped
+#           at random.
+
+
+class VolumeSequence(Sequence):
+
+    def __init__(self, x, y, batch_size, index=None,
+                 sampling="duplicate", shuffle=True, random_state=None):
+        self.x = x
+        self.y = y
+        self.batch_size = batch_size
+        self.sampling = sampling
+        self.shuffle = shuffle
+        self.rng = np.random.RandomState(random_state)
+
+        # Only use samples in index, such as one fold of x
+        self.index = np.arange(len(y)) if index is None else np.asarray(index)
+        self.labels = np.argmax(self.y[self.index], axis=1)
+        self._set_samples()
+
+    def _set_samples(self):
+        is_lgg = self.labels == 0
+
+        if self.sampling == "duplicate":
+            samples = np.concatenate([self.index, self.index[is_lgg]])
+            flips = np.concatenate([np.zeros(len(self.index), dtype=bool),
+                                    np.ones(np.sum(is_lgg), dtype=bool)])
+        elif self.sampling == "balanced":
+            counts = np.bincount(self.labels)
+            weights = 1.0 / counts[self.labels]
+            pos = self.rng.choice(len(self.index), size=len(self.index),
+                                  p=weights / np.sum(weights))
+            samples = self.index[pos]
+            flips = np.logical_and(is_lgg[pos],
+                                   self.rng.rand(len(pos)) < 0.5)
+        else:
+            samples = self.index
+            flips = np.zeros(len(self.index), dtype=bool)
+
+        if self.shuffle:
+            order = self.rng.permutation(len(samples))
+            samples, flips = samples[order], flips[order]
+
+        self.samples, self.flips = samples, flips
+
+    def __len__(self):
+        return int(np.ceil(len(self.samples) / float(self.batch_size)))
+
+    def __getitem__(self, idx):
+        batch = slice(idx * self.batch_size, (idx + 1) * self.batch_size)
+        samples, flips = self.samples[batch], self.flips[batch]
+
+        batch_x = flip(self.x, 1, flips, samples)
+        return batch_x, self.y[samples]
+
+    def on_epoch_end(self):
+        if self.shuffle or self.sampling == "balanced":
+            self._set_samples()
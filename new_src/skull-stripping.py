@@ -5,6 +5,7 @@ import shutil
 import subprocess
 import numpy as np
 import nibabel as nib
+from artifact_store import ArtifactStore
 from multiprocessing import Pool, cpu_count
 from scipy.ndimage.morphology import binary_fill_holes
 
@@ -27,6 +28,12 @@ def save_nii(data, path):
     return
 
 
+def subj_files(subj_dir, names=None):
+    if names is None:
+        names = os.listdir(subj_dir)
+    return [os.path.join(subj_dir, name) for name in names]
+
+
 def mask(in_path, out_path, mask_path):
     in_volume = load_nii(in_path)
     mask_volume = binary_fill_holes(load_nii(mask_path))
@@ -209,6 +216,9 @@ subj_num = len(subjects)
 # Generate the paths of input directory
 input_subj_dirs = [os.path.join(input_dir, subj) for subj in subjects]
 
+# Outputs which have been computed are skipped in re-runs
+store = ArtifactStore(os.path.join(cwd, "SkullStrippingStore"))
+
 
 # --------------------------------------------- #
 # Implementation of Method 1 - Apply Brain Mask #
@@ -227,9 +237,11 @@ temp_output_subj_dirs = [os.path.join(temp_output_dir, subj) for subj in subject
 # strip_skull_mask(input_subj_dirs[0], temp_output_subj_dirs[0], mask_path)
 
 # Multi-processing
-paras = zip(input_subj_dirs, temp_output_subj_dirs, [mask_path] * subj_num)
-pool = Pool(processes=cpu_count())
-# pool.map(unwarp_strip_skull_mask, paras)
+jobs = [store.job(subj, strip_skull_mask, [in_dir, out_dir, mask_path],
+                  inputs=subj_files(in_dir) + [mask_path],
+                  outputs=subj_files(out_dir, os.listdir(in_dir) + ["mask.nii.gz"]))
+        for subj, in_dir, out_dir in zip(subjects, input_subj_dirs, temp_output_subj_dirs)]
+# store.run("TempMask", jobs)
 
 
 # -------------------------------------- #
@@ -246,9 +258,13 @@ bet_output_subj_dirs = [os.path.join(bet_output_dir, subj) for subj in subjects]
 # strip_skull_bet(input_subj_dirs[0], bet_output_subj_dirs[0])
 
 # Multi-processing
-paras = zip(input_subj_dirs, bet_output_subj_dirs)
-pool = Pool(processes=cpu_count())
-# pool.map(unwarp_strip_skull_bet, paras)
+jobs = [store.job(subj, strip_skull_bet, [in_dir, out_dir],
+                  inputs=subj_files(in_dir, ["flair.nii.gz", "t1ce.nii.gz"]),
+                  outputs=subj_files(out_dir, ["flair.nii.gz", "t1ce.nii.gz",
+                                               "bet_mask.nii.gz"]),
+                  paras=["flair", "0.5", "0.0"])
+        for subj, in_dir, out_dir in zip(subjects, input_subj_dirs, bet_output_subj_dirs)]
+# store.run("BetMask", jobs)
 
 
 # --------------------------------------- #
@@ -270,9 +286,13 @@ ants_output_subj_dirs = [os.path.join(ants_output_dir, subj) for subj in subject
 # strip_skull_ants(input_subj_dirs[0], ants_output_subj_dirs[0], templates, "flair")
 
 # Multi-processing
-paras = zip(input_subj_dirs, ants_output_subj_dirs, [templates] * subj_num)
-pool = Pool(processes=cpu_count())
-# pool.map(unwarp_strip_skull_ants, paras)
+jobs = [store.job(subj, strip_skull_ants, [in_dir, out_dir, templates],
+                  inputs=subj_files(in_dir, ["flair.nii.gz", "t1ce.nii.gz"]) + templates,
+                  outputs=subj_files(out_dir, ["flair.nii.gz", "t1ce.nii.gz",
+                                               "ants_mask.nii.gz"]),
+                  paras="flair")
+        for subj, in_dir, out_dir in zip(subjects, input_subj_dirs, ants_output_subj_dirs)]
+# store.run("AntsMask", jobs)
 
 
 # ----------------------------- #
@@ -300,8 +320,12 @@ threshold = 3
 #             weights, threshold)
 
 # Multi-processing
-paras = zip(input_subj_dirs, output_subj_dirs,
-            temp_mask_paths, bet_mask_paths, ants_mask_paths,
-            [weights] * subj_num, [threshold] * subj_num)
-pool = Pool(processes=cpu_count())
-pool.map(unwarp_mask_fusion, paras)
+paras = zip(subjects, input_subj_dirs, output_subj_dirs,
+            temp_mask_paths, bet_mask_paths, ants_mask_paths)
+jobs = [store.job(subj, mask_fusion,
+                  [in_dir, out_dir, temp_mask, bet_mask, ants_mask, weights, threshold],
+                  inputs=subj_files(in_dir) + [temp_mask, bet_mask, ants_mask],
+                  outputs=subj_files(out_dir, os.listdir(in_dir) + ["brain_mask.nii.gz"]),
+                  paras=[weights, threshold])
+        for subj, in_dir, out_dir, temp_mask, bet_mask, ants_mask in paras]
+store.run("MaskFusion", jobs)
@@ -3,8 +3,9 @@ import scipy.misc
 import numpy as np
 from tqdm import *
 import nibabel as nib
+from geometry import bbox, square
 import matplotlib.pyplot as plt
-from scipy.ndimage.interpolation import zoom
+from resample import resample
 
 
 def create_dir(path):
@@ -27,31 +28,13 @@ def plot_slices(slices):
 
 
 def trim(volume):
-    none_zero_idx = np.where(volume > 0)
-
-    min_i, max_i = np.min(none_zero_idx[0]), np.max(none_zero_idx[0])
-    min_j, max_j = np.min(none_zero_idx[1]), np.max(none_zero_idx[1])
-
-    diff_i = max_i - min_i
-    diff_j = max_j - min_j
-
-    if diff_i > diff_j:
-        diff = diff_i - diff_j
-        half_diff = diff // 2
-        min_j -= half_diff
-        max_j += (diff - half_diff)
-    elif diff_i < diff_j:
-        diff = diff_j - diff_i
-        half_diff = diff // 2
-        min_i -= half_diff
-        max_i += (diff - half_diff)
-
-    return min_i, max_i, min_j, max_j
+    (min_i, max_i), (min_j, max_j) = square(bbox(volume, [0, 1]))
+    return min_i, max_i - 1, min_j, max_j - 1
 
 
 def rescale(in_slice, target_shape=[224, 224]):
     factors = [t / s for s, t in zip(in_slice.shape, target_shape)]
-    resized = zoom(in_slice, zoom=factors, order=1, prefilter=False)
+    resized = resample(in_slice, factors, order=1, output=in_slice.dtype, threads=1)
     return resized
 
 
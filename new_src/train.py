@@ -8,7 +8,11 @@ from tqdm import *
 from models import *
 import pandas as pd
 import nibabel as nib
+from functools import partial
 from random import seed, shuffle
+from sampler import VolumeSequence
+from volume_cache import load_cached
+from parallel_load import load_volumes
 
 from keras.layers import *
 from keras.callbacks import CSVLogger
@@ -33,6 +37,12 @@ BATCH_SIZE = 8
 EPOCHS_NUM = 60
 SPLITS_NUM = 4
 
+# Parameters of load_volume, part of the cache key
+VOLUME_PARAS = {"orientation": "rot90-3",
+                "normalization": "foreground-zscore",
+                "shape": VOLUME_SIZE,
+                "dtype": "float32"}
+
 
 def get_data_path(dir_path, volume_type, label, SEED):
     subjects = os.listdir(dir_path)
@@ -74,22 +84,23 @@ def save_to_csv(subjects, csv_path):
     return
 
 
-def load_data(info, mode):
-    x, y = [], []
+def load_volume(volume_path):
+    volume = nib.load(volume_path).get_data()
+    volume = np.rot90(volume, 3)
+    volume_obj = volume[volume > 0]
+    volume = (volume - np.mean(volume_obj)) / np.std(volume_obj)
+    # volume = volume / np.max(volume_obj) - 0.5
+    volume = np.reshape(volume, VOLUME_SIZE)
+    return volume.astype(np.float32)
+
+
+def load_data(info, mode, cache_dir=None, processes=-1):
     print("Loading {} data ...".format(mode))
-    for subject in info:
-        volume_path, label = subject[0], subject[1]
-        volume = nib.load(volume_path).get_data()
-        volume = np.rot90(volume, 3)
-        volume_obj = volume[volume > 0]
-        volume = (volume - np.mean(volume_obj)) / np.std(volume_obj)
-        # volume = volume / np.max(volume_obj) - 0.5
-        volume = np.reshape(volume, VOLUME_SIZE)
-        x.append(volume.astype(np.float32))
-        y.append(label)
-
-    x = np.array(x)
-    y = np.array(y).reshape((-1, 1))
+    paths = [subject[0] for subject in info]
+    loader = partial(load_cached, loader=load_volume,
+                     paras=VOLUME_PARAS, cache_dir=cache_dir)
+    x, _ = load_volumes(paths, loader, processes)
+    y = np.array([subject[1] for subject in info]).reshape((-1, 1))
 
     return x, y
 
@@ -202,32 +213,16 @@ def test(SEED, x, y,
     return
 
 
-def augment(x_train, y_train):
-    print("Do Augmentation on LGG Samples ...")
-    aug_x_train, aug_y_train = [], []
-    for i in range(len(y_train)):
-        aug_x_train.append(x_train[i])
-        aug_y_train.append(y_train[i])
-        if y_train[i] == 0:
-            aug_x_train.append(np.fliplr(x_train[i]))
-            aug_y_train.append(np.array([0]))
-    x_train = np.array(aug_x_train)
-    y_train = np.array(aug_y_train).reshape((-1, 1))
-
-    return x_train, y_train
-
-
 def train(trainset_info, validset_info, testset_info,
-          paras, models_dir, logs_dir, test_logs_dir):
+          paras, models_dir, logs_dir, test_logs_dir, cache_dir=None):
     # Load dataset
-    x_test, y_test = load_data(testset_info, "testset")
+    x_test, y_test = load_data(testset_info, "testset", cache_dir)
     y_test_category = to_categorical(y_test, num_classes=2)
 
-    x_valid, y_valid = load_data(validset_info, "validset")
+    x_valid, y_valid = load_data(validset_info, "validset", cache_dir)
     y_valid_category = to_categorical(y_valid, num_classes=2)
 
-    x_train, y_train = load_data(trainset_info, "trainset")
-    x_train, y_train = augment(x_train, y_train)
+    x_train, y_train = load_data(trainset_info, "trainset", cache_dir)
     y_train_category = to_categorical(y_train, num_classes=2)
 
     # Load parameters
@@ -241,6 +236,8 @@ def train(trainset_info, validset_info, testset_info,
     bn_momentum = paras["bn_momentum"]
     initializer = paras["initializer"]
     drop_rate = paras["drop_rate"]
+    # "duplicate" or "balanced", see sampler.py
+    sampling = paras.get("sampling", "duplicate")
 
     global epochs_num, lr_start, lr_end
     epochs_num = paras["epochs_num"]
@@ -286,16 +283,18 @@ def train(trainset_info, validset_info, testset_info,
     tb = TensorBoard(log_dir=log_dir, batch_size=batch_size)
     callbacks = [checkpoint, lr_scheduler, csv_logger, tb]
 
-    model.fit(x_train, y_train_category,
-              batch_size=batch_size,
-              epochs=epochs_num,
-              validation_data=(x_valid, y_valid_category),
-              shuffle=True,
-              callbacks=callbacks)
+    # LGG samples are augmented while batches are assembled
+    train_seq = VolumeSequence(x_train, y_train_category, batch_size,
+                               sampling=sampling, random_state=SEED)
+    model.fit_generator(train_seq,
+                        epochs=epochs_num,
+                        validation_data=(x_valid, y_valid_category),
+                        shuffle=False,
+                        callbacks=callbacks)
 
     model.save(last_model_path)
     # score[0]: loss, score[1]: accuracy
-    train_score = model.evaluate(x_train, y_train_category, batch_size=batch_size, verbose=0)
+    train_score = model.evaluate_generator(train_seq)
     valid_score = model.evaluate(x_valid, y_valid_category, batch_size=batch_size, verbose=0)
     test_score = model.evaluate(x_test, y_test_category, batch_size=batch_size, verbose=0)
 
@@ -326,6 +325,10 @@ if __name__ == "__main__":
     parser.add_argument("--model", action="store", default="model0",
                         dest="model", help=model_help_str)
 
+    cache_help_str = "Directory to cache normalized volumes."
+    parser.add_argument("--cache", action="store", default=None,
+                        dest="cache", help=cache_help_str)
+
     args = parser.parse_args()
     model = args.model
 
@@ -366,4 +369,4 @@ if __name__ == "__main__":
     test_logs_dir = os.path.join(parent_dir, "test_logs")
 
     train(trainset_info, validset_info, testset_info,
-          paras, models_dir, logs_dir, test_logs_dir)
+          paras, models_dir, logs_dir, test_logs_dir, args.cache)
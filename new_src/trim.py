@@ -4,8 +4,10 @@ from multiprocessing import Pool, cpu_count
 
 import numpy as np
 import nibabel as nib
+from geometry import square_crop
+from artifact_store import ArtifactStore
 import matplotlib.pyplot as plt
-from scipy.ndimage.interpolation import zoom
+from resample import resample, pool_threads
 
 
 # Ignore the warning caused by SciPy
@@ -49,41 +51,15 @@ def segment(in_path, seg_path):
 
 
 def trim(volume):
-    non_zero_slices = [i for i in range(volume.shape[-1]) if np.sum(volume[..., i]) > 0]
-    volume = volume[..., non_zero_slices]
-
-    row_begins, row_ends = [], []
-    col_begins, col_ends = [], []
-    for i in range(volume.shape[-1]):
-        non_zero_pixels = np.where(volume > 0)
-        row_begins.append(np.min(non_zero_pixels[0]))
-        row_ends.append(np.max(non_zero_pixels[0]))
-        col_begins.append(np.min(non_zero_pixels[1]))
-        col_ends.append(np.max(non_zero_pixels[1]))
-
-    row_begin, row_end = min(row_begins), max(row_ends)
-    col_begin, col_end = min(col_begins), max(col_ends)
-
-    rows_num = row_end - row_begin
-    cols_num = col_end - col_begin
-    more_col_len = rows_num - cols_num
-    more_col_len_left = more_col_len // 2
-    more_col_len_right = more_col_len - more_col_len_left
-    col_begin -= more_col_len_left
-    col_end += more_col_len_right
-    len_of_side = rows_num + 1
-
-    trimmed = np.zeros([len_of_side, len_of_side, volume.shape[-1]])
-    for i in range(volume.shape[-1]):
-        trimmed[..., i] = volume[row_begin:row_end + 1,
-                                 col_begin:col_end + 1, i]
-    return trimmed
-
-
-def resize(trimmed, target_shape):
+    # A view of volume, no copy
+    return square_crop(volume)
+
+
+def resize(trimmed, target_shape, threads=None):
     old_shape = list(trimmed.shape)
     factor = [n / float(o) for n, o in zip(target_shape, old_shape)]
-    resized = zoom(trimmed, zoom=factor, order=1, prefilter=False)
+    resized = resample(trimmed, factor, order=1, output=np.float32,
+                       threads=threads)
     # plot_middle_two(trimmed, resized)
     return resized
 
@@ -100,12 +76,12 @@ def unwrap_rescale(arg, **kwarg):
     return rescale(*arg, **kwarg)
 
 
-def rescale(target_shape, in_path, to_path, seg_path):
+def rescale(target_shape, in_path, to_path, seg_path, threads=None):
     try:
         print("Rescaling on: " + in_path)
         segged = segment(in_path, seg_path)
         trimmed = trim(segged)
-        resized = resize(trimmed, target_shape)
+        resized = resize(trimmed, target_shape, threads)
         save2nii(to_path, resized)
     except:
         print("  Failed to rescal:" + in_path)
@@ -167,7 +143,12 @@ if __name__ == "__main__":
     seg_paths = hgg_seg_paths + lgg_seg_paths
 
     # rescale(target_shape, in_paths[0], out_paths[0], seg_paths[0])
-    paras = zip([target_shape] * len(in_paths),
-                in_paths, out_paths, seg_paths)
-    pool = Pool(processes=cpu_count())
-    pool.map(unwrap_rescale, paras)
+    store = ArtifactStore(os.path.join(parent_dir, "data", "Original",
+                                       "BraTS", "TrimmedStore"))
+    threads = pool_threads(len(in_paths))
+    jobs = [store.job(in_path, rescale,
+                      [target_shape, in_path, out_path, seg_path, threads],
+                      inputs=[in_path, seg_path], outputs=[out_path],
+                      paras=target_shape)
+            for in_path, out_path, seg_path in zip(in_paths, out_paths, seg_paths)]
+    store.run("Trim", jobs)
@@ -0,0 +1,92 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+
+# On-disk cache of loaded and normalized volumes, one .npy file
+# per entry, keyed by source path, mtime, size and loading parameters.
+# Entries are reopened with mmap_mode="r", the least recently used
+# ones are removed once the cache is larger than max_size_gb.
+# The total size is tracked in memory of each process, and the
+# directory is listed only while evicting, at least once every
+# EVICT_INTERVAL writes since other processes write to it too.
+
+EVICT_INTERVAL = 16
+
+# [size, writes] of each cache directory in this process
+_SIZES = {}
+
+
+def cache_key(path, paras=None):
+    stat = os.stat(path)
+    info = json.dumps([os.path.abspath(path), stat.st_mtime,
+                       stat.st_size, paras], sort_keys=True)
+    return hashlib.sha1(info.encode("utf-8")).hexdigest()
+
+
+def evict(cache_dir, max_size_gb=20):
+    # Remove least recently used entries, return the total size
+    entries = []
+    for name in os.listdir(cache_dir):
+        if not name.endswith(".npy"):
+            continue
+        entry_path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(entry_path)
+        except OSError:
+            continue
+        entries.append([stat.st_mtime, stat.st_size, entry_path])
+
+    entries.sort()
+    max_size = int(max_size_gb * 1024 ** 3)
+    total_size = sum([e[1] for e in entries])
+    # Always keep the most recent entry
+    for _, size, entry_path in entries[:-1]:
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(entry_path)
+        except OSError:
+            pass
+        total_size -= size
+    return total_size
+
+
+def load_cached(path, loader, paras=None, cache_dir=None, max_size_gb=20):
+    if cache_dir is None:
+        return loader(path)
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    cache_path = os.path.join(cache_dir, cache_key(path, paras) + ".npy")
+    try:
+        # Touch entry to mark it as recently used, an entry
+        # removed by another process is regarded as a miss
+        os.utime(cache_path, None)
+        return np.load(cache_path, mmap_mode="r")
+    except OSError:
+        pass
+
+    volume = loader(path)
+
+    # Write to a temporary file first so that an interrupted run
+    # or a concurrent reader never sees a partial entry
+    temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, volume)
+    os.rename(temp_path, cache_path)
+
+    # The entry may be evicted by another process at once,
+    # so the loaded volume is returned rather than the file
+    key = (os.getpid(), os.path.abspath(cache_dir))
+    if key not in _SIZES:
+        _SIZES[key] = [evict(cache_dir, max_size_gb), 0]
+    else:
+        state = _SIZES[key]
+        state[0] += volume.nbytes
+        state[1] += 1
+        if state[0] > max_size_gb * 1024 ** 3 or state[1] >= EVICT_INTERVAL:
+            _SIZES[key] = [evict(cache_dir, max_size_gb), 0]
+    return volume
@@ -25,7 +25,9 @@ Class BTCAugment
     (1) Create mirrors of original tumor;
     (2) Slightly modify intensity of mirrors;
     (3) Randomly extract partial patches;
-    (4) Save patches into output folder.
+    (4) Record partial patches in an index file.
+-3- Load partial patches from the index, each patch is loaded
+    once and partial patches are slices of its mirrors.
 
 Pipline of Data Augmentation:
 
@@ -37,7 +39,7 @@ Pipline of Data Augmentation:
             |        |        |       |           Data Augmentation
             ---------------------------
                          |
-                       Done
+             Save Index of All Cases
 
 Details of Augmentation Process:
 
@@ -55,7 +57,15 @@ Details of Augmentation Process:
     |           |        |           |        |           |        |           |
  Partial ... Partial  Partial ... Partial  Partial ... Partial  Partial ... Partial
     |           |        |           |        |           |        |           |
-  Save        Save     Save         Save     Save        Save     Save        Save
+ Record      Record   Record      Record   Record      Record   Record      Record
+
+Each record of the index has the case, the name of partial patch,
+the path of original patch, the type of mirror and the first index
+of partial patch. Use load_partials to obtain partial patches:
+
+    index = pd.read_csv(os.path.join(output_dir, AUGMENT_INDEX_FILE))
+    for name, partial in load_partials(index, case_no):
+        ...
 
 '''
 
@@ -66,13 +76,54 @@ import os
 import numpy as np
 import pandas as pd
 from btc_settings import *
+from btc_trace import trace
+from btc_augment_ops import mirror, crop
 from multiprocessing import Pool, cpu_count
 
 
 # Helper function to do multiprocessing of
 # BTCAugment._augment_data
 def unwrap_augment_data(arg, **kwarg):
-    return BTCAugment._augment_data(*arg, **kwarg)
+    with trace("augment_data", arg[1]):
+        return BTCAugment._augment_data(*arg, **kwarg)
+
+
+def load_partials(index, case_no):
+    '''LOAD_PARTIALS
+
+        Generate partial patches of one case recorded in the index.
+        Each original patch is loaded only once, and all partial
+        patches of it are cropped from its mirrors in one batch.
+
+        Inputs:
+        -------
+        - index: DataFrame read from AUGMENT_INDEX_FILE
+        - case_no: the serial number of a case
+
+        Outputs:
+        --------
+        - name: the name of partial patch
+        - partial: the partial patch
+
+    '''
+
+    records = index[index[CASE_NO] == case_no]
+    for patch_path, patch_records in records.groupby(INDEX_PATCH, sort=False):
+        with trace("load", reads=[patch_path]):
+            volume = np.load(patch_path)
+
+        # Mirror the patch once for each type
+        mirror_types, samples = np.unique(patch_records[INDEX_MIRROR].values,
+                                          return_inverse=True)
+        mirrors = mirror(np.repeat(volume[None], len(mirror_types), axis=0),
+                         mirror_types)
+
+        partials = crop(mirrors, patch_records[INDEX_BEGIN].values,
+                        PARTIAL_SIZE, samples)
+        for name, partial in zip(patch_records[INDEX_NAME], partials):
+            yield name, partial
+
+    return
 
 
 class BTCAugment():
@@ -91,7 +142,7 @@ class BTCAugment():
             - input_dir: the path of directory which stores
                          tumor and mask patches
             - output_dir: the path of directory that will keep
-                          all outputs
+                          the index file
             - label_file: the path of file which has labels
                           of all cases
 
@@ -150,16 +201,17 @@ class BTCAugment():
             The number of subprocesses equals to the number of cpus.
 
             - Generate paths of all cases.
-            - Map parameters (serial number of case, the folder path of
-              a case's patches and the output folder) to function
+            - Map parameters (serial number of case and the folder
+              path of a case's patches) to function
               BTCAugment._augment_data.
+            - Save records of all cases into the index file.
 
             Inputs:
             -------
             - input_dir: the path of directory which stores
                          tumor and mask patches
             - output_dir: the path of directory that will keep
-                          all outputs
+                          the index file
 
         '''
 
@@ -170,21 +222,24 @@ class BTCAugment():
         print("\nData augmentation for tumor patches\n")
         paras = zip([self] * case_num,
                     self.case_no,
-                    case_paths,
-                    [output_dir] * case_num)
+                    case_paths)
         pool = Pool(processes=cpu_count())
-        pool.map(unwrap_augment_data, paras)
+        records = pool.map(unwrap_augment_data, paras)
+
+        columns = [CASE_NO, INDEX_NAME, INDEX_PATCH, INDEX_MIRROR] + INDEX_BEGIN
+        index = pd.DataFrame(data=sum(records, []), columns=columns)
+        index.to_csv(os.path.join(output_dir, AUGMENT_INDEX_FILE), index=False)
 
         return
 
-    def _augment_data(self, case_no, case_path, output_dir):
+    def _augment_data(self, case_no, case_path):
         '''_AUGMENT_DATA
             The function is used to increase the number of
             patches by those augmentation methods:
             - Create mirrors of original tumor.
             - Slightly modify intensity of mirrors.
             - Randomly extract partial patches.
-            - Save patches into output folder.
+            - Record partial patches.
 
             Settings can be found in btc_settings.py.
 
@@ -193,8 +248,12 @@ class BTCAugment():
             - case_no: the serial number of a case
             - case_path: the path of folder that has patches
                          generated by BTCPatches
-            - output_dir: the path of folder that keeps
-                          outputs patches
+
+            Output:
+            -------
+            - records: list of records of partial patches, each one
+                       is [case_no, name, path of patch, mirror type]
+                       with the first index of the partial patch
 
         '''
 
@@ -240,76 +299,16 @@ class BTCAugment():
 
             return partial_begins, partial_ends
 
-        # The function that is used to extract sub-array from given array
-        def partial_array(arr, begin, end):
-            return arr[begin[0]:end[0],
-                       begin[1]:end[1],
-                       begin[2]:end[2]]
-
-        # Return the horizontal mirror of given volume
-        def horizontal_mirror(volume):
-
-            temp = np.copy(volume)
-            for i in range(temp.shape[2]):
-                temp[:, :, i] = np.fliplr(temp[:, :, i])
-
-            return temp
-
-        # Return the vertical mirror of given volume
-        def vertical_mirror(volume):
-
-            temp = np.copy(volume)
-            for i in range(temp.shape[2]):
-                temp[:, :, i] = np.flipud(temp[:, :, i])
-
-            return temp
-
-        # Return axisymmtric mirror of given volume
-        def axisymmetric_mirror(volume):
-
-            temp = np.copy(volume)
-            temp = horizontal_mirror(temp)
-            temp = vertical_mirror(temp)
-
-            return temp
-
-        # Slightly modify intensity of given volume.
-        # The scope of modification can be set in btc_settings.py.
-        def modify_intensity(volume):
-
-            temp = np.copy(volume)
-            # Modify intensity in each channel respectively
-            for c in range(CHANNELS):
-                ctemp = np.reshape(temp[..., c], ((1, -1)))[0]
-                non_bg_index = np.where(ctemp > 0)
-                # Randomly generate the sign,
-                # if positive, increase intensity of each voxel;
-                # if negative, decrease intensity of each voxel
-                sign = np.random.randint(2, size=1)[0] * 2 - 1
-
-                for i in non_bg_index:
-                    # Randomly generate how much, in percentage, the intrensity
-                    # of a voxel will be modified
-                    scope = np.random.randint(SCOPE_MIN, SCOPE_MAX + 1, size=1)[0] / 100
-                    ctemp[i] = ctemp[i] * (1 + sign * scope)
-
-                temp[..., c] = np.reshape(ctemp, temp[..., c].shape)
-
-            return temp
-
         print("Data augmentation on: ", case_no)
 
-        # Create output folder for each case
-        case_output_dir = os.path.join(output_dir, case_no)
-        if not os.path.isdir(case_output_dir):
-            os.makedirs(case_output_dir)
+        records = []
 
         # Get the grade of the case
         case_grade = self.labels[GRADE_LABEL][self.labels[CASE_NO] == case_no].values[0]
         # If the grade is unknown, no more process on this case
         if case_grade == GRADE_UNKNOWN:
             print("The grade of case " + case_no + " is unknown")
-            return
+            return records
         # Set the number of partial patches to be generated
         elif case_grade == GRADE_II:
             partial_num = GRADE_II_PARTIALS
@@ -325,11 +324,13 @@ class BTCAugment():
         # which are original, dilated and eroded tumor patches
         case_names = os.listdir(case_path)
         for cn in case_names:
-            # Load patch volume
-            volume = np.load(os.path.join(case_path, cn))
+            # Only the shape of patch volume is read
+            patch_path = os.path.abspath(os.path.join(case_path, cn))
+            with trace("load", reads=[patch_path]):
+                volume = np.load(patch_path, mmap_mode="r")
 
             # Compute range of indices of 15 partial patches
-            partial_begins, partial_ends = compute_partial_index(volume)
+            partial_begins, _ = compute_partial_index(volume)
 
             # If the grade of a case is IV (GBM), only one mirror can be made
             # randomly from three types of mirror. Otherwise, all mirrors will
@@ -340,58 +341,39 @@ class BTCAugment():
             # 1 for vertical mirror
             # 2 for axisymmetric mirror
             if case_grade == GRADE_II:
-                mirror_types = [0, 1, 2]
+                mirror_types = [HORIZONTAL_MIRROR, VERTICAL_MIRROR,
+                                AXISYMMETRIC_MIRROR]
             elif case_grade == GRADE_III:
                 mirror_types = list(np.random.randint(0, 3, 2))
             else:  # case_grade == GRADE_IV
-                mirror_types = [np.random.randint(0, 3, 1)]
-
-            # Generate mirrors and put them into list
-            volume_mirrors = []
-            for mirror_type in mirror_types:
-                if mirror_type == 0:
-                    volume_mirrors.append(horizontal_mirror(volume))
-
-                if mirror_type == 1:
-                    volume_mirrors.append(vertical_mirror(volume))
-
-                if mirror_type == 2:
-                    volume_mirrors.append(axisymmetric_mirror(volume))
+                mirror_types = list(np.random.randint(0, 3, 1))
 
             # Modity all volumes' intensity, but the original one,
             # modified mirrors are put into list
             # volume_augmented = [volume]
             # for vm in volume_mirrors:
-            #    volume_augmented.append(modify_intensity(vm))
-            volume_augmented = [volume] + volume_mirrors
+            #    volume_augmented.append(jitter_intensity(vm[None])[0])
+            volume_augmented = [NO_MIRROR] + [int(mt) for mt in mirror_types]
 
-            # Extract partial patches and save them into output folder
+            # Record partial patches of the original patch and mirrors
             # Code for patches
             partial_no = 0
             # Morphology type: "original", "dilated", "eroded"
             morp_type = cn.split(".")[0]
-            for vm in volume_augmented:
+            for mirror_type in volume_augmented:
                 # Randomly select several partial patches from 15 patches
                 all_partial_num = len(partial_begins)
                 ridx = np.random.choice(range(all_partial_num), partial_num, replace=False)
 
-                # Get these patches indices
-                rbegins = [partial_begins[i] for i in ridx]
-                rends = [partial_ends[i] for i in ridx]
-
-                # Save into folder
-                for rb, re in zip(rbegins, rends):
-                    # Extract a partial patch
-                    partial = partial_array(vm, rb, re)
-                    # Format file name and save
-                    partial_name = "_".join([case_no, morp_type, str(partial_no)]) + TARGET_EXTENSION
-                    partial_path = os.path.join(case_output_dir, partial_name)
-                    np.save(partial_path, partial)
+                for i in ridx:
+                    partial_name = "_".join([case_no, morp_type, str(partial_no)])
+                    records.append([case_no, partial_name, patch_path, mirror_type] +
+                                   [int(b) for b in partial_begins[i]])
 
                     # Increase the code for next patch
                     partial_no += 1
 
-        return
+        return records
 
 
 if __name__ == "__main__":
@@ -0,0 +1,220 @@
+# Brain Tumor Classification
+# Script for Batch Augmentation Operations
+
+#     ,,,         ,,,
+#   ;"   ';     ;'   ",
+#   ;  @.ss$$$$$$s.@  ;
+#   `s$$$$$$$$$$$$$$$'
+#   $$$$$$$$$$$$$$$$$$
+#  $$$$P""Y$$$Y""W$$$$$
+#  $$$$  p"$$$"q  $$$$$
+#  $$$$  .$$$$$.  $$$$'
+#   $$$DaU$$O$$DaU$$$'
+#    '$$$$'.^.'$$$$'
+#       '&$$$$$&'
+
+'''
+
+Augmentation Operations on Batches
+
+All operations work on a batch whose first dimention is samples,
+such as (N, X, Y, Z, C) for volumes or (N, X, Y, C) for slices.
+Use volume[None] to augment one volume. Random operations take
+a seed or an instance of np.random.RandomState.
+
+-1- flip: flip all or some samples along one axis.
+-2- mirror: horizontal, vertical or axisymmetric mirror of
+    each sample, as the mirrors in BTCAugment.
+-3- crop: crop a cube from each sample at its own position.
+-4- jitter_intensity: scale and shift intensities of foreground
+    in each channel of each sample.
+
+Usage example:
+
+    rng = np.random.RandomState(0)
+    batch = mirror(batch, [NO_MIRROR, HORIZONTAL_MIRROR])
+    batch = crop(batch, [[0, 0, 0], [5, 5, 5]], PARTIAL_SIZE)
+    batch = jitter_intensity(batch, rng)
+
+'''
+
+
+from __future__ import print_function
+
+import numpy as np
+from btc_settings import *
+
+
+def random_state(seed=None):
+    '''RANDOM_STATE
+
+        Return seed if it is an instance of np.random.RandomState,
+        otherwise a new instance seeded by it.
+
+    '''
+
+    if isinstance(seed, np.random.RandomState):
+        return seed
+
+    return np.random.RandomState(seed)
+
+
+def _gather(batch, samples, flips):
+    '''_GATHER
+
+        Gather batch[samples[i]] for each i by one indexing of
+        the batch, the k-th axis of the i-th output is reversed
+        if flips[k][i] is True.
+
+    '''
+
+    samples = np.asarray(samples)
+    num, axes = len(samples), len(flips)
+
+    index = [samples.reshape([-1] + [1] * axes)]
+    for axis, which in enumerate(flips):
+        size = batch.shape[axis + 1]
+        grid = np.arange(size)
+        grid = np.where(np.asarray(which, dtype=bool)[:, None], grid[::-1], grid)
+        shape = [num] + [1] * axes
+        shape[axis + 1] = size
+        index.append(grid.reshape(shape))
+
+    return batch[tuple(index)]
+
+
+def flip(batch, axis, which=None, samples=None):
+    '''FLIP
+
+        Flip samples along one axis of samples.
+
+        Inputs:
+        -------
+        - batch: array of samples
+        - axis: the axis of each sample, 0 for rows (np.flipud)
+                and 1 for columns (np.fliplr)
+        - which: boolean array of outputs to be flipped, default
+                 is None, all outputs are flipped
+        - samples: the sample of each output, default is None,
+                   each sample once, a sample can be repeated
+
+        Output:
+        -------
+        - batch: flipped batch, a view of the input if both which
+                 and samples are None, otherwise a new array
+
+    '''
+
+    if which is None and samples is None:
+        return np.flip(batch, axis + 1)
+
+    if samples is None:
+        samples = np.arange(len(batch))
+    if which is None:
+        which = np.ones(len(samples), dtype=bool)
+
+    flips = [np.zeros(len(samples), dtype=bool)] * axis + [which]
+    return _gather(batch, samples, flips)
+
+
+def mirror(batch, mirror_types):
+    '''MIRROR
+
+        Mirror each sample by its type.
+        - NO_MIRROR: the sample itself
+        - HORIZONTAL_MIRROR: flip each slice left to right
+        - VERTICAL_MIRROR: flip each slice upside down
+        - AXISYMMETRIC_MIRROR: flip in both directions
+
+        Inputs:
+        -------
+        - batch: array of samples
+        - mirror_types: mirror type of each sample
+
+        Output:
+        -------
+        - batch: a new array of mirrored samples
+
+    '''
+
+    mirror_types = np.asarray(mirror_types)
+    if not np.all(np.isin(mirror_types, [NO_MIRROR, HORIZONTAL_MIRROR,
+                                         VERTICAL_MIRROR, AXISYMMETRIC_MIRROR])):
+        raise ValueError("Unknown mirror type.")
+
+    flips = [np.isin(mirror_types, [VERTICAL_MIRROR, AXISYMMETRIC_MIRROR]),
+             np.isin(mirror_types, [HORIZONTAL_MIRROR, AXISYMMETRIC_MIRROR])]
+    return _gather(batch, np.arange(len(batch)), flips)
+
+
+def crop(batch, begins, size, samples=None):
+    '''CROP
+
+        Crop a cube from each sample, all cubes are gathered
+        by one indexing of the batch.
+
+        Inputs:
+        -------
+        - batch: array of samples
+        - begins: the first index of the cube in each sample,
+                  in shape of (N, number of cropped axes)
+        - size: the size of cube in each axis
+        - samples: the sample of each cube, default is None,
+                   one cube is cropped from each sample
+
+        Output:
+        -------
+        - cubes: array of cubes, channels are kept
+
+    '''
+
+    begins = np.asarray(begins)
+    num, axes = begins.shape
+    if samples is None:
+        samples = np.arange(num)
+
+    index = [np.asarray(samples).reshape([-1] + [1] * axes)]
+    for axis in range(axes):
+        shape = [num] + [1] * axes
+        shape[axis + 1] = size
+        grid = begins[:, axis, None] + np.arange(size)
+        if np.any(grid < 0) or np.any(grid >= batch.shape[axis + 1]):
+            raise IndexError("The cube is out of the sample.")
+        index.append(grid.reshape(shape))
+
+    return batch[tuple(index)]
+
+
+def jitter_intensity(batch, rng=None, scope=[SCOPE_MIN, SCOPE_MAX], shift=0):
+    '''JITTER_INTENSITY
+
+        Scale foreground (larger than zero) of each channel of
+        each sample by 1 + sign * scope / 100, where the sign is
+        randomly +1 or -1 and scope is an integer in the given
+        range, then shift it by a uniform value in [-shift, shift].
+
+        Inputs:
+        -------
+        - batch: array of samples, the last dimention is channels
+        - rng: seed or np.random.RandomState, default is None
+        - scope: range of scopes in percentage, default is
+                 [SCOPE_MIN, SCOPE_MAX]
+        - shift: the maximum of shift, default is 0
+
+        Output:
+        -------
+        - batch: jittered batch in the dtype of input
+
+    '''
+
+    rng = random_state(rng)
+    shape = [batch.shape[0]] + [1] * (batch.ndim - 2) + [batch.shape[-1]]
+
+    sign = rng.randint(2, size=shape) * 2 - 1
+    percent = rng.randint(scope[0], scope[1] + 1, size=shape)
+    factor = (1 + sign * percent / 100.0).astype(np.float32)
+    offset = rng.uniform(-shift, shift, size=shape).astype(np.float32)
+
+    jittered = np.where(batch > 0, batch * factor + offset, batch)
+
+    return jittered.astype(batch.dtype, copy=False)
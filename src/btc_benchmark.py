@@ -0,0 +1,725 @@
+# Brain Tumor Classification
+# Script for Benchmarks of Preprocessing Stages
+
+#     ,,,         ,,,
+#   ;"   ';     ;'   ",
+#   ;  @.ss$$$$$$s.@  ;
+#   `s$$$$$$$$$$$$$$$'
+#   $$$$$$$$$$$$$$$$$$
+#  $$$$P""Y$$$Y""W$$$$$
+#  $$$$  p"$$$"q  $$$$$
+#  $$$$  .$$$$$.  $$$$'
+#   $$$DaU$$O$$DaU$$$'
+#    '$$$$'.^.'$$$$'
+#       '&$$$$$&'
+
+'''
+
+Class BTCBenchmark
+
+-1- Generate a cohort of synthetic BraTS-shaped subjects, four
+    modalities and a tumor mask with necrotic core, edema and
+    enhancing tumor, no network or external tool is needed.
+-2- Write the cohort in the layout each stage reads from.
+-3- Run BTCPreprocess, BTCPatches, BTCAugment, BTCSlices,
+    BTCVolumes, BTCTFRecords and BTCExtract (patches, slices and
+    volumes from one load) in a new process with a given number
+    of workers, and measure the stage.
+-4- Save voxels/s, subjects/s, peak RSS and temp-disk bytes
+    of all runs into a JSON file.
+-5- Audit memory: peak RSS of each process of a stage, over
+    the RSS after stage modules are imported, is checked against
+    MEMORY_BUDGETS in units of one subject's float32 volume.
+
+Stages whose dependencies (nibabel, nipype, skimage or
+tensorflow) cannot be imported are recorded as skipped.
+If the N4BiasFieldCorrection executable cannot be found
+(on PATH, or given by the environment variable BTC_N4),
+BTCPreprocess is measured from intensity normalization,
+with original volumes copied as the bias-corrected ones.
+
+Usage example:
+
+    python btc_benchmark.py --subjects 4 8 --workers 1 4
+                            --stages patches volumes
+
+    python btc_benchmark.py --subjects 2 --workers 1 --audit
+
+'''
+
+
+from __future__ import print_function
+
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import threading
+import traceback
+import numpy as np
+import pandas as pd
+from btc_settings import *
+from btc_trace import current_rss
+from btc_chunks import save_chunks, open_volume
+from multiprocessing import Process, Queue, cpu_count
+
+
+# All stages can be benchmarked
+STAGES = ["preprocess", "patches", "augment",
+          "slices", "volumes", "tfrecords", "extract"]
+
+# Mean intensities of brain, necrotic core, edema and
+# enhancing tumor in each modality of synthetic subjects
+INTENSITIES = {"flair": [400, 500, 900, 700],
+               "t1": [500, 300, 450, 600],
+               "t1Gd": [500, 300, 450, 1100],
+               "t2": [400, 900, 1000, 800]}
+
+# Interval in seconds to sample memory and disk usage
+SAMPLE_INTERVAL = 0.1
+
+# Budgets of memory of one process in each stage, in units of
+# the float32 full volume of one subject (all modalities).
+# Intermediates are kept in float32 or the dtype of inputs,
+# one worker should never hold float64 copies of a volume.
+MEMORY_BUDGETS = {"preprocess": 2.5, "patches": 0.5, "augment": 0.25,
+                  "slices": 0.4, "volumes": 1.4, "tfrecords": 0.5,
+                  "extract": 1.8}
+
+
+def synthetic_subject(shape=BRAIN_SHAPE, seed=0):
+    '''SYNTHETIC_SUBJECT
+
+        Generate one subject. The brain is an ellipsoid, the tumor
+        is an ellipsoid of edema inside the brain, which contains
+        a shell of enhancing tumor around a necrotic core.
+        Intensities of each modality are shaded by a smooth bias
+        field and Gaussian noise.
+
+        Inputs:
+        -------
+        - shape: shape of each modality
+        - seed: random seed of the subject
+
+        Outputs:
+        --------
+        - volumes: dictionary of int16 volumes of VOLUME_TYPES
+        - mask: uint8 tumor mask with ELSE_MASK, NCRNET_MASK,
+                ED_MASK and ET_MASK
+
+    '''
+
+    rng = np.random.RandomState(seed)
+    shape = list(shape)
+    grid = np.ogrid[tuple([slice(0, s) for s in shape])]
+
+    # Brain, longer along rows than columns as in BraTS
+    radius = [s * r * rng.uniform(0.95, 1.05)
+              for s, r in zip(shape, [0.38, 0.3, 0.35])]
+    center = [s / 2.0 for s in shape]
+    dist = sum([((g - c) / r) ** 2 for g, c, r in zip(grid, center, radius)])
+    brain = dist <= 1
+
+    # Tumor, placed in the inner half of the brain
+    tumor_center = [c + r * rng.uniform(-0.4, 0.4)
+                    for c, r in zip(center, radius)]
+    tumor_radius = [min(shape) * rng.uniform(0.08, 0.14) for _ in shape]
+    dist = np.sqrt(sum([((g - c) / r) ** 2 for g, c, r
+                        in zip(grid, tumor_center, tumor_radius)]))
+
+    # Labels in order of INTENSITIES: 0 brain, 1 core, 2 edema, 3 enhancing
+    tissue = np.zeros(shape, dtype=np.uint8)
+    tissue[dist <= 1] = 2
+    tissue[dist <= 0.6] = 3
+    tissue[dist <= 0.35] = 1
+    tissue[~brain] = 0
+
+    mask = np.array([ELSE_MASK, NCRNET_MASK, ED_MASK, ET_MASK],
+                    dtype=np.uint8)[tissue]
+    mask[~brain] = ELSE_MASK
+
+    bias = 1 + 0.1 * (grid[0] / float(shape[0]) - grid[1] / float(shape[1]))
+    volumes = {}
+    for vtype in VOLUME_TYPES:
+        volume = np.array(INTENSITIES[vtype], dtype=np.float32)[tissue]
+        volume = volume * bias + rng.normal(0, 30, shape)
+        volume = np.maximum(volume, 1)
+        volume[~brain] = 0
+        volumes[vtype] = volume.astype(np.int16)
+
+    return volumes, mask
+
+
+def dir_size(path):
+    '''DIR_SIZE
+
+        Compute bytes of all files in the directory.
+
+    '''
+
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                # The file has been removed by the stage
+                pass
+
+    return size
+
+
+def tree_rss(pid):
+    '''TREE_RSS
+
+        Compute the sum of RSS, in bytes, of the process and all
+        its descendants from /proc. Return None if /proc is not
+        available.
+
+    '''
+
+    if not os.path.isdir("/proc"):
+        return None
+
+    parents, rss = {}, {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(os.path.join("/proc", name, "stat"), "r") as f:
+                # Fields after the command name, which may have spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (IOError, OSError):
+            continue
+        parents[int(name)] = int(fields[1])
+        rss[int(name)] = int(fields[21]) * resource.getpagesize()
+
+    tree, size = set([pid]), 0
+    while len(tree) != size:
+        size = len(tree)
+        tree |= set([p for p in parents if parents[p] in tree])
+
+    return sum([rss.get(p, 0) for p in tree])
+
+
+class Monitor(threading.Thread):
+
+    def __init__(self, pid, temp_dir, run_dir):
+        '''__INIT__
+
+            A thread to sample RSS of the process tree, and disk
+            usage of temporary and output files while a stage runs.
+
+            Inputs:
+            -------
+            - pid: process id of the stage
+            - temp_dir: directory of temporary files of the stage
+            - run_dir: directory of all files written by the stage
+
+        '''
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.pid = pid
+        self.temp_dir = temp_dir
+        self.run_dir = run_dir
+        self.stopped = threading.Event()
+
+        self.peak_rss = 0
+        self.peak_temp = 0
+        self.peak_disk = 0
+
+        return
+
+    def sample(self):
+        rss = tree_rss(self.pid)
+        if rss is None:
+            self.peak_rss = None
+        else:
+            self.peak_rss = max(self.peak_rss, rss)
+        self.peak_temp = max(self.peak_temp, dir_size(self.temp_dir))
+        self.peak_disk = max(self.peak_disk, dir_size(self.run_dir))
+        return
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.sample()
+            self.stopped.wait(SAMPLE_INTERVAL)
+        return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+        return
+
+
+def limit_workers(workers):
+    '''LIMIT_WORKERS
+
+        Pools of stages have cpu_count() processes, replace
+        cpu_count in imported stage modules to run stages
+        with the given number of workers.
+
+    '''
+
+    for name in ["btc_preprocess", "btc_patches", "btc_augment",
+                 "btc_slices", "btc_volumes", "btc_tfrecords",
+                 "btc_store", "btc_extract"]:
+        module = sys.modules.get(name)
+        if module is not None and hasattr(module, "cpu_count"):
+            module.cpu_count = lambda: workers
+
+    return
+
+
+def run_stage(queue, func, workers, temp_dir, run_dir):
+    '''RUN_STAGE
+
+        Run one stage in a new process and put its measures into
+        the queue. Stage modules are imported here, the stage is
+        skipped if any of its dependencies is missing.
+
+    '''
+
+    result = {}
+    try:
+        stage = func()
+        limit_workers(workers)
+
+        # Memory of imported modules, which workers inherit
+        result["baseline_rss_bytes"] = current_rss()
+
+        monitor = Monitor(os.getpid(), temp_dir, run_dir)
+        monitor.start()
+        start = time.time()
+        stage()
+        result["seconds"] = time.time() - start
+
+        # Finalize pools, their workers are counted in RUSAGE_CHILDREN
+        gc.collect()
+        monitor.stop()
+
+        result["status"] = "done"
+        result["peak_rss_bytes"] = monitor.peak_rss
+        result["temp_disk_bytes"] = monitor.peak_temp
+        result["peak_disk_bytes"] = monitor.peak_disk
+    except ImportError as e:
+        result["status"] = "skipped"
+        result["error"] = str(e)
+    except Exception:
+        result["status"] = "failed"
+        result["error"] = traceback.format_exc()
+
+    # ru_maxrss is in kilobytes on Linux
+    result["max_process_rss_bytes"] = 1024 * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if "baseline_rss_bytes" in result:
+        result["worker_rss_bytes"] = max(
+            result["max_process_rss_bytes"] - result["baseline_rss_bytes"], 0)
+    queue.put(result)
+
+    return
+
+
+class BTCBenchmark():
+
+    def __init__(self, work_dir, shape=BRAIN_SHAPE, seed=0):
+        '''__INIT__
+
+            Initialization of class BTCBenchmark.
+
+            Inputs:
+            -------
+            - work_dir: path of the directory to keep synthetic
+                        cohorts and outputs of stages
+            - shape: shape of each modality, default is BRAIN_SHAPE
+            - seed: random seed of the first subject
+
+        '''
+
+        self.work_dir = work_dir
+        self.shape = list(shape)
+        self.seed = seed
+        self.results = []
+
+        if not os.path.isdir(work_dir):
+            os.makedirs(work_dir)
+
+        return
+
+    def _cohort_dir(self, subjects):
+        return os.path.join(self.work_dir, "Cohort" + str(subjects))
+
+    def _case_names(self, subjects):
+        return ["S{0:04d}".format(i) for i in range(subjects)]
+
+    def generate(self, subjects):
+        '''GENERATE
+
+            Generate a cohort and write it in the layouts of inputs
+            of stages. A cohort which exists is not generated again.
+
+            ----- Cohort<subjects>
+              |----- labels.csv  (Case, Grade_Label)
+              |----- Preprocessed
+              |   |----- full/<case>.npy  (cropped, float32)
+              |   |----- mask/<case>.npy
+              |----- Patches
+                  |----- <case>/<morphology>.npy
+
+            Original volumes in NIfTI are written by _prepare_preprocess,
+            only if nibabel can be imported.
+
+            Input:
+            ------
+            - subjects: number of subjects
+
+        '''
+
+        cohort_dir = self._cohort_dir(subjects)
+        label_file = os.path.join(cohort_dir, LABEL_FILE)
+        if os.path.isfile(label_file):
+            return
+
+        full_dir = os.path.join(cohort_dir, PREPROCESSED_FOLDER, FULL_FOLDER)
+        mask_dir = os.path.join(cohort_dir, PREPROCESSED_FOLDER, MASK_FOLDER)
+        for path in [full_dir, mask_dir]:
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        print("Generate a cohort of {} subjects".format(subjects))
+        cases = self._case_names(subjects)
+        for i, case in enumerate(cases):
+            volumes, mask = synthetic_subject(self.shape, self.seed + i)
+            full = np.stack([volumes[vtype] for vtype in VOLUME_TYPES], axis=3)
+            full = full.astype(np.float32)
+
+            # Keep the brain with EDGE_SPACE around, as BTCPreprocess does
+            index = np.where(np.sum(full, axis=3) > 0)
+            begin = [max(np.min(idx) - EDGE_SPACE, 0) for idx in index]
+            end = [np.max(idx) + 1 + EDGE_SPACE for idx in index]
+            region = tuple([slice(b, e) for b, e in zip(begin, end)])
+            save_chunks(os.path.join(full_dir, case + CHUNKS_EXTENSION), full[region])
+            save_chunks(os.path.join(mask_dir, case + CHUNKS_EXTENSION), mask[region])
+
+            # A cube around the tumor as the patch of each morphology
+            index = np.where(mask > ELSE_MASK)
+            center = [(np.min(idx) + np.max(idx)) // 2 for idx in index]
+            half = max(max([np.max(idx) - np.min(idx) for idx in index]),
+                       PARTIAL_SIZE + 1) // 2 + 1
+            begin = [max(min(c - half, s - 2 * half), 0)
+                     for c, s in zip(center, self.shape)]
+            patch = full[tuple([slice(b, b + 2 * half) for b in begin])]
+
+            case_dir = os.path.join(cohort_dir, PATCHES_FOLDER, case)
+            if not os.path.isdir(case_dir):
+                os.makedirs(case_dir)
+            for morp in MORPHOLOGY:
+                np.save(os.path.join(case_dir, morp + TARGET_EXTENSION), patch)
+
+        grades = [GRADES_LIST[i % len(GRADES_LIST)] for i in range(subjects)]
+        labels = pd.DataFrame(data={CASE_NO: cases, GRADE_LABEL: grades},
+                              columns=[CASE_NO, GRADE_LABEL])
+        labels.to_csv(label_file, index=False)
+
+        return
+
+    def _prepare_preprocess(self, subjects, run_dir):
+        '''_PREPARE_PREPROCESS
+
+            Write original volumes and masks in NIfTI as the
+            layout generated by btc_reorganize.py.
+
+        '''
+
+        import nibabel as nib
+
+        input_dir = os.path.join(self._cohort_dir(subjects), ORIGINAL_FOLDER)
+        cases = self._case_names(subjects)
+        if not os.path.isdir(input_dir):
+            for i, case in enumerate(cases):
+                case_dir = os.path.join(input_dir, case)
+                os.makedirs(case_dir)
+                volumes, mask = synthetic_subject(self.shape, self.seed + i)
+                volumes[MASK_NAME] = mask
+                for name, volume in volumes.items():
+                    path = os.path.join(case_dir, case + "_" + name +
+                                        SOURCE_EXTENSION)
+                    nib.save(nib.Nifti1Image(volume, np.eye(4)), path)
+
+        temp_dir = os.path.join(run_dir, TEMP_FOLDER)
+        output_dir = os.path.join(run_dir, PREPROCESSED_FOLDER)
+        has_n4 = bool(os.environ.get(N4_COMMAND_ENV)) or \
+            any([os.path.isfile(os.path.join(path, "N4BiasFieldCorrection"))
+                 for path in os.environ.get("PATH", "").split(os.pathsep)])
+
+        if not has_n4:
+            # Original volumes are regarded as bias-corrected volumes
+            for vtype in VOLUME_TYPES:
+                os.makedirs(os.path.join(temp_dir, vtype))
+                for case in cases:
+                    name = case + "_" + vtype + SOURCE_EXTENSION
+                    shutil.copy(os.path.join(input_dir, case, name),
+                                os.path.join(temp_dir, vtype, name))
+
+        def stage():
+            from btc_store import BTCStore
+            from btc_preprocess import BTCPreprocess
+
+            prep = BTCPreprocess.__new__(BTCPreprocess)
+            if not has_n4:
+                # Percentile values are saved by bias field correction,
+                # they are computed here and not measured
+                for vtype in VOLUME_TYPES:
+                    for case in cases:
+                        name = case + "_" + vtype
+                        prep._volume_percentiles(
+                            os.path.join(temp_dir, vtype, name + SOURCE_EXTENSION),
+                            os.path.join(temp_dir, vtype, name + PCTS_SUFFIX +
+                                         TARGET_EXTENSION))
+
+            def run():
+                if has_n4:
+                    BTCPreprocess(input_dir, output_dir, temp_dir,
+                                  keep_temp=False)
+                    return
+
+                prep.volume_no = os.listdir(input_dir)
+                prep.mask_folder = os.path.join(output_dir, MASK_FOLDER)
+                prep.full_folder = os.path.join(output_dir, FULL_FOLDER)
+                prep._create_folders(temp_dir)
+                store = BTCStore(None)
+                prep._intensity_normalization_multi(temp_dir, store)
+                prep._merge_to_one_volume_multi(input_dir, temp_dir, store)
+
+            return run
+
+        voxels = subjects * len(VOLUME_TYPES) * int(np.prod(self.shape))
+        note = None if has_n4 else "N4BiasFieldCorrection is not found, " + \
+            "bias field correction is not measured"
+
+        return stage, temp_dir, voxels, note
+
+    def _prepare(self, name, subjects, run_dir):
+        '''_PREPARE
+
+            Generate the function which runs the stage in
+            the new process.
+
+            Inputs:
+            -------
+            - name: name of the stage in STAGES
+            - subjects: number of subjects
+            - run_dir: path of the directory for all outputs of
+                       the stage, it will be removed after the run
+
+            Outputs:
+            --------
+            - stage: function to import stage modules and
+                     return the function to run the stage
+            - temp_dir: directory of temporary files
+            - voxels: number of voxels of inputs, all channels
+            - note: a message about the run, or None
+
+        '''
+
+        if name == "preprocess":
+            return self._prepare_preprocess(subjects, run_dir)
+
+        cohort_dir = self._cohort_dir(subjects)
+        prep_dir = os.path.join(cohort_dir, PREPROCESSED_FOLDER)
+        patch_dir = os.path.join(cohort_dir, PATCHES_FOLDER)
+        label_file = os.path.join(cohort_dir, LABEL_FILE)
+        temp_dir = os.path.join(run_dir, TEMP_FOLDER)
+        output_dir = os.path.join(run_dir, "Output")
+
+        def npy_voxels(paths):
+            return int(sum([np.prod(open_volume(p).shape) for p in paths]))
+
+        full_dir = os.path.join(prep_dir, FULL_FOLDER)
+        full_paths = [os.path.join(full_dir, f) for f in os.listdir(full_dir)]
+        patch_paths = [os.path.join(patch_dir, c, f)
+                       for c in os.listdir(patch_dir)
+                       for f in os.listdir(os.path.join(patch_dir, c))]
+
+        if name == "patches":
+            def stage():
+                from btc_patches import BTCPatches
+                return lambda: BTCPatches(prep_dir, output_dir, temp_dir, 1)
+            voxels = npy_voxels(full_paths)
+        elif name == "augment":
+            def stage():
+                from btc_augment import BTCAugment
+                return lambda: BTCAugment(patch_dir, output_dir, label_file)
+            voxels = npy_voxels(patch_paths)
+        elif name == "slices":
+            def stage():
+                from btc_slices import BTCSlices
+                return lambda: BTCSlices(prep_dir, output_dir, label_file)
+            voxels = npy_voxels(full_paths)
+        elif name == "volumes":
+            def stage():
+                from btc_volumes import BTCVolumes
+                return lambda: BTCVolumes(full_dir, output_dir)
+            voxels = npy_voxels(full_paths)
+        elif name == "tfrecords":
+            def stage():
+                from btc_tfrecords import BTCTFRecords
+                return lambda: BTCTFRecords("patch").create_tfrecord(
+                    patch_dir, output_dir, temp_dir, label_file)
+            voxels = npy_voxels(patch_paths)
+        elif name == "extract":
+            def stage():
+                from btc_extract import BTCExtract, EXTRACTORS
+                output_dirs = dict([(e, os.path.join(output_dir, e))
+                                    for e in EXTRACTORS])
+                return lambda: BTCExtract(prep_dir, output_dirs,
+                                          label_file, temp_dir, 1)
+            voxels = npy_voxels(full_paths)
+        else:
+            raise ValueError("Unknown stage: " + name)
+
+        return stage, temp_dir, voxels, None
+
+    def run(self, name, subjects, workers):
+        '''RUN
+
+            Run one stage on a cohort with the given number of
+            workers in a new process, and keep its measures.
+
+            Inputs:
+            -------
+            - name: name of the stage in STAGES
+            - subjects: number of subjects
+            - workers: number of worker processes of the stage
+
+            Output:
+            -------
+            - result: dictionary of measures
+
+        '''
+
+        self.generate(subjects)
+        run_dir = os.path.join(self.work_dir, "Run")
+        if os.path.isdir(run_dir):
+            shutil.rmtree(run_dir)
+        os.makedirs(run_dir)
+
+        result = {"stage": name, "subjects": subjects, "workers": workers,
+                  "shape": self.shape}
+        print("\nBenchmark {0}: {1} subjects, {2} workers".format(
+            name, subjects, workers))
+
+        try:
+            stage, temp_dir, voxels, note = self._prepare(name, subjects, run_dir)
+        except ImportError as e:
+            result.update({"status": "skipped", "error": str(e)})
+            self.results.append(result)
+            return result
+
+        queue = Queue()
+        process = Process(target=run_stage,
+                          args=(queue, stage, workers, temp_dir, run_dir))
+        process.start()
+        result.update(queue.get())
+        process.join()
+
+        result["voxels"] = voxels
+        if note is not None:
+            result["note"] = note
+        if result["status"] == "done":
+            seconds = max(result["seconds"], 1e-9)
+            result["voxels_per_second"] = voxels / seconds
+            result["subjects_per_second"] = subjects / seconds
+            result["output_bytes"] = dir_size(run_dir)
+            result["memory_budget_bytes"] = int(
+                MEMORY_BUDGETS[name] * np.prod(self.shape) * CHANNELS *
+                np.dtype(np.float32).itemsize)
+            print("{0:.2f}s, {1:.3g} voxels/s, {2:.3g} subjects/s".format(
+                result["seconds"], result["voxels_per_second"],
+                result["subjects_per_second"]))
+            print("worker memory {0:.1f} MB, budget {1:.1f} MB".format(
+                result["worker_rss_bytes"] / 2.0 ** 20,
+                result["memory_budget_bytes"] / 2.0 ** 20))
+        else:
+            print(result["status"] + ": " + result["error"])
+
+        shutil.rmtree(run_dir)
+        self.results.append(result)
+
+        return result
+
+    def audit(self):
+        '''AUDIT
+
+            Check memory of all runs which are done.
+
+            Output:
+            -------
+            - over: list of runs whose memory of one process
+                    exceeds the budget of the stage
+
+        '''
+
+        over = [r for r in self.results if r["status"] == "done" and
+                r["worker_rss_bytes"] > r["memory_budget_bytes"]]
+        for r in over:
+            print("Memory of {0} ({1} subjects, {2} workers) is over budget: "
+                  "{3:.1f} MB > {4:.1f} MB".format(
+                      r["stage"], r["subjects"], r["workers"],
+                      r["worker_rss_bytes"] / 2.0 ** 20,
+                      r["memory_budget_bytes"] / 2.0 ** 20))
+
+        return over
+
+    def save(self, path):
+        '''SAVE
+
+            Save results of all runs into a JSON file.
+
+        '''
+
+        with open(path, "w") as f:
+            json.dump({"cpu_count": cpu_count(), "results": self.results},
+                      f, indent=1, sort_keys=True)
+
+        return
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subjects", type=int, nargs="+", default=[4],
+                        help="Sizes of synthetic cohorts.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[cpu_count()],
+                        help="Numbers of worker processes.")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES,
+                        help="Stages to be benchmarked.")
+    parser.add_argument("--shape", type=int, nargs=3, default=BRAIN_SHAPE,
+                        help="Shape of each modality.")
+    parser.add_argument("--work-dir", dest="work_dir",
+                        default=os.path.join(TEMP_FOLDER, "Benchmark"),
+                        help="Directory of synthetic cohorts and outputs.")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="Path of the JSON file of results.")
+    parser.add_argument("--audit", action="store_true",
+                        help="Exit with 1 if memory of any stage is over "
+                             "its budget in MEMORY_BUDGETS.")
+    args = parser.parse_args()
+
+    bench = BTCBenchmark(args.work_dir, args.shape)
+    for subjects in args.subjects:
+        for name in args.stages:
+            for workers in args.workers:
+                bench.run(name, subjects, workers)
+    bench.save(args.output)
+
+    if args.audit and len(bench.audit()) > 0:
+        sys.exit(1)
@@ -0,0 +1,292 @@
+# Brain Tumor Classification
+# Script for Chunked Volumes
+
+#     ,,,         ,,,
+#   ;"   ';     ;'   ",
+#   ;  @.ss$$$$$$s.@  ;
+#   `s$$$$$$$$$$$$$$$'
+#   $$$$$$$$$$$$$$$$$$
+#  $$$$P""Y$$$Y""W$$$$$
+#  $$$$  p"$$$"q  $$$$$
+#  $$$$  .$$$$$.  $$$$'
+#   $$$DaU$$O$$DaU$$$'
+#    '$$$$'.^.'$$$$'
+#       '&$$$$$&'
+
+'''
+
+Class BTCChunks
+
+-1- Save a volume in chunks, each chunk is compressed by zlib
+    respectively. Chunks are CHUNK_SHAPE in the first three
+    dimentions, and one channel in the fourth dimention.
+-2- Read a region or some channels of the volume, only chunks
+    intersecting the region are decompressed.
+
+Layout of a chunked file (a zip file without compression):
+
+    meta.json  <=== shape, dtype and chunk shape of the volume,
+                    minimum and maximum of each channel
+    0.0.0.0    <=== compressed chunk, named by its index
+    0.0.0.1
+    ...
+
+Chunks whose values are all zero are not saved.
+
+Usage example:
+
+    save_chunks("TCGA-XX-0000.npc", full)
+
+    with BTCChunks("TCGA-XX-0000.npc") as full:
+        tumor = full[40:80, 60:100, 30:70]
+        flair = full[..., 0]
+
+'''
+
+
+from __future__ import print_function
+
+import os
+import json
+import zlib
+import zipfile
+import numpy as np
+from btc_settings import *
+from collections import OrderedDict
+
+
+META_NAME = "meta.json"
+
+
+def save_chunks(path, volume, chunk_shape=CHUNK_SHAPE, level=CHUNK_LEVEL):
+    '''SAVE_CHUNKS
+
+        Save volume into path in chunks. The file is written
+        into a temporary file and renamed, a crash never leaves
+        a partial file.
+
+        Inputs:
+        -------
+        - path: path of the output file
+        - volume: 3D volume or 4D volume whose last dimention
+                  is channels
+        - chunk_shape: shape of chunks in the first three
+                       dimentions, default is CHUNK_SHAPE
+        - level: compression level of zlib, default is CHUNK_LEVEL
+
+    '''
+
+    volume = np.ascontiguousarray(volume)
+    chunks = list(chunk_shape[:3]) + [1] * (volume.ndim - 3)
+    grid = [int(np.ceil(s / float(c))) for s, c in zip(volume.shape, chunks)]
+
+    # Minimum and maximum of each channel
+    if volume.ndim > 3:
+        channels = [volume[..., c] for c in range(volume.shape[-1])]
+    else:
+        channels = [volume]
+
+    meta = {"shape": list(volume.shape),
+            "dtype": volume.dtype.str,
+            "chunks": chunks,
+            "min": [np.min(c).item() for c in channels],
+            "max": [np.max(c).item() for c in channels]}
+
+    temp_path = path + ".tmp"
+    with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_STORED) as zf:
+        zf.writestr(META_NAME, json.dumps(meta))
+        for index in np.ndindex(*grid):
+            region = tuple([slice(i * c, min((i + 1) * c, s))
+                            for i, c, s in zip(index, chunks, volume.shape)])
+            chunk = volume[region]
+            if not chunk.any():
+                continue
+            data = zlib.compress(np.ascontiguousarray(chunk).tobytes(), level)
+            zf.writestr(".".join([str(i) for i in index]), data)
+    os.rename(temp_path, path)
+
+    return
+
+
+def open_volume(path):
+    '''OPEN_VOLUME
+
+        Open a volume without reading all of it. Return an
+        instance of BTCChunks for chunked files, or a memory
+        mapped array for .npy files.
+
+    '''
+
+    if path.endswith(CHUNKS_EXTENSION):
+        return BTCChunks(path)
+
+    return np.load(path, mmap_mode="r")
+
+
+def load_volume(path):
+    '''LOAD_VOLUME
+
+        Read the whole volume from a chunked file or .npy file.
+
+    '''
+
+    if path.endswith(CHUNKS_EXTENSION):
+        with BTCChunks(path) as volume:
+            return volume.read()
+
+    return np.load(path)
+
+
+class BTCChunks(object):
+
+    def __init__(self, path, cache_size=CHUNK_CACHE_SIZE):
+        '''__INIT__
+
+            Open a chunked file and read its meta data.
+            Decompressed chunks are kept in a cache, so
+            overlapped regions do not decompress them again.
+
+            Inputs:
+            -------
+            - path: path of the chunked file
+            - cache_size: the number of chunks in the cache,
+                          default is CHUNK_CACHE_SIZE
+
+        '''
+
+        self.path = path
+        self.zip = zipfile.ZipFile(path, "r")
+        meta = json.loads(self.zip.read(META_NAME).decode("utf-8"))
+
+        self.shape = tuple(meta["shape"])
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(meta["dtype"])
+        self.chunks = meta["chunks"]
+        self.min_values = np.array(meta["min"])
+        self.max_values = np.array(meta["max"])
+        self.names = set(self.zip.namelist())
+
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+
+        return
+
+    def close(self):
+        self.zip.close()
+        self.cache.clear()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    def _chunk(self, index):
+        '''_CHUNK
+
+            Return the chunk of the given index, decompress it
+            if it is not in cache. Chunks which are not saved
+            are zeros.
+
+        '''
+
+        if index in self.cache:
+            return self.cache[index]
+
+        shape = [min(c, s - i * c) for i, c, s in zip(index, self.chunks, self.shape)]
+        name = ".".join([str(i) for i in index])
+        if name in self.names:
+            data = zlib.decompress(self.zip.read(name))
+            chunk = np.frombuffer(data, dtype=self.dtype).reshape(shape)
+        else:
+            chunk = np.zeros(shape, dtype=self.dtype)
+
+        self.cache[index] = chunk
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return chunk
+
+    def read(self, begin=None, end=None):
+        '''READ
+
+            Read the region from begin to end (not included)
+            of all dimentions.
+
+            Inputs:
+            -------
+            - begin: list of first indices of all dimentions,
+                     default is None, which is all zeros
+            - end: list of last indices (not included) of all
+                   dimentions, default is None, the shape
+
+            Output:
+            -------
+            - region: the array of the region
+
+        '''
+
+        begin = [0] * self.ndim if begin is None else list(begin)
+        end = list(self.shape) if end is None else list(end)
+
+        region = np.zeros([max(e - b, 0) for b, e in zip(begin, end)],
+                          dtype=self.dtype)
+        if region.size == 0:
+            return region
+
+        # Indices of the first and the last chunks in each dimention
+        first = [b // c for b, c in zip(begin, self.chunks)]
+        last = [(e - 1) // c for e, c in zip(end, self.chunks)]
+        for offset in np.ndindex(*[l - f + 1 for f, l in zip(first, last)]):
+            index = tuple([f + o for f, o in zip(first, offset)])
+            chunk_begin = [i * c for i, c in zip(index, self.chunks)]
+
+            # Intersection of the chunk and the region
+            low = [max(b, cb) for b, cb in zip(begin, chunk_begin)]
+            high = [min(e, cb + c) for e, cb, c in zip(end, chunk_begin, self.chunks)]
+            src = tuple([slice(l - cb, h - cb) for l, h, cb in zip(low, high, chunk_begin)])
+            dst = tuple([slice(l - b, h - b) for l, h, b in zip(low, high, begin)])
+            region[dst] = self._chunk(index)[src]
+
+        return region
+
+    def __getitem__(self, key):
+        '''__GETITEM__
+
+            Read a region by indexing, such as volume[10:20, :, 5]
+            or volume[..., 0]. Steps of slices are not supported.
+
+        '''
+
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        # Expand the ellipsis to full slices
+        if any([k is Ellipsis for k in key]):
+            i = [k is Ellipsis for k in key].index(True)
+            key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        begin, end, squeeze = [], [], []
+        for axis, (k, s) in enumerate(zip(key, self.shape)):
+            if isinstance(k, slice):
+                b, e, step = k.indices(s)
+                if step != 1:
+                    raise ValueError("Steps of slices are not supported.")
+                begin.append(b)
+                end.append(max(e, b))
+            else:
+                k = int(k) + s if int(k) < 0 else int(k)
+                if k < 0 or k >= s:
+                    raise IndexError("Index out of range.")
+                begin.append(k)
+                end.append(k + 1)
+                squeeze.append(axis)
+
+        region = self.read(begin, end)
+        if len(squeeze) > 0:
+            region = np.squeeze(region, axis=tuple(squeeze))
+
+        return region
@@ -0,0 +1,222 @@
+# Brain Tumor Classification
+# Script for Extracting Patches, Slices and Volumes
+
+#     ,,,         ,,,
+#   ;"   ';     ;'   ",
+#   ;  @.ss$$$$$$s.@  ;
+#   `s$$$$$$$$$$$$$$$'
+#   $$$$$$$$$$$$$$$$$$
+#  $$$$P""Y$$$Y""W$$$$$
+#  $$$$  p"$$$"q  $$$$$
+#  $$$$  .$$$$$.  $$$$'
+#   $$$DaU$$O$$DaU$$$'
+#    '$$$$'.^.'$$$$'
+#       '&$$$$$&'
+
+'''
+
+Class BTCExtract
+
+Load each case of preprocessed data once, and run any of the
+extractors of tumor patches (BTCPatches), slices (BTCSlices)
+and volumes (BTCVolumes) on it. Generating all of them reads
+the cohort once instead of three times.
+
+-1- Each process loads the brain volume and its mask of one case,
+    saves slices and resized volumes, and returns tumor patches.
+-2- Patches of all cases are collected as in BTCPatches, and then
+    resized into their median shape.
+
+Usage example:
+
+    BTCExtract(input_dir, {"patches": patches_dir,
+                           "slices": slices_dir,
+                           "volumes": volumes_dir},
+               label_file, temp_dir)
+
+'''
+
+
+from __future__ import print_function
+
+import os
+import argparse
+from btc_settings import *
+from btc_trace import trace
+from btc_chunks import load_volume
+from btc_slices import BTCSlices
+from btc_patches import BTCPatches
+from btc_volumes import BTCVolumes
+from btc_resample import pool_threads
+from multiprocessing import Pool, cpu_count
+
+
+# All products can be extracted
+EXTRACTORS = ["patches", "slices", "volumes"]
+
+
+# Helper function to do multiprocessing of
+# BTCExtract._extract_case
+def unwrap_extract_case(arg, **kwarg):
+    with trace("extract_case", arg[1].split(".")[0]):
+        return BTCExtract._extract_case(*arg, **kwarg)
+
+
+class BTCExtract():
+
+    def __init__(self, input_dir, output_dirs, label_file=None,
+                 temp_dir="temp", is_morph=1):
+        '''__INIT__
+
+            Initialization of class BTCExtract, and finish
+            extracting all products at the mean time.
+
+            Inputs:
+            -------
+            - input_dir: path of the directory which keeps
+                         preprocessed data
+            - output_dirs: dictionary of output directories, the key
+                           is one of EXTRACTORS, only products in it
+                           are extracted
+            - label_file: path of the file which has labels of all
+                          cases, it is required by slices
+            - temp_dir: path of the directory which keeps temporary
+                        patches, default is "temp"
+            - is_morph: whether to extract dilated and eroded
+                        patches, default is 1
+
+        '''
+
+        for name in output_dirs.keys():
+            if name not in EXTRACTORS:
+                raise ValueError("Unknown extractor: " + name)
+
+        if "slices" in output_dirs and label_file is None:
+            raise ValueError("Label file is required by slices.")
+
+        self.full_dir = os.path.join(input_dir, FULL_FOLDER)
+        self.mask_dir = os.path.join(input_dir, MASK_FOLDER)
+        if not os.path.isdir(self.full_dir):
+            raise IOError("Brain volumes folder cannot be found.")
+        if not os.path.isdir(self.mask_dir):
+            raise IOError("Brain masks folder cannot be found.")
+
+        # Extractors are initialized without running,
+        # their steps are called on each loaded case
+        self.patches, self.slices, self.volumes = None, None, None
+        self.threads = None
+        if "patches" in output_dirs:
+            self.patches = BTCPatches(input_dir, output_dirs["patches"],
+                                      temp_dir, is_morph, run=False)
+        if "slices" in output_dirs:
+            self.slices = BTCSlices(input_dir, output_dirs["slices"],
+                                    label_file, run=False)
+        if "volumes" in output_dirs:
+            self.volumes = BTCVolumes(self.full_dir, output_dirs["volumes"],
+                                      run=False)
+
+        self._extract_multi()
+
+        return
+
+    def _extract_multi(self):
+        '''_EXTRACT_MULTI
+
+            Map cases on different cpus. Patches returned by
+            subprocesses are collected and resized by BTCPatches.
+
+        '''
+
+        case_names = sorted(os.listdir(self.full_dir))
+
+        print("\nExtract products from each case\n")
+        # Threads of resampling volumes in each process
+        self.threads = pool_threads(len(case_names))
+        paras = zip([self] * len(case_names), case_names)
+        pool = Pool(processes=cpu_count())
+        results = pool.imap_unordered(unwrap_extract_case, paras)
+
+        if self.patches is not None:
+            patches, shapes = self.patches._collect_patches(results)
+        else:
+            for _ in results:
+                pass
+
+        pool.close()
+        pool.join()
+
+        if self.patches is not None:
+            self.patches._resize_tumors_multi(patches, shapes)
+            self.patches._delete_temp_files()
+
+        return
+
+    def _extract_case(self, case_name):
+        '''_EXTRACT_CASE
+
+            Load brain volume and mask of one case, and
+            run all extractors on them.
+
+            Input:
+            ------
+            - case_name: string, the name of input volume
+
+            Outputs:
+            --------
+            - shape, patches: outputs of BTCPatches._extract_tumor,
+                              None and empty list if patches are
+                              not extracted
+
+        '''
+
+        full_path = os.path.join(self.full_dir, case_name)
+        mask_path = os.path.join(self.mask_dir, case_name)
+        with trace("load", reads=[full_path, mask_path]):
+            full = load_volume(full_path)
+            mask = load_volume(mask_path)
+
+        shape, patches = None, []
+        if self.patches is not None:
+            with trace("patches"):
+                case_no = case_name.split(".")[0]
+                shape, patches = self.patches._extract_tumor(mask, full, case_no)
+
+        if self.slices is not None:
+            with trace("slices"):
+                self.slices._resize_slice(case_name, full, mask)
+
+        if self.volumes is not None:
+            with trace("volumes"):
+                self.volumes._resize_volume(full, self.volumes.output_dir,
+                                            case_name, self.threads)
+
+        return shape, patches
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    help_str = "Products to be extracted in " + ", ".join(EXTRACTORS) + "."
+    parser.add_argument("--products", nargs="+", default=EXTRACTORS,
+                        choices=EXTRACTORS, dest="products", help=help_str)
+
+    help_str = "Whether use morphology '1' or '0'."
+    parser.add_argument("--morph", action="store", default=1,
+                        dest="morph", help=help_str)
+    args = parser.parse_args()
+
+    parent_dir = os.path.dirname(os.getcwd())
+    data_dir = os.path.join(parent_dir, DATA_FOLDER)
+
+    input_dir = os.path.join(data_dir, PREPROCESSED_FOLDER)
+    label_file = os.path.join(data_dir, LABEL_FILE)
+    temp_dir = os.path.join(TEMP_FOLDER, PATCHES_FOLDER)
+
+    folders = {"patches": PATCHES_FOLDER,
+               "slices": SLICES_FOLDER,
+               "volumes": VOLUMES_FOLDER}
+    output_dirs = dict([(p, os.path.join(data_dir, folders[p]))
+                        for p in args.products])
+
+    BTCExtract(input_dir, output_dirs, label_file, temp_dir, args.morph)
@@ -27,6 +27,7 @@ import os
 import numpy as np
 import nibabel as nib
 from btc_settings import *
+from btc_chunks import save_chunks
 from multiprocessing import Pool, cpu_count
 
 
@@ -107,6 +108,8 @@ class BTCNonePreprocess():
             Merge normalized flair, t1, t1Gd and t2 volumes of one patient
             to one volume. Remove surrounding backgrounds, and save output
             into output folder as the result of preprocessing.
+            Outputs are saved in chunks by save_chunks, and masks are
+            saved as uint8.
 
             Inputs:
             -------
@@ -118,7 +121,7 @@ class BTCNonePreprocess():
         '''
 
         print("NO." + vno + ": Save brain volume and mask volume")
-        full_volume = np.zeros(FULL_SHAPE)
+        full_volume = np.zeros(FULL_SHAPE, dtype=np.float32)
         volume_folder = os.path.join(input_dir, vno)
         for file in os.listdir(volume_folder):
             for i in range(len(VOLUME_TYPES)):
@@ -141,11 +144,11 @@ class BTCNonePreprocess():
         full_volume, mask_volume = self._keep_minimum_volume(full_volume, mask_volume)
 
         # Save volume into output folders
-        full_volume_path = os.path.join(self.full_folder, vno + TARGET_EXTENSION)
-        mask_volume_path = os.path.join(self.mask_folder, vno + TARGET_EXTENSION)
+        full_volume_path = os.path.join(self.full_folder, vno + CHUNKS_EXTENSION)
+        mask_volume_path = os.path.join(self.mask_folder, vno + CHUNKS_EXTENSION)
 
-        np.save(full_volume_path, full_volume)
-        np.save(mask_volume_path, mask_volume)
+        save_chunks(full_volume_path, full_volume)
+        save_chunks(mask_volume_path, mask_volume.astype(np.uint8))
 
         return
 
@@ -37,7 +37,8 @@ Pipline of Patches Generation:
         |        |        |        |          Extracting Minimum Tumor Patches
         ----------------------------
                      |
-       Save Outputs in Temporary Folder
+    Keep Patches in Memory (Spill to Temporary
+    Folder if PATCHES_CACHE_SIZE is Reached)
      Compute Median Shape of All Patches
                      |
         ----------------------------
@@ -60,11 +61,12 @@ import argparse
 import warnings
 import numpy as np
 from btc_settings import *
+from btc_trace import trace
 import scipy.ndimage as sn
+from btc_chunks import BTCChunks, open_volume, load_volume
 from skimage import measure
-import scipy.ndimage.morphology as snm
 from multiprocessing import Pool, cpu_count
-from scipy.ndimage.interpolation import zoom
+from btc_resample import resample, pool_threads
 
 
 # Ignore the warning caused by SciPy
@@ -74,18 +76,73 @@ warnings.simplefilter("ignore", UserWarning)
 # Helper function to do multiprocessing of
 # BTCPatches._extract_tumors
 def unwrap_extract_tumors(arg, **kwarg):
-    return BTCPatches._extract_tumor(*arg, **kwarg)
+    with trace("extract_tumor", arg[3]):
+        return BTCPatches._extract_tumor(*arg, **kwarg)
 
 
 # Helper function to do multiprocessing of
 # BTCPatches._resize_tumors
 def unwrap_resize_tumor(arg, **kwarg):
-    return BTCPatches._resize_tumor(*arg, **kwarg)
+    with trace("resize_tumor", arg[3]):
+        return BTCPatches._resize_tumor(*arg, **kwarg)
+
+
+def roi_morphology(mask, iterations=MORP_ITER_NUM):
+    '''ROI_MORPHOLOGY
+
+        Dilate and erode a binary mask inside the bounding box of
+        the mask, padded by iterations voxels. The results equal to
+        binary_dilation and binary_erosion with the structure of
+        generate_binary_structure(3, 1) iterated for iterations
+        times, since iterated dilations and erosions by this cross
+        reach voxels within the same taxicab distance.
+
+        - Dilated mask: voxels whose distance to the mask is not
+          larger than iterations.
+        - Eroded mask: voxels whose distance to the background is
+          larger than iterations, voxels out of the volume are
+          regarded as background.
+
+        Inputs:
+        -------
+        - mask: binary mask of the whole volume
+        - iterations: the number of iterations of dilatation and
+                      erosion, default is MORP_ITER_NUM
+
+        Outputs:
+        --------
+        - begin: the first index of the region in each dimention,
+                 None if the mask is empty
+        - masks: dictionary of masks of the region, whose keys are
+                 "original", "dilated" and "eroded"
+
+    '''
+
+    objects = sn.find_objects(mask.astype(np.uint8))
+    if len(objects) == 0:
+        return None, {}
+
+    region = tuple([slice(max(o.start - iterations, 0),
+                          min(o.stop + iterations, s))
+                    for o, s in zip(objects[0], mask.shape)])
+    roi = mask[region] > 0
+
+    # Distance from each voxel to the mask
+    dilated = sn.distance_transform_cdt(~roi, metric="taxicab") <= iterations
+
+    # Distance from each voxel in the mask to the background,
+    # the region is padded by one voxel of background
+    dist = sn.distance_transform_cdt(np.pad(roi, 1, mode="constant"),
+                                     metric="taxicab")
+    eroded = dist[1:-1, 1:-1, 1:-1] > iterations
+
+    begin = [r.start for r in region]
+    return begin, {"original": roi, "dilated": dilated, "eroded": eroded}
 
 
 class BTCPatches():
 
-    def __init__(self, input_dir, output_dir, temp_dir="temp", is_morph=1):
+    def __init__(self, input_dir, output_dir, temp_dir="temp", is_morph=1, run=True):
         '''__INIT__
 
             Initialization of class BTCPatches, and finish
@@ -107,6 +164,11 @@ class BTCPatches():
             - temp_dir: path of the directory which
                         keeps temporary files during the
                         preprocessing, default is "temp"
+            - is_morph: whether to extract dilated and eroded
+                        patches, default is 1
+            - run: whether to extract patches now, default is True,
+                   BTCExtract sets it to False and calls the steps
+                   on cases it has loaded
 
         '''
 
@@ -125,17 +187,18 @@ class BTCPatches():
         self.mask_files = os.listdir(self.input_mask)
         self.full_files = os.listdir(self.input_full)
 
-        # Create a file name to record each tumor patch's size
-        self.shape_file = os.path.join(temp_dir, SHAPE_FILE)
-
         self.is_morph = bool(int(is_morph))
         print(self.is_morph)
 
-        # Patches generation pipline
         self._check_volumes_amount()
         self._create_folders()
-        self._extract_tumors_multi()
-        self._resize_tumors_multi()
+
+        if not run:
+            return
+
+        # Patches generation pipline
+        patches, shapes = self._extract_tumors_multi()
+        self._resize_tumors_multi(patches, shapes)
 
         # Delete temporary folder and all files in it
         self._delete_temp_files()
@@ -166,7 +229,8 @@ class BTCPatches():
             Create folders for temporary files and outputs.
             All folders are as below.
 
-            Folder for temporary files:
+            Folder for temporary files, patches are saved
+            here only if they are out of PATCHES_CACHE_SIZE:
             ----- temp_dir (default is "temp")
               |----- mask
               |----- tumor
@@ -205,9 +269,13 @@ class BTCPatches():
             The number of subprocesses equals to the number of cpus.
 
             - Generate paths of all input volumes of brain and mask.
-            - Create a text file to keep shape of every patches.
             - Map parameters (mask path, brain path and case number)
               to function BTCPatches._extract_tumor.
+            - Collect patches and shapes returned by subprocesses.
+
+            Outputs:
+            --------
+            - patches, shapes: see BTCPatches._collect_patches
 
         '''
 
@@ -216,29 +284,69 @@ class BTCPatches():
         full_paths = [os.path.join(self.input_full, ff) for ff in self.full_files]
         case_nos = [ff.split(".")[0] for ff in self.full_files]
 
-        # If the text file is exist already, delete it
-        if os.path.isfile(self.shape_file):
-            os.remove(self.shape_file)
-
-        # Create empty text file to keep all pathes' shape
-        open(self.shape_file, "a").close()
-
         print("\nStep 1: Extract tumor patches from full volume\n")
         paras = zip([self] * len(case_nos),
                     mask_paths,
                     full_paths,
                     case_nos)
         pool = Pool(processes=cpu_count())
-        pool.map(unwrap_extract_tumors, paras)
+        patches, shapes = self._collect_patches(
+            pool.imap_unordered(unwrap_extract_tumors, paras))
+        pool.close()
+        pool.join()
 
-        return
+        return patches, shapes
+
+    def _collect_patches(self, results):
+        '''_COLLECT_PATCHES
+
+            Collect patches and shapes of all cases. Patches are
+            kept in memory until the total size is larger than
+            PATCHES_CACHE_SIZE, the others are saved in temporary
+            folder.
+
+            Input:
+            ------
+            - results: iterable of outputs of BTCPatches._extract_tumor
+
+            Outputs:
+            --------
+            - patches: dictionary of patches, the key is patch's name,
+                       the value is a tuple of mask and tumor patches,
+                       or paths of them in temporary folder
+            - shapes: list of sizes of patches extracted according to
+                      the original tumor core's mask
+
+        '''
+
+        patches, shapes, cache_size = {}, [], 0
+        for shape, case_patches in results:
+            if shape is not None:
+                shapes.append(shape)
+
+            for patch_name, tumor_mask, tumor_full in case_patches:
+                patch_size = tumor_mask.nbytes + tumor_full.nbytes
+                if cache_size + patch_size <= PATCHES_CACHE_SIZE:
+                    patches[patch_name] = (tumor_mask, tumor_full)
+                    cache_size += patch_size
+                    continue
+
+                # Save patches into temporary folder
+                file_name = patch_name + TARGET_EXTENSION
+                tumor_mask_path = os.path.join(self.temp_mask, file_name)
+                tumor_full_path = os.path.join(self.temp_tumor, file_name)
+                np.save(tumor_mask_path, tumor_mask)
+                np.save(tumor_full_path, tumor_full)
+                patches[patch_name] = (tumor_mask_path, tumor_full_path)
+
+        return patches, shapes
 
     def _extract_tumor(self, mask_path, full_path, case_no):
         '''_EXTRACT_TUMORS
 
             Extract the patch of tumor's core according to its mask
-            and save outputs in temporary folder. There are three steps
-            in this stage, which are:
+            and return patches. There are three steps in this stage,
+            which are:
             - Do morphology operations on tumor core's mask. Each of
               them will be dilated. Some masks shall be eroded if they
               are larger than the threshold volume. After this step,
@@ -246,16 +354,21 @@ class BTCPatches():
               obtained at most.
             - Compute the range of tumor core's index based on each mask,
               and make sure that each dimention has same size.
-            - Extract tumor patch according to indices and save it in
-              temporary folder.
+            - Extract tumor patch according to indices.
 
             Inputs:
             -------
-            - mask_path: the path of mask volume
-            - full_path: the path of brain volume
+            - mask_path: the path of mask volume, or the mask
+            - full_path: the path of brain volume, or the volume
             - case_no: the serial number of input volume, this is used to
                        format the name of output file
 
+            Outputs:
+            --------
+            - shape: the size of patch extracted according to the
+                     original tumor core's mask, None if there is not
+            - patches: list of patch's name, mask patch and tumor patch
+
         '''
 
         # This function is used to get tumor indices.
@@ -265,21 +378,18 @@ class BTCPatches():
         # tumor. Then, get and return indices of reserved region.
         def remove_small_object(mask):
 
-            # Obtain all connected regions
-            blobs = measure.label((mask > 0) * 1.0, background=ELSE_MASK)
-            labels = np.unique(blobs)[1:]
-            labels_num = [len(np.where(blobs == l)[0]) for l in labels]
-
-            # Find which regions are larger than threshold
-            label_idx = np.where(np.array(labels_num) > TUMOT_MIN_SIZE)[0]
-            temp = np.zeros(mask.shape)
+            # Obtain all connected regions and their sizes,
+            # the size of region l is labels_num[l]
+            blobs = measure.label((mask > 0).astype(np.uint8), background=ELSE_MASK)
+            labels_num = np.bincount(blobs.ravel())
 
-            # Remain those regions
-            for li in label_idx:
-                temp[blobs == labels[li]] = 1.0
+            # Remain regions which are larger than threshold,
+            # the background is never remained
+            keep = labels_num > TUMOT_MIN_SIZE
+            keep[ELSE_MASK] = False
 
             # Retuen indices of remain mask
-            return np.where(temp > 0)
+            return np.where(keep[blobs])
 
         # In this function, the indices' range of each dimention is
         # going to be computed. What's more, every dimention has the
@@ -319,65 +429,63 @@ class BTCPatches():
 
             # Get the background intensity of input array
             arr_shape = arr.shape
-            if len(arr_shape) == CHANNELS:  # Brainvolume
+            if isinstance(arr, BTCChunks):  # Chunked brain volume
+                bg = arr.min_values
+            elif len(arr_shape) == CHANNELS:  # Brainvolume
                 bg = np.array([np.min(arr[..., i]) for i in range(CHANNELS)])
             else:  # Mask volume
                 bg = np.min(arr)
 
-            # Compute new range of indices, as well as how many slices
-            # of background will be padded in each dimentions
-            new_begin, begin_diff = [], []
-            new_end, end_diff = [], []
+            # Compute the range of indices which are in the array,
+            # and where it is placed in the output. The last slice
+            # of the array is regarded as background once the range
+            # is out of the array.
+            src, dst, out_shape = [], [], []
             for i in range(len(begin)):
-                # Before first slice
-                if begin[i] >= 0:  # No need to pad
-                    new_begin.append(begin[i])
-                    begin_diff.append(0)
-                else:  # Need to pad befor the first slice
-                    new_begin.append(0)
-                    begin_diff.append(np.abs(begin[i]))
-
-                # After last slice
+                src_begin = max(begin[i], 0)
                 if end[i] <= arr_shape[i] - 1:  # No need to pad
-                    new_end.append(end[i] + 1)
-                    end_diff.append(0)
+                    src_end = end[i] + 1
                 else:  # Need to pad after the last slice
-                    new_end.append(arr_shape[i] - 1)
-                    end_diff.append(end[i] - arr_shape[i] + 2)
-
-            # Extract tumor region
-            sub_arr = arr[new_begin[0]:new_end[0],
-                          new_begin[1]:new_end[1],
-                          new_begin[2]:new_end[2]]
+                    src_end = arr_shape[i] - 1
+                dst_begin = src_begin - begin[i]
+                src.append(slice(src_begin, src_end))
+                dst.append(slice(dst_begin, dst_begin + src_end - src_begin))
+                out_shape.append(end[i] + 1 - begin[i])
 
-            for i in range(len(begin_diff)):
-                temp_shape = list(sub_arr.shape)
+            # Write tumor region into the output, which is filled by
+            # background if it is larger than the region
+            sub_arr = np.empty(out_shape + list(arr_shape[3:]), dtype=arr.dtype)
+            if any([d.start > 0 or d.stop < o for d, o in zip(dst, out_shape)]):
+                sub_arr[...] = bg
+            sub_arr[tuple(dst)] = arr[tuple(src)]
 
-                # Pad background before the first slice
-                if begin_diff[i] > 0:
-                    temp_shape[i] = begin_diff[i]
-                    temp_arr = np.multiply(np.ones(temp_shape), bg)
-                    sub_arr = np.concatenate((temp_arr, sub_arr), axis=i)
-
-                # Pad background after the last slice
-                if end_diff[i] > 0:
-                    temp_shape[i] = end_diff[i]
-                    temp_arr = np.multiply(np.ones(temp_shape), bg)
-                    sub_arr = np.concatenate((sub_arr, temp_arr), axis=i)
-
-            return sub_arr.astype(arr.dtype)
+            return sub_arr
 
         print("Extract tumor from patient: " + case_no)
 
-        # Load brain and mask volumes
-        mask = np.load(mask_path)
-        full = np.load(full_path)
+        # Load mask volume, only tumor regions of brain
+        # volume are read from chunks which intersect them
+        if isinstance(mask_path, str):
+            with trace("load", reads=[mask_path]):
+                mask = load_volume(mask_path)
+                full = open_volume(full_path)
+        else:
+            mask, full = mask_path, full_path
 
-        # Generate kernel for dilatation and erosion
-        kernel = sn.generate_binary_structure(3, 1).astype(np.float32)
         # Get the original tumor core's mask
         original_core_mask = np.logical_and(mask != ED_MASK,
-                                            mask != ELSE_MASK) * 1.0
+                                            mask != ELSE_MASK)
+
+        # Dilated and eroded masks are computed only around
+        # the tumor, tumor indices are offset by roi_begin
+        with trace("morphology"):
+            roi_begin, core_masks = roi_morphology(original_core_mask)
+
+        shape, patches = None, []
+
+        # No tumor's core is in this case
+        if roi_begin is None:
+            return shape, patches
 
         # If the size of tumor's core is too small,
         # enable_eroded will be assigned to False
@@ -392,25 +500,17 @@ class BTCPatches():
             if (not self.is_morph) and (morp == "dilated" or morp == "eroded"):
                 continue
 
-            if morp == "dilated":  # Dilatation
-                core_mask = snm.binary_dilation(original_core_mask,
-                                                structure=kernel,
-                                                iterations=MORP_ITER_NUM)
-            elif morp == "eroded":  # Erosion
-                if enable_eroded:  # The tumor can be eroded.
-                    core_mask = snm.binary_erosion(original_core_mask,
-                                                   structure=kernel,
-                                                   iterations=MORP_ITER_NUM)
-                else:  # The tumor cannot be eroded since it is too small
-                    continue
-            else:  # Original mask
-                core_mask = original_core_mask
+            if morp == "eroded" and not enable_eroded:
+                # The tumor cannot be eroded since it is too small
+                continue
 
-            # Get tumor indices
-            tumor_index = remove_small_object(core_mask)
+            with trace("label"):
+                # Get tumor indices
+                tumor_index = remove_small_object(core_masks[morp])
             # If no tumor availabel, start next loop
             if len(tumor_index[0]) == 0:
                 continue
+            tumor_index = [i + b for i, b in zip(tumor_index, roi_begin)]
 
             # Compute the range of indices in each dimention
             dims_begin, dims_end = compute_dims_range(tumor_index)
@@ -421,26 +521,20 @@ class BTCPatches():
                     enable_eroded = False
 
             # Extract patch from brain and mask volumes
-            tumor_mask = sub_array(mask, dims_begin, dims_end)
-            tumor_full = sub_array(full, dims_begin, dims_end)
+            with trace("crop"):
+                tumor_mask = sub_array(mask, dims_begin, dims_end)
+                tumor_full = sub_array(full, dims_begin, dims_end)
 
-            # Save patches into temporary folder
-            file_name = case_no + "_" + morp + TARGET_EXTENSION
-            tumor_mask_path = os.path.join(self.temp_mask, file_name)
-            tumor_full_path = os.path.join(self.temp_tumor, file_name)
+            patches.append((case_no + "_" + morp, tumor_mask, tumor_full))
 
-            np.save(tumor_mask_path, tumor_mask)
-            np.save(tumor_full_path, tumor_full)
-
-            # Save the shape of patch extracted according to the original
-            # tumor core's mask into text file
+            # Keep the shape of patch extracted according to
+            # the original tumor core's mask
             if morp == "original":
-                with open(self.shape_file, "a") as txt:
-                    txt.write(str(tumor_full.shape[0]) + SHAPE_FILE_SPLIT)
+                shape = tumor_full.shape[0]
 
-        return
+        return shape, patches
 
-    def _resize_tumors_multi(self):
+    def _resize_tumors_multi(self, patches, shapes):
         '''_RESIZE_TUMOR_MULTI
 
             Main function of resizing tumor patches to map tasks
@@ -449,43 +543,41 @@ class BTCPatches():
 
             - Compute the median shape of all tumor patches and
               generate new shape that all patches will be resized to.
-            - Generate paths of all input volumes of tumor and mask.
-            - Map parameters (mask patch's path, tumor patch's path,
-              patch's name and new shape) to function
-              BTCPatches._extract_tumor.
+            - Map parameters (mask patch, tumor patch, patch's name
+              and new shape) to function BTCPatches._resize_tumor.
+              Patches are passed to subprocesses one by one, and
+              released once they are sent.
 
-        '''
+            Inputs:
+            -------
+            - patches: dictionary of patches returned by
+                       BTCPatches._extract_tumors_multi
+            - shapes: list of sizes of original patches
 
-        # Read original tumors' shape from text file
-        all_shapes = open(self.shape_file, "r")
-        shapes_txt = all_shapes.read()
-        shapes_list = shapes_txt.split(SHAPE_FILE_SPLIT)
-        shapes_list = list(filter(None, shapes_list))
-        shapes_list = list(map(int, shapes_list))
+        '''
 
         # Compute median shape of all tumors as the new shape
-        median_shape = int(np.median(shapes_list))
+        median_shape = int(np.median(shapes))
         new_shape = [median_shape] * 3 + [CHANNELS]
 
-        # Generate mask patches' path, tumor patches' path
-        # and patches' names
-        temp_file_names = os.listdir(self.temp_tumor)
-        temp_mask_paths = [os.path.join(self.temp_mask, tfn) for tfn in temp_file_names]
-        temp_tumor_paths = [os.path.join(self.temp_tumor, tfn) for tfn in temp_file_names]
-        patch_names = [tfn.split(".")[0] for tfn in temp_file_names]
-
         print("\nStep 2: Resize tumor patches to ", new_shape, "\n")
-        paras = zip([self] * len(patch_names),
-                    temp_mask_paths,
-                    temp_tumor_paths,
-                    patch_names,
-                    [new_shape] * len(patch_names))
+        patch_names = sorted(patches.keys())
+        threads = pool_threads(len(patch_names))
+
+        def paras():
+            for patch_name in patch_names:
+                tumor_mask, tumor_full = patches.pop(patch_name)
+                yield self, tumor_mask, tumor_full, patch_name, new_shape, threads
+
         pool = Pool(processes=cpu_count())
-        pool.map(unwrap_resize_tumor, paras)
+        for _ in pool.imap_unordered(unwrap_resize_tumor, paras()):
+            pass
+        pool.close()
+        pool.join()
 
         return
 
-    def _resize_tumor(self, mask_path, tumor_path, patch_name, shape):
+    def _resize_tumor(self, mask, tumor, patch_name, shape, threads=None):
         '''_RESIZE_TUMOR
 
             Resize tumor patch into the given shape. Three steps
@@ -497,26 +589,31 @@ class BTCPatches():
 
             Inputs:
             -------
-            - mask_path: the path of mask patch
-            - tumor_path: the path of tumor patch
+            - mask: mask patch, or its path in temporary folder
+            - tumor: tumor patch, or its path in temporary folder
             - patch_name: the name of patch file, which is used
                           to format output's name
             - shape: the shape that patch will be resized into
+            - threads: the number of threads of resampling,
+                       default is None, which uses all cores
 
         '''
 
         print("Resize tumor on: " + patch_name)
 
-        # Load tumor and mask patch
-        tumor = np.load(tumor_path)
-        mask = np.load(mask_path)
+        # Load tumor and mask patch if they are spilled
+        if isinstance(tumor, str):
+            with trace("load", reads=[tumor, mask]):
+                tumor = np.load(tumor)
+                mask = np.load(mask)
 
         # Remove surrounding brain tissues around tumor,
         # and replace tissues with background
         bg = np.array([np.min(tumor[..., i]) for i in range(CHANNELS)])
-        temp_tumor = np.multiply(np.ones(tumor.shape), bg)
-        non_bg_index = np.where(mask > 0)
-        temp_tumor[non_bg_index] = tumor[non_bg_index]
+        temp_tumor = np.empty_like(tumor)
+        temp_tumor[...] = bg
+        non_bg = mask > 0
+        temp_tumor[non_bg] = tumor[non_bg]
 
         # Resize tumor into given shape.
         # Settings can be found in btc_settings.py
@@ -524,9 +621,10 @@ class BTCPatches():
         # Compute zoom factor, a warning may be appear
         # The warning has been ignored by the code at line 68
         factor = [ns / float(vs) for ns, vs in zip(shape, tumor_shape)]
-        resize_tumor = zoom(temp_tumor, zoom=factor,
-                            order=ZOOM_ORDER, prefilter=ZOOM_FILTER)
-        resize_tumor = resize_tumor.astype(tumor.dtype)
+        with trace("zoom"):
+            resize_tumor = resample(temp_tumor, factor, order=ZOOM_ORDER,
+                                    prefilter=ZOOM_FILTER, output=tumor.dtype,
+                                    threads=threads)
 
         # Generate the path of output folder
         case_no = patch_name.split("_")[0]
@@ -540,15 +638,15 @@ class BTCPatches():
         morp_type = patch_name.split("_")[1]
         file_name = morp_type + TARGET_EXTENSION
         output_path = os.path.join(case_no_folder, file_name)
-        np.save(output_path, resize_tumor)
+        with trace("save", writes=[output_path]):
+            np.save(output_path, resize_tumor)
 
         return
 
     def _delete_temp_files(self):
         '''_DELETE_TEMP_FILES
 
-            Delete temporary files in temporary folder except
-            the text file of all original tumors' shapes.
+            Delete patches saved in temporary folder.
 
         '''
 
@@ -22,6 +22,8 @@ Class BTCPreprocess
 
 -1- Correct bias field via N4BiasFieldCorrection.
 -2- Intensity normalization on each volume.
+    Landmarks can be loaded from a former run to normalize
+    new cases only, without computing landmarks again.
 -3- Merge four volumes (flair, t1, t1Gd and t2) into one volume
     and remove surrounding backgrounds to keep minimum volume.
 
@@ -58,42 +60,65 @@ Pipline of Preprocessing:
               Save Outputs in Output Folder
                  Delete Tempprary Folder
 
+Usage example of normalizing new cases with landmarks
+saved in the temporary folder of the training cohort:
+
+    BTCPreprocess(input_dir, output_dir, new_temp_dir,
+                  landmarks_dir=temp_dir, cases=["TCGA-XX-0000"])
+
+    python btc_preprocess.py landmarks_dir [case ...]
+
 '''
 
 
 from __future__ import print_function
 
 import os
+import sys
+import json
+import shlex
 import shutil
+import hashlib
+import subprocess
 import numpy as np
 import pandas as pd
 import nibabel as nib
+from btc_store import BTCStore
+from btc_trace import trace
 from btc_settings import *
-from multiprocessing import Pool, cpu_count
+from btc_chunks import save_chunks
+from multiprocessing import cpu_count
 from nipype.interfaces.ants.segmentation import N4BiasFieldCorrection
 
 
 # Helper function to do multiprocessing of
 # BTCPreprocess._bias_field_correction
 def unwrap_bias_field_correction(arg, **kwarg):
-    return BTCPreprocess._bias_field_correction(*arg, **kwarg)
+    with trace("bias_field_correction", os.path.basename(arg[1]),
+               reads=[arg[1]], writes=[arg[2], arg[3]]):
+        return BTCPreprocess._bias_field_correction(*arg, **kwarg)
 
 
 # Helper function to do multiprocessing of
-# BTCPreprocess._intensity_normalization
-def unwrap_intensity_normalization(arg, **kwarg):
-    return BTCPreprocess._intensity_normalization(*arg, **kwarg)
+# BTCPreprocess._intensity_transform
+def unwrap_intensity_transform(arg, **kwarg):
+    with trace("intensity_transform", os.path.basename(arg[1]),
+               reads=[arg[1]], writes=[arg[2]]):
+        return BTCPreprocess._intensity_transform(*arg, **kwarg)
 
 
 # Helper function to do multiprocessing of
 # BTCPreprocess._merge_to_one_volume
 def unwrap_merge_to_one_volume(arg, **kwarg):
-    return BTCPreprocess._merge_to_one_volume(*arg, **kwarg)
+    with trace("merge_to_one_volume", arg[3]):
+        return BTCPreprocess._merge_to_one_volume(*arg, **kwarg)
 
 
 class BTCPreprocess():
 
-    def __init__(self, input_dir, output_dir, temp_dir="temp", preprocess=True):
+    def __init__(self, input_dir, output_dir, temp_dir="temp",
+                 preprocess=True, keep_temp=True,
+                 landmarks_dir=None, cases=None):
         '''__INIT__
 
             Initialization of class BTCPreprocess, and finish
@@ -105,7 +130,19 @@ class BTCPreprocess():
             - Multiprocess of function to correct bias field.
             - Multiprocess of function to normalize intensity.
             - Multiprocess of function to merge and save output.
-            - Delete all temporary files.
+            - Delete all temporary files if keep_temp is False.
+
+            Outputs of each stage are recorded in the manifest in
+            temp_dir by BTCStore. In a re-run, only subjects or
+            stages whose inputs or settings have been changed, and
+            those failed before, are computed again.
+
+            If landmarks_dir is given, landmarks saved in it are
+            loaded to transform intensities of volumes, instead of
+            computing landmarks from all volumes. Each case is
+            normalized independently, so new cases can be added
+            without a pass over the whole cohort, and they have
+            the same mapping as cases in training.
 
             Inputs:
             -------
@@ -116,11 +153,21 @@ class BTCPreprocess():
             - temp_dir: path of the directory which
                         keeps temporary files during the
                         preprocessing, default is "temp"
+            - keep_temp: whether to keep temporary files for
+                         incremental re-runs, default is True
+            - landmarks_dir: path of the directory which keeps
+                             landmarks csv files, default is None,
+                             landmarks are computed from all volumes
+            - cases: serial numbers of patients to be preprocessed,
+                     default is None, all patients in input_dir
 
         '''
 
         # Serial numbers of patients generated by btc_reorganize.py
-        self.volume_no = os.listdir(input_dir)
+        if cases is None:
+            self.volume_no = os.listdir(input_dir)
+        else:
+            self.volume_no = list(cases)
 
         # Output folder of mask volumes
         self.mask_folder = os.path.join(output_dir, MASK_FOLDER)
@@ -129,12 +176,14 @@ class BTCPreprocess():
 
         # Preprocess pipline
         self._create_folders(temp_dir)
-        self._bias_field_correction_multi(input_dir, temp_dir)
-        self._intensity_normalization_multi(temp_dir)
-        self._merge_to_one_volume_multi(input_dir, temp_dir)
+        store = BTCStore(temp_dir)
+        self._bias_field_correction_multi(input_dir, temp_dir, store)
+        self._intensity_normalization_multi(temp_dir, store, landmarks_dir)
+        self._merge_to_one_volume_multi(input_dir, temp_dir, store)
 
         # Delete temporary folder and all files in it
-        self._delete_temp_files(temp_dir)
+        if not keep_temp:
+            self._delete_temp_files(temp_dir)
 
         return
 
@@ -184,17 +233,24 @@ class BTCPreprocess():
 
         return
 
-    def _bias_field_correction_multi(self, input_dir, temp_dir):
+    def _bias_field_correction_multi(self, input_dir, temp_dir, store):
         '''_BIAS_FIELD_CORRECTION_MULTI
 
             Main function of bias field correctgion to map tasks
             on different cpus to accelerate processing speed.
-            The number of subprocesses equals to the number of cpus.
+            Each N4 job runs N4_THREADS threads of ITK, so the number
+            of subprocesses is the number of cpus divided by N4_THREADS.
 
             - Generate paths of all original volumes and
               paths of temporary volumes that will be corrected.
-            - Map pairs of paths (original path and temporary path)
-              to function BTCPreprocess._bias_field_correction.
+            - Map paths (original path, temporary path and path of
+              percentile values) to BTCPreprocess._bias_field_correction,
+              jobs of larger volumes are started first, so that
+              the longest jobs do not run at the end alone.
+            - Runtime of each job, and the exit status of a failed
+              job, are recorded in the manifest by BTCStore.
+            - Exclude patients whose volumes failed to be corrected
+              from the following stages.
 
             Inputs:
             -------
@@ -203,34 +259,73 @@ class BTCPreprocess():
             - temp_dir: path of the directory which
                         keeps temporary files during the
                         preprocessing, default is "temp"
+            - store: instance of BTCStore
 
         '''
 
-        orig_volumes_path = []  # paths of original volumes
-        temp_volumes_path = []  # paths of temporary volumes
+        n4_paras = [N4_DIMENSION, N4_ITERATION, N4_SHRINK_FACTOR,
+                    N4_THRESHOLD, N4_BSPLINE]
+
+        processes, threads = self._n4_schedule()
+
+        jobs, jobs_vno, jobs_size = [], {}, {}
         for vtype in VOLUME_TYPES:
             for vno in self.volume_no:
                 file_name = vno + "_" + vtype + SOURCE_EXTENSION
                 orig = os.path.join(input_dir, vno, file_name)
                 temp = os.path.join(temp_dir, vtype, file_name)
-                orig_volumes_path.append(orig)
-                temp_volumes_path.append(temp)
+                pcts = os.path.join(temp_dir, vtype, vno + "_" + vtype +
+                                    PCTS_SUFFIX + TARGET_EXTENSION)
+                jobs.append(store.job(file_name, unwrap_bias_field_correction,
+                                      [(self, orig, temp, pcts, threads)], [orig],
+                                      [temp, pcts], [n4_paras, PCTS]))
+                jobs_vno[file_name] = vno
+                jobs_size[file_name] = os.path.getsize(orig) \
+                    if os.path.isfile(orig) else 0
+
+        # Largest volumes first
+        jobs.sort(key=lambda job: -jobs_size[job["name"]])
 
         print("Stage 1: Bias Field Correction\n")
-        paras = zip([self] * len(orig_volumes_path),
-                    orig_volumes_path,
-                    temp_volumes_path)
-        pool = Pool(processes=cpu_count())
-        pool.map(unwrap_bias_field_correction, paras)
+        print("{0} N4 jobs at once, {1} threads in each job".format(processes, threads))
+        failed = store.run("BiasFieldCorrection", jobs, processes=processes)
+
+        failed_vno = set([jobs_vno[name] for name in failed])
+        if len(failed_vno) > 0:
+            print("Exclude patients: " + ", ".join(sorted(failed_vno)))
+            self.volume_no = [vno for vno in self.volume_no
+                              if vno not in failed_vno]
 
         return
 
-    def _bias_field_correction(self, orig_path, temp_path):
+    def _n4_schedule(self):
+        '''_N4_SCHEDULE
+
+            Compute the number of concurrent N4 jobs and the number
+            of ITK threads of each job. Jobs x threads is no more than
+            the number of cpus, to avoid oversubscription.
+
+            Outputs:
+            --------
+            - processes: number of concurrent N4 jobs
+            - threads: number of ITK threads of each job
+
+        '''
+
+        cpus = cpu_count()
+        processes = max(cpus // N4_THREADS, 1)
+        threads = max(cpus // processes, 1)
+
+        return processes, threads
+
+    def _bias_field_correction(self, orig_path, temp_path, pcts_path, threads=1):
         '''_BIAS_FIELD_CORRECTION
 
             Apply N4BiasFieldCorrection method on a volume
             and save the output into temporary folder.
             Settings can be found in btc_settings.py.
+            Percentile values of the output, which are used to
+            compute landmarks in Stage 2, are saved in pcts_path.
 
             Original paper can be found here:
             https://www.ncbi.nlm.nih.gov/pubmed/20378467
@@ -240,6 +335,13 @@ class BTCPreprocess():
             - orig_path: path for original volume
             - temp_path: path for temporary volume which is
                          the output of bias field correction
+            - pcts_path: path of .npy file to save percentile values
+            - threads: number of ITK threads, default is 1
+
+            The executable can be replaced by the environment
+            variable BTC_N4, such as a stand-in script in tests,
+            which is called with the same arguments.
+            RuntimeError is raised with the exit status if N4 fails.
 
             --- NOTE ---
 
@@ -262,7 +364,11 @@ class BTCPreprocess():
         '''
 
         print("N4ITK on: " + orig_path)
-        n4 = N4BiasFieldCorrection()
+        command = os.environ.get(N4_COMMAND_ENV)
+        if command:
+            n4 = N4BiasFieldCorrection(command=command)
+        else:
+            n4 = N4BiasFieldCorrection()
 
         n4.inputs.input_image = orig_path
         n4.inputs.output_image = temp_path
@@ -273,85 +379,298 @@ class BTCPreprocess():
         n4.inputs.convergence_threshold = N4_THRESHOLD
         n4.inputs.bspline_fitting_distance = N4_BSPLINE
 
-        # Run command line silently in UBUNTU
-        n4.run()
-
-        # Run command line in WINDOWS
-        # Do not forget import denpendicy at the head of script
-        # import subprocess
+        # Pin the number of ITK threads of this job
+        env = dict(os.environ)
+        env[ITK_THREADS_ENV] = str(threads)
 
-        # Run command line with information printing in WINDOWS
-        # subprocess.call(n4.cmdline.split(" "))
+        # Run command line silently, both in UBUNTU and WINDOWS
+        process = subprocess.Popen(shlex.split(n4.cmdline, posix=(os.name != "nt")),
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, env=env)
+        log = process.communicate()[0].decode("utf-8", "replace")
+        if process.returncode != 0:
+            raise RuntimeError("N4BiasFieldCorrection exited with status {0} on {1}\n{2}".format(
+                process.returncode, orig_path, log[-2000:]))
 
-        # Run command line silently in WINDOWS
-        # devnull = open(os.devnull, 'w')
-        # subprocess.call(n4.cmdline.split(" "), stdout=devnull, stderr=devnull)
+        # Stage 2 does not need to decode all outputs to compute
+        # landmarks, each output is decoded once to be transformed
+        self._volume_percentiles(temp_path, pcts_path)
 
         return
 
-    def _intensity_normalization_multi(self, temp_dir):
+    def _intensity_normalization_multi(self, temp_dir, store, landmarks_dir=None):
         '''_INTENSITY_NORMALIZATION_MULTI
 
-            Main function of intensity normalization to map tasks
-            on different cpus to accelerate processing speed.
+            Main function of intensity normalization.
+            (There are four types volumes: Flair, T1, T1c and T2.)
+            Compute landmarks for Flair, T1, T1c and T2 respectively
+            from percentile values saved in Stage 1, and save them in
+            csv files. Then map tasks on different cpus to transform
+            intensities of each volume according to landmarks.
             The number of subprocesses equals to the number of cpus.
 
-            Input:
-            ------
+            Original paper can be found here:
+            http://ieeexplore.ieee.org/abstract/document/836373/
+
+            The job of a volume is done again if its landmarks
+            are changed.
+
+            Inputs:
+            -------
             - temp_dir: path of the temporary directory that outputs
                         of bias field correction have been saved in
+            - store: instance of BTCStore
+            - landmarks_dir: path of the directory which keeps
+                             landmarks csv files, if it is not None,
+                             landmarks are loaded from it
 
         '''
 
         print("Stage 2: Intensity Normalization\n")
-        paras = zip([self] * len(VOLUME_TYPES),
-                    [temp_dir] * len(VOLUME_TYPES),
-                    VOLUME_TYPES)
-        pool = Pool(processes=cpu_count())
-        pool.map(unwrap_intensity_normalization, paras)
+
+        if landmarks_dir is None:
+            # Compute landmarks for each type volumes
+            all_landmarks, all_pcts = {}, {}
+            for vtype in VOLUME_TYPES:
+                all_landmarks[vtype], all_pcts[vtype] = \
+                    self._get_volume_landmarks(temp_dir, vtype)
+            version = self._save_landmarks(temp_dir, all_landmarks)
+        else:
+            all_landmarks, version = self._load_landmarks(landmarks_dir)
+            all_pcts = dict([(vtype, self._load_volume_pcts(temp_dir, vtype))
+                             for vtype in VOLUME_TYPES])
+            # Keep a copy of landmarks with outputs
+            if os.path.abspath(landmarks_dir) != os.path.abspath(temp_dir):
+                self._save_landmarks(temp_dir, all_landmarks)
+
+        print("Version of landmarks: " + version)
+
+        jobs = []
+        for vtype in VOLUME_TYPES:
+            landmarks = all_landmarks[vtype]
+            for vno, pct in zip(self.volume_no, all_pcts[vtype]):
+                name = vno + "_" + vtype
+                in_path = os.path.join(temp_dir, vtype, name + SOURCE_EXTENSION)
+                out_path = os.path.join(temp_dir, vtype, name + TARGET_EXTENSION)
+                jobs.append(store.job(name, unwrap_intensity_transform,
+                                      [(self, in_path, out_path, pct, landmarks)],
+                                      [in_path], [out_path],
+                                      [pct.tolist(), landmarks.tolist(), version]))
+
+        store.run("IntensityTransform", jobs)
 
         return
 
-    def _intensity_normalization(self, temp_dir, vtype):
-        '''_INTENSITY_NORMALIZATION
+    @staticmethod
+    def _landmarks_version(all_landmarks):
+        '''_LANDMARKS_VERSION
 
-            Apply intensity normalization on each type of volumes.
-            (There are four types volumes: Flair, T1, T1c and T2.)
-            Compute landmarks for Flair, T1, T1c and T2 respectively.
-            Obtain intensities at certain percentiles from each volume.
-            Transform each volume intensity according to corresponding
-            landmarks.
+            Compute the version of landmarks, which is the SHA1
+            of percentiles and landmarks of all types volumes.
 
-            Original paper can be found here:
-            http://ieeexplore.ieee.org/abstract/document/836373/
+            Input:
+            ------
+            - all_landmarks: dictionary of landmarks, keys are
+                             types of volumes
+
+            Output:
+            -------
+            - version: the first LANDMARKS_VERSION_LENGTH hex
+                       digits of SHA1
+
+        '''
+
+        info = json.dumps([PCTS, [[vtype, [float(l) for l in all_landmarks[vtype]]]
+                                  for vtype in VOLUME_TYPES]])
+        sha1 = hashlib.sha1(info.encode("utf-8")).hexdigest()
+
+        return sha1[:LANDMARKS_VERSION_LENGTH]
+
+    def _save_landmarks(self, landmarks_dir, all_landmarks):
+        '''_SAVE_LANDMARKS
+
+            Save landmarks of each type volumes into a csv file
+            in landmarks_dir, such as "flair_landmarks.csv".
+            Each file has one row, whose columns are percentiles
+            and the version of landmarks of all types.
 
             Inputs:
             -------
-            - temp_dir: path of temporary folder which keeps the outputs
-                        of bias field correction
-            - vtype: types of volume, flair, t1, t1GD or t2
+            - landmarks_dir: path of the directory to save csv files
+            - all_landmarks: dictionary of landmarks, keys are
+                             types of volumes
+
+            Output:
+            -------
+            - version: version of landmarks
+
+        '''
+
+        version = self._landmarks_version(all_landmarks)
+        columns = PCTS_COLUMNS + [LANDMARKS_VERSION]
+        for vtype in VOLUME_TYPES:
+            landmarks_dict = dict(zip(PCTS_COLUMNS, all_landmarks[vtype]))
+            landmarks_dict[LANDMARKS_VERSION] = version
+            landmarks_df = pd.DataFrame(data=landmarks_dict, columns=columns, index=[0])
+            landmarks_df.to_csv(os.path.join(landmarks_dir, vtype + LANDMARKS_SUFFIX))
+
+        return version
+
+    def _load_landmarks(self, landmarks_dir):
+        '''_LOAD_LANDMARKS
+
+            Load landmarks of all types volumes from csv files
+            saved by _save_landmarks. Raise ValueError if the
+            percentiles are different from PCTS in btc_settings.py,
+            or files are not of one version, or landmarks have
+            been modified since they were saved.
+            Files saved before landmarks had a version have only
+            columns of percentiles, their version is computed from
+            the landmarks. Raise ValueError if only some of files
+            have no version.
+
+            Input:
+            ------
+            - landmarks_dir: path of the directory which keeps
+                             landmarks csv files
+
+            Outputs:
+            --------
+            - all_landmarks: dictionary of landmarks, keys are
+                             types of volumes
+            - version: version of landmarks
+
+        '''
+
+        all_landmarks, versions, unversioned = {}, set(), []
+        for vtype in VOLUME_TYPES:
+            path = os.path.join(landmarks_dir, vtype + LANDMARKS_SUFFIX)
+            if not os.path.isfile(path):
+                raise IOError("Landmarks file " + path + " is not exist.")
+
+            landmarks_df = pd.read_csv(path, index_col=0, dtype={LANDMARKS_VERSION: str})
+            columns = list(landmarks_df.columns)
+            if columns not in [PCTS_COLUMNS, PCTS_COLUMNS + [LANDMARKS_VERSION]]:
+                raise ValueError("Percentiles in " + path +
+                                 " are different from PCTS.")
+
+            all_landmarks[vtype] = landmarks_df[PCTS_COLUMNS].values[0].astype(np.float64)
+            if LANDMARKS_VERSION in columns:
+                versions.add(landmarks_df[LANDMARKS_VERSION].values[0])
+            else:
+                unversioned.append(path)
+
+        if unversioned:
+            if versions:
+                raise ValueError("Landmarks files " + ", ".join(unversioned) +
+                                 " have no version, but others in " +
+                                 landmarks_dir + " have.")
+            # Saved before landmarks had a version
+            return all_landmarks, self._landmarks_version(all_landmarks)
+
+        if len(versions) != 1:
+            raise ValueError("Landmarks files in " + landmarks_dir +
+                             " have different versions.")
+
+        version = versions.pop()
+        if version != self._landmarks_version(all_landmarks):
+            raise ValueError("Landmarks in " + landmarks_dir +
+                             " do not match their version " + version + ".")
+
+        return all_landmarks, version
+
+    def _volume_percentiles(self, in_path, out_path):
+        '''_VOLUME_PERCENTILES
+
+            Extract values from one bias-corrected volume at
+            percentiles PCTS, assigned in btc_settings.py, and
+            save them into out_path.
+
+            Inputs:
+            -------
+            - in_path: path of bias-corrected volume
+            - out_path: path of the .npy file to save percentile values
 
         '''
 
-        # Compute landmarks for each type volumes
-        landmarks, all_volume_pct = self._get_volume_landmarks(temp_dir, vtype)
+        volume = nib.load(in_path).get_data()
 
-        # Save landmarks into csv files
-        landmarks_dict = dict(zip(PCTS_COLUMNS, landmarks))
-        landmarks_df = pd.DataFrame(data=landmarks_dict, columns=PCTS_COLUMNS, index=[0])
-        landmarks_df.to_csv(os.path.join(temp_dir, vtype + "_landmarks.csv"))
+        # Check whether volume's background has the minimum intensity
+        # If not, set the background to the minimum intensity
+        volume_min = np.min(volume)
+        if volume_min < 0:
+            volume[np.where(volume == 0)] = volume_min
+            volume = volume - np.min(volume)
 
-        # Transform volumes' intensity
-        self._intensity_transform(temp_dir, vtype, landmarks, all_volume_pct)
+        # Percentile values of voxels except background
+        np.save(out_path, self._percentile_values(volume[volume > 0]))
 
         return
 
+    @staticmethod
+    def _percentile_values(values):
+        '''_PERCENTILE_VALUES
+
+            Compute values at percentiles PCTS. The value at percentile
+            p is the k-th smallest value, where k = ceil(p * n) - 1,
+            same as reading the sorted values at k, but no full sort
+            is done. Values are counted in integer bins which keep
+            their order:
+            - integer values in a range smaller than HIST_MAX_RANGE,
+              one bin for each value;
+            - positive floats, the bits of which are in the same order
+              as their values, bins are the higher 16 bits.
+            The k-th value is selected from values in its bin only.
+            Others are selected by np.partition.
+
+            Input:
+            ------
+            - values: 1D array of positive intensities of voxels
+
+            Output:
+            -------
+            - array of percentile values, same dtype as values
+
+        '''
+
+        values = np.ascontiguousarray(values)
+        values_len = len(values)
+        ks = [max(int(np.ceil(p * values_len)) - 1, 0) for p in PCTS]
+
+        size = values.dtype.itemsize
+        if values.dtype.kind == "f" and size in [4, 8]:
+            bits = values.view(np.uint32 if size == 4 else np.uint64)
+            keys = (bits >> (8 * size - 16)).astype(np.intp)
+        elif values.dtype.kind in "iu" and \
+                int(np.max(values)) - int(np.min(values)) < HIST_MAX_RANGE:
+            keys = (values - np.min(values)).astype(np.intp)
+        else:
+            return np.partition(values, ks)[ks]
+
+        # The k-th value is in the first bin whose
+        # cumulative count is larger than k
+        counts = np.cumsum(np.bincount(keys))
+        bins = np.searchsorted(counts, ks, side="right")
+
+        # Keep values in those bins
+        wanted = np.zeros(len(counts), dtype=bool)
+        wanted[bins] = True
+        in_bins = wanted[keys]
+        bin_values, bin_keys = values[in_bins], keys[in_bins]
+
+        pcts = []
+        for k, b in zip(ks, bins):
+            k -= counts[b - 1] if b > 0 else 0
+            pcts.append(np.partition(bin_values[bin_keys == b], k)[k])
+
+        return np.array(pcts, dtype=values.dtype)
+
     def _get_volume_landmarks(self, temp_dir, vtype):
         '''_GET_VOLUME_LANDMARKS
 
             Take Flair volumes as example.
-            - Extract values from each volume at centain percentiles,
-              PCTS, which is assigned in btc_settings.py.
+            - Load values from each volume at centain percentiles,
+              PCTS, which have been computed by _volume_percentiles.
             - Ensemble volumes' percentile values into one array.
             - Compute the mean percentile values as the landmarks
               of all Flair volumes.
@@ -370,48 +689,45 @@ class BTCPreprocess():
         '''
 
         print("Compute landmarks of all " + vtype + " volumes")
+        all_volume_pct = self._load_volume_pcts(temp_dir, vtype)
+
+        # Compute mean as landmarks of one certain type volume,
+        # in float64 to be saved in csv and loaded without loss
+        landmarks = np.mean(all_volume_pct, axis=0).astype(np.float64)
+
+        return landmarks, all_volume_pct
+
+    def _load_volume_pcts(self, temp_dir, vtype):
+        '''_LOAD_VOLUME_PCTS
+
+            Load percentile values of one type volumes of all
+            patients, which have been computed by _volume_percentiles.
+
+            Inputs:
+            -------
+            - temp_dir: path of temporary folder which keeps the outputs
+                        of bias field correction
+            - vtype: types of volume, flair, t1, t1Gd or t2
+
+            Output:
+            -------
+            - all_volume_pct: percentile values of all volumes in one type
+
+        '''
+
         all_volume_pct = []
         for vno in self.volume_no:
-            # Load bias-corrected volume
-            file_name = vno + "_" + vtype + SOURCE_EXTENSION
-            path = os.path.join(temp_dir, vtype, file_name)
-            volume = nib.load(path).get_data()
-
-            # Check whether volume's background has the minimum intensity
-            # If not, set the background to the minimum intensity
-            volume_min = np.min(volume)
-            if volume_min < 0:
-                volume[np.where(volume == 0)] = volume_min
-                volume = volume - np.min(volume)
-
-            # Sort voxels by their intensities except background,
-            # which makes it easy to compute percentile values
-            volume = volume[np.where(volume > 0)]
-            sort = np.sort(volume)
-            sort_len = len(sort)
-
-            # Compute percentile values of one volume
-            one_volume_pct = []
-            for p in PCTS:
-                pct_idx = int(np.ceil(p * sort_len)) - 1
-                if pct_idx < 0:
-                    pct_idx = 0
-                one_volume_pct.append(sort[pct_idx])
-
-            # Ensembel all volumes' percentile values into one array
-            all_volume_pct.append(one_volume_pct)
-
-        # Compute mean as landmarks of one certain type volume
-        all_volume_pct = np.array(all_volume_pct)
-        landmarks = np.mean(all_volume_pct, axis=0)
+            file_name = vno + "_" + vtype + PCTS_SUFFIX + TARGET_EXTENSION
+            all_volume_pct.append(np.load(os.path.join(temp_dir, vtype,
+                                                       file_name)))
 
-        return landmarks, all_volume_pct
+        return np.array(all_volume_pct)
 
-    def _intensity_transform(self, temp_dir, vtype, landmarks, pct):
+    def _intensity_transform(self, in_path, out_path, pct, landmarks):
         '''_INTENSITY_TRANSFORM
 
-            Transfor voxels' intensities according to the landmarks.
-            For each volume, there are three classes voxels:
+            Transfor voxels' intensities of one volume according to
+            the landmarks. There are three classes voxels:
             - 1. voxels have higher intensities than its maximum percentile value;
             - 2. voxels have lower intensities than its minimum percentile value;
             - 3. voxels have proper intensities.
@@ -421,58 +737,51 @@ class BTCPreprocess():
             For voxels 3, transform intensitied to new percentile values
             as landmarks via interpolation.
 
+            The minimum percentile value is the minimum of foreground,
+            so voxels 2 are background, and interpolation gives the
+            maximum value of landmarks to voxels 1. Only one mask of
+            foreground is needed. Intensities of integer volumes are
+            transformed by a lookup table.
+
             Inputs:
             -------
-            - temp_dir: path of temporary folder which keeps the outputs
-                        of bias field correction
-            - vtype: types of volume, Flair, T1, T1c or T2
+            - in_path: path of the bias-corrected volume
+            - out_path: path to save the transformed volume
+            - pct: original percentile values of the volume
             - landmarks: new percentile values computed from
                          all volumes of a certain type
-            - pct: original percentile values of volumes of a certain type
 
         '''
 
-        print("Transform intensity of all " + vtype + " volumes")
-        for i in range(len(self.volume_no)):
-            # Load bias-corrected volume
-            file_name = self.volume_no[i] + "_" + vtype + SOURCE_EXTENSION
-            path = os.path.join(temp_dir, vtype, file_name)
-            volume = nib.load(path).get_data()
-
-            # Check whether volume's background has the minimum intensity
-            # If not, set the background to the minimum intensity
-            volume_min = np.min(volume)
-            if volume_min < 0:
-                volume[np.where(volume == 0)] = volume_min
-                volume = volume - np.min(volume)
-
-            # Indices of voxels whose intensities are
-            # higher than its own maximum percentile value,
-            # regard them as higher-voxels
-            higher_idx = np.where(volume >= pct[i, -1])
-            # Indices of voxels whose intensities are
-            # lower than its own minimum percentile value,
-            # regard them as lower-voxels
-            lower_idx = np.where(volume < pct[i, 0])
-            # Indices of voxels that are not background
-            non_bg_idx = np.where(volume > 0)
-
-            # Transform foreground voxels to new intensities
-            volume[non_bg_idx] = np.interp(volume[non_bg_idx], pct[i, :], landmarks)
-            # Set maximum percentile value of landmarks to higher-voxels
-            volume[higher_idx] = landmarks[-1]
-            # Set 0 to lower-voxels
-            volume[lower_idx] = 0
-
-            # Save transformed volumes into temporary folder
-            file_name = self.volume_no[i] + "_" + vtype + TARGET_EXTENSION
-            np.save(os.path.join(temp_dir, vtype, file_name), volume)
-
-        print(vtype + ": Done")
+        print("Transform intensity of " + os.path.basename(in_path))
+
+        # Load bias-corrected volume
+        volume = nib.load(in_path).get_data()
+
+        # Check whether volume's background has the minimum intensity
+        # If not, set the background to the minimum intensity
+        volume_min = np.min(volume)
+        if volume_min < 0:
+            volume[np.where(volume == 0)] = volume_min
+            volume = volume - np.min(volume)
+
+        # Voxels that are not background
+        non_bg = volume > 0
+
+        # Transform foreground voxels to new intensities
+        transformed = np.zeros_like(volume)
+        if np.issubdtype(volume.dtype, np.integer):
+            lut = np.interp(np.arange(np.max(volume) + 1), pct, landmarks)
+            transformed[non_bg] = lut[volume[non_bg]]
+        else:
+            transformed[non_bg] = np.interp(volume[non_bg], pct, landmarks)
+
+        # Save transformed volume into temporary folder
+        np.save(out_path, transformed)
 
         return
 
-    def _merge_to_one_volume_multi(self, input_dir, temp_dir):
+    def _merge_to_one_volume_multi(self, input_dir, temp_dir, store):
         '''_MERGE_TO_ONE_VOLUME_MULTI
 
             Main function of merging four types volumes and saving outputs
@@ -484,17 +793,25 @@ class BTCPreprocess():
             - input_dir: path of the directory which keeps mask volumes
             - temp_dir: path of temporary folder which keeps the outputs
                         of intensity transformation
+            - store: instance of BTCStore
 
         '''
 
+        jobs = []
+        for vno in self.volume_no:
+            inputs = [os.path.join(temp_dir, vtype,
+                                   vno + "_" + vtype + TARGET_EXTENSION)
+                      for vtype in VOLUME_TYPES]
+            inputs.append(os.path.join(input_dir, vno, vno + "_" +
+                                       MASK_NAME + SOURCE_EXTENSION))
+            outputs = [os.path.join(self.full_folder, vno + CHUNKS_EXTENSION),
+                       os.path.join(self.mask_folder, vno + CHUNKS_EXTENSION)]
+            jobs.append(store.job(vno, unwrap_merge_to_one_volume,
+                                  [(self, input_dir, temp_dir, vno)],
+                                  inputs, outputs, [EDGE_SPACE, CHUNK_SHAPE]))
+
         print("Stage 3: Merge flair, t1, t1Gd and t2 into One Volume")
-        volume_no_len = len(self.volume_no)
-        paras = zip([self] * volume_no_len,
-                    [input_dir] * volume_no_len,
-                    [temp_dir] * volume_no_len,
-                    self.volume_no)
-        pool = Pool(processes=cpu_count())
-        pool.map(unwrap_merge_to_one_volume, paras)
+        store.run("MergeToOneVolume", jobs)
 
         return
 
@@ -504,6 +821,8 @@ class BTCPreprocess():
             Merge normalized flair, t1, t1Gd and t2 volumes of one patient
             to one volume. Remove surrounding backgrounds, and save output
             into output folder as the result of preprocessing.
+            Outputs are saved in chunks by save_chunks, and masks are
+            saved as uint8.
 
             Inputs:
             -------
@@ -516,7 +835,7 @@ class BTCPreprocess():
         '''
 
         print("NO." + vno + ": Save brain volume and mask volume")
-        full_volume = np.zeros(FULL_SHAPE)
+        full_volume = np.zeros(FULL_SHAPE, dtype=np.float32)
         for i in range(len(VOLUME_TYPES)):
             # Load intensity-transformed volume
             file_name = vno + "_" + VOLUME_TYPES[i] + TARGET_EXTENSION
@@ -540,11 +859,11 @@ class BTCPreprocess():
         full_volume, mask_volume = self._keep_minimum_volume(full_volume, mask_volume)
 
         # Save volume into output folders
-        full_volume_path = os.path.join(self.full_folder, vno + TARGET_EXTENSION)
-        mask_volume_path = os.path.join(self.mask_folder, vno + TARGET_EXTENSION)
+        full_volume_path = os.path.join(self.full_folder, vno + CHUNKS_EXTENSION)
+        mask_volume_path = os.path.join(self.mask_folder, vno + CHUNKS_EXTENSION)
 
-        np.save(full_volume_path, full_volume)
-        np.save(mask_volume_path, mask_volume)
+        save_chunks(full_volume_path, full_volume)
+        save_chunks(mask_volume_path, mask_volume.astype(np.uint8))
 
         return
 
@@ -655,4 +974,11 @@ if __name__ == "__main__":
     input_dir = os.path.join(parent_dir, DATA_FOLDER, ORIGINAL_FOLDER)
     output_dir = os.path.join(parent_dir, DATA_FOLDER, PREPROCESSED_FOLDER)
     temp_dir = os.path.join(TEMP_FOLDER, PREPROCESSED_FOLDER)
-    BTCPreprocess(input_dir, output_dir, temp_dir, preprocess=True)
+
+    if len(sys.argv) > 1:
+        # Normalize given cases, or all cases, with saved landmarks
+        cases = sys.argv[2:] if len(sys.argv) > 2 else None
+        BTCPreprocess(input_dir, output_dir, temp_dir, preprocess=True,
+                      landmarks_dir=sys.argv[1], cases=cases)
+    else:
+        BTCPreprocess(input_dir, output_dir, temp_dir, preprocess=True)
@@ -0,0 +1,265 @@
+# Brain Tumor Classification
+# Script for Resampling Volumes in Threads
+
+#     ,,,         ,,,
+#   ;"   ';     ;'   ",
+#   ;  @.ss$$$$$$s.@  ;
+#   `s$$$$$$$$$$$$$$$'
+#   $$$$$$$$$$$$$$$$$$
+#  $$$$P""Y$$$Y""W$$$$$
+#  $$$$  p"$$$"q  $$$$$
+#  $$$$  .$$$$$.  $$$$'
+#   $$$DaU$$O$$DaU$$$'
+#    '$$$$'.^.'$$$$'
+#       '&$$$$$&'
+
+'''
+
+Resampling of Volumes and Slices
+
+A replacement of scipy.ndimage.zoom which has the same output
+shape and the same grid (corners of input and output are aligned).
+The output is split into chunks along the first axis, and chunks
+are interpolated in a pool of threads, thus one large volume is
+resampled by several cores even if it is the only task of a
+process pool.
+
+-1- order=1 and prefilter=False: separable linear interpolation,
+    one axis after another, computed in float32.
+-2- Other orders without prefilter: each chunk is interpolated by
+    scipy from a slab of input which overlaps its neighbours by
+    the support of the spline.
+-3- With prefilter: the whole volume is filtered by a global
+    spline filter, thus it is resampled by zoom in one thread.
+
+Chunks are along the first axis rather than the channels, since
+splines of order larger than 1 in zoom also span channels.
+
+Outputs equal to zoom in mirror mode, which is the same as the
+default constant mode inside the input. Except that zoom in
+constant mode may fill the last row with zero, if the rounded
+coordinate of that row is out of the input by a tiny distance.
+
+Usage example:
+
+    factor = [ns / float(vs) for ns, vs in zip(VOLUME_SHAPE, vshape)]
+    resized = resample(volume, factor, order=1, output=volume.dtype)
+
+In a pool of processes, threads of each process are given by
+pool_threads, so that processes x threads is no more than the
+number of cpus. Small slices are resampled in one thread.
+
+    threads = pool_threads(len(names))
+    resized = resample(volume, factor, order=1, output=volume.dtype,
+                       threads=threads)
+
+'''
+
+
+from __future__ import print_function
+
+import os
+import numpy as np
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from scipy.ndimage import zoom, affine_transform
+
+
+# The maximum rows of output in one chunk, which bounds the
+# memory of intermediates to a small part of the volume
+CHUNK_ROWS = 16
+
+# Thread pools of this process, keyed by the number of threads,
+# a pool inherited from a forked parent is not used
+_POOLS = {}
+
+
+def _thread_pool(threads):
+    '''_THREAD_POOL
+
+        Return a pool with given number of threads which
+        is created in this process.
+
+    '''
+
+    key = (os.getpid(), threads)
+    if key not in _POOLS:
+        _POOLS[key] = ThreadPool(processes=threads)
+
+    return _POOLS[key]
+
+
+def pool_threads(tasks, processes=-1):
+    '''POOL_THREADS
+
+        Return the number of threads of resample in each
+        process of a pool which runs tasks. Busy processes
+        x threads is no more than the number of cpus.
+
+        Inputs:
+        -------
+        - tasks: the number of tasks of the pool
+        - processes: the number of processes of the pool,
+                     default is -1, which uses all cpus
+
+        Output:
+        -------
+        - threads: the number of threads, at least 1
+
+    '''
+
+    if processes == -1 or processes > cpu_count():
+        processes = cpu_count()
+
+    return max(cpu_count() // max(min(processes, tasks), 1), 1)
+
+
+def zoom_shape(shape, factor):
+    '''ZOOM_SHAPE
+
+        Return the output shape of zooming an array in
+        shape by factor, the same as scipy.ndimage.zoom.
+
+    '''
+
+    return [int(round(s * f)) for s, f in zip(shape, factor)]
+
+
+def _scales(in_shape, out_shape):
+    '''_SCALES
+
+        The i-th output index along each axis is sampled at
+        i * scale of input, corners of both grids are aligned.
+
+    '''
+
+    return [(i - 1) / float(o - 1) if o > 1 else 1.0
+            for i, o in zip(in_shape, out_shape)]
+
+
+def _linear(array, axis, coords):
+    '''_LINEAR
+
+        Linear interpolation of array at coords along axis,
+        coords are in the range of [0, size of axis - 1].
+
+    '''
+
+    size = array.shape[axis]
+    low = np.clip(np.floor(coords).astype(np.intp), 0, max(size - 2, 0))
+    high = np.minimum(low + 1, size - 1)
+
+    shape = [1] * array.ndim
+    shape[axis] = -1
+    weight = (coords - low).astype(np.float32).reshape(shape)
+
+    # Both are new arrays, interpolate in place
+    lower = np.take(array, low, axis=axis).astype(np.float32, copy=False)
+    upper = np.take(array, high, axis=axis).astype(np.float32, copy=False)
+    lower *= 1 - weight
+    upper *= weight
+    lower += upper
+
+    return lower
+
+
+def _linear_chunk(volume, out_shape, scales, begin, end):
+    '''_LINEAR_CHUNK
+
+        Rows [begin, end) of output by linear interpolation,
+        the first axis is interpolated first to read only rows
+        of this chunk, then other axes whose size is changed.
+
+    '''
+
+    chunk = _linear(volume, 0, np.arange(begin, end) * scales[0])
+    for axis in range(1, volume.ndim):
+        if out_shape[axis] != volume.shape[axis]:
+            coords = np.arange(out_shape[axis]) * scales[axis]
+            chunk = _linear(chunk, axis, coords)
+
+    return chunk
+
+
+def _spline_chunk(volume, out_shape, scales, begin, end, order):
+    '''_SPLINE_CHUNK
+
+        Rows [begin, end) of output by spline interpolation
+        without prefilter, from the slab of input which covers
+        the support of splines at these rows.
+
+    '''
+
+    margin = order + 1
+    first = max(int(np.floor(begin * scales[0])) - margin, 0)
+    last = min(int(np.floor((end - 1) * scales[0])) + margin + 1, volume.shape[0])
+
+    # Mirror mode, since rounding of the offset may move the
+    # last row of input out of the slab by a tiny distance
+    offset = [begin * scales[0] - first] + [0.0] * (volume.ndim - 1)
+    return affine_transform(volume[first:last], scales, offset=offset,
+                            output_shape=[end - begin] + list(out_shape[1:]),
+                            output=np.float32, order=order, prefilter=False,
+                            mode="mirror")
+
+
+def resample(volume, factor, order=1, prefilter=False,
+             output=np.float32, threads=None):
+    '''RESAMPLE
+
+        Resample volume by factor as scipy.ndimage.zoom.
+
+        Inputs:
+        -------
+        - volume: array to be resampled, such as (X, Y, Z, C)
+                  volumes or (X, Y, C) slices
+        - factor: zoom factor of each axis
+        - order: the order of spline, default is 1
+        - prefilter: whether to apply spline filter before
+                     interpolation, default is False
+        - output: dtype of output, default is np.float32, values
+                  are rounded if it is an integer type as zoom
+        - threads: the number of threads, default is None,
+                   which uses all cores
+
+        Output:
+        -------
+        - resampled: resampled array in dtype of output
+
+    '''
+
+    out_shape = zoom_shape(volume.shape, factor)
+    output = np.dtype(output)
+
+    if prefilter and order > 1:
+        return zoom(volume, zoom=factor, order=order,
+                    prefilter=True, output=output)
+
+    scales = _scales(volume.shape, out_shape)
+    resampled = np.empty(out_shape, dtype=np.float32)
+
+    def resample_chunk(rows):
+        begin, end = rows
+        if order == 1:
+            chunk = _linear_chunk(volume, out_shape, scales, begin, end)
+        else:
+            chunk = _spline_chunk(volume, out_shape, scales, begin, end, order)
+        resampled[begin:end] = chunk
+        return
+
+    threads = cpu_count() if threads is None else threads
+    num = max(threads, int(np.ceil(out_shape[0] / float(CHUNK_ROWS))))
+    bounds = np.linspace(0, out_shape[0], min(num, out_shape[0]) + 1)
+    bounds = np.round(bounds).astype(int)
+    chunks = list(zip(bounds[:-1], bounds[1:]))
+
+    if len(chunks) > 1 and threads > 1:
+        _thread_pool(threads).map(resample_chunk, chunks)
+    else:
+        list(map(resample_chunk, chunks))
+
+    if output.kind in "iu":
+        # Round half away from zero as zoom
+        resampled = np.trunc(resampled + np.copysign(0.5, resampled))
+
+    return resampled.astype(output, copy=False)
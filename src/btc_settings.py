@@ -64,18 +64,44 @@ N4_DIMENSION = 3
 N4_THRESHOLD = 1e-4
 N4_SHRINK_FACTOR = 5
 N4_ITERATION = [100, 100, 60, 40]
+# ITK threads of each N4 job, the number of concurrent
+# N4 jobs is the number of cpus divided by N4_THREADS
+N4_THREADS = 4
+ITK_THREADS_ENV = "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS"
+# The environment variable to replace the N4BiasFieldCorrection
+# executable, such as a stand-in script in tests
+N4_COMMAND_ENV = "BTC_N4"
 
 
 # Parameters for Intensity Normalization
 PCTS = [0, 0.1, 0.2, 0.3, 0.4, 0.5,
         0.6, 0.7, 0.8, 0.9, 0.998]
 PCTS_COLUMNS = [str(p) for p in PCTS]
+PCTS_SUFFIX = "_pcts"
+# Landmarks of each type volumes are saved in "<type>_landmarks.csv"
+# with the version of landmarks of all types
+LANDMARKS_SUFFIX = "_landmarks.csv"
+LANDMARKS_VERSION = "version"
+LANDMARKS_VERSION_LENGTH = 12
+# Percentiles of integer volumes whose range of intensities
+# is smaller than this are read from histograms
+HIST_MAX_RANGE = 2 ** 24
 
 
 # Parameters for Keep Minimum Volume
 EDGE_SPACE = 10
 
 
+# Parameters for Chunked Volumes
+# Full and mask volumes are saved in chunks, each chunk
+# is compressed respectively, regions can be read partially
+CHUNKS_EXTENSION = ".npc"
+CHUNK_SHAPE = [32, 32, 32]
+CHUNK_LEVEL = 1
+# The number of decompressed chunks kept in memory
+CHUNK_CACHE_SIZE = 256
+
+
 '''
 Settings for Patches or Volumes Generation
 '''
@@ -91,8 +117,9 @@ VOLUME_ONE_CHANNEL_SHAPE = [112, 112, 88, 1]
 SLICE_SHAPE = [112, 112, CHANNELS]
 RESIZE_FOLDER = "resize"
 TUMOR_FOLDER = "tumor"
-SHAPE_FILE = "shape.txt"
-SHAPE_FILE_SPLIT = "\n"
+# Bytes of extracted patches kept in memory until they are
+# resized, patches out of it are saved in temporary folder
+PATCHES_CACHE_SIZE = 2 ** 31
 
 # Values in Tumor Mask
 NCRNET_MASK = 1  # Necrotic and the Non-Enhancing tumor
@@ -137,6 +164,18 @@ GRADE_II_PARTIALS = 4
 GRADE_III_PARTIALS = 4
 GRADE_IV_PARTIALS = 2
 
+# Partial patches are not saved, they are recorded in an index
+# file, each record is a partial patch of a mirror of one patch
+AUGMENT_INDEX_FILE = "augment.csv"
+INDEX_NAME = "Name"
+INDEX_PATCH = "Patch"
+INDEX_MIRROR = "Mirror"
+INDEX_BEGIN = ["Begin_0", "Begin_1", "Begin_2"]
+NO_MIRROR = -1
+HORIZONTAL_MIRROR = 0
+VERTICAL_MIRROR = 1
+AXISYMMETRIC_MIRROR = 2
+
 
 '''
 Settings for Class of BTCTFRecords
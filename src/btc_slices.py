@@ -34,8 +34,11 @@ import warnings
 import numpy as np
 import pandas as pd
 from btc_settings import *
+from btc_trace import trace
+from btc_chunks import open_volume, load_volume
+from btc_augment_ops import flip, jitter_intensity
 from multiprocessing import Pool, cpu_count
-from scipy.ndimage.interpolation import zoom
+from btc_resample import resample
 
 
 # Ignore the warning caused by SciPy
@@ -45,12 +48,13 @@ warnings.simplefilter("ignore", UserWarning)
 # Helper function to do multiprocessing of
 # BTCSlices._resize_slice
 def unwrap_resize_slice(arg, **kwarg):
-    return BTCSlices._resize_slice(*arg, **kwarg)
+    with trace("resize_slice", arg[1]):
+        return BTCSlices._resize_slice(*arg, **kwarg)
 
 
 class BTCSlices():
 
-    def __init__(self, input_dir, output_dir, label_file):
+    def __init__(self, input_dir, output_dir, label_file, run=True):
         '''__INIT__
 
             Initialization of class to generate input path
@@ -63,6 +67,9 @@ class BTCSlices():
                           store outputs
             - label_file: the path of file which has labels
                           of all cases
+            - run: whether to extract slices now, default is True,
+                   BTCExtract sets it to False and calls
+                   BTCSlices._resize_slice on cases it has loaded
 
         '''
 
@@ -86,7 +93,8 @@ class BTCSlices():
         self.labels = pd.read_csv(label_file)
 
         # Extract and resize slices
-        self._resize_slice_multi()
+        if run:
+            self._resize_slice_multi()
 
         return
 
@@ -123,16 +131,19 @@ class BTCSlices():
 
         return
 
-    def _resize_slice(self, case_name):
+    def _resize_slice(self, case_name, volume=None, mask=None):
         '''_RESIZE_SLICE
 
             Extract slice from brai volumes at where
             the tumor core locates, and resize all slices
             into same shape.
 
-            Input:
-            ------
+            Inputs:
+            -------
             - case_name: string, the name of input volume
+            - volume, mask: the volume and its mask if they have
+                            been loaded, default is None, they
+                            are read from input folders
 
         '''
 
@@ -154,45 +165,42 @@ class BTCSlices():
                      EDGE_SPACE:vshape[1] - EDGE_SPACE,
                      EDGE_SPACE:vshape[2] - EDGE_SPACE]
 
-        # Extract sub-volume that has tumor's core
+        # Extract sub-volume that has tumor's core,
+        # volume still has edge space, only slices which
+        # may have tumor's core are read from it
         def extract_core_volume(volume, mask):
-            # Obtain the number of slices
-            num_slices = mask.shape[-1]
             # Obtain the area of each slice
             slice_area = mask.shape[0] * mask.shape[1]
-            # Inialize a empty list to save slice number
-            # that needs to be kept
-            core_nums = []
 
-            # In each slice of the volume, if there is tumor's core
-            # this slice will be extracted
-            for i in range(num_slices):
-                core_pos = np.where(mask[:, :, i] >= MASK_THRESHOLD)
-                core_nums.append(len(core_pos[0]))
+            # The area of tumor's core in each slice
+            core_nums = np.count_nonzero(mask >= MASK_THRESHOLD, axis=(0, 1))
 
             # Compute a threshold to remove some slices in which
             # the area of tumor's core is too small
-            min_core_num = int(max(core_nums) * PROP_THRESHOLD)
-            core_slice_idxs = []
-            for i in range(num_slices):
-                if core_nums[i] >= min_core_num:
-                    large_object = True
-                    for c in range(CHANNELS):
-                        # Check brain's area in each channel
-                        non_bg_area = len(np.where(volume[:, :, i, c] > 0)[0])
-                        # If brain's area is too small, the slice will
-                        # not be taken into consideration
-                        if non_bg_area / slice_area < PROP_NON_BG:
-                            large_object = False
-                    if large_object:
-                        core_slice_idxs.append(i)
+            min_core_num = int(np.max(core_nums) * PROP_THRESHOLD)
+            core_slice_candidates = np.flatnonzero(core_nums >= min_core_num)
+
+            # Read slices from the first candidate to the last one
+            # without edge space
+            first, last = core_slice_candidates[0], core_slice_candidates[-1]
+            vshape = list(volume.shape)
+            volume = volume[EDGE_SPACE:vshape[0] - EDGE_SPACE,
+                            EDGE_SPACE:vshape[1] - EDGE_SPACE,
+                            EDGE_SPACE + first:EDGE_SPACE + last + 1]
+
+            # Check brain's area of each slice in each channel,
+            # if brain's area is too small in any channel, the
+            # slice will not be taken into consideration
+            non_bg_areas = np.count_nonzero(volume[..., :CHANNELS] > 0, axis=(0, 1))
+            large_object = np.all(non_bg_areas / slice_area >= PROP_NON_BG, axis=1)
+            core_slice_idxs = core_slice_candidates[large_object[core_slice_candidates - first]]
 
             # print(len(core_slice_idxs))
 
             if len(core_slice_idxs) > 0:
                 # Extract sub-volumes
-                min_core_slice_idx = min(core_slice_idxs)
-                max_core_slice_idx = max(core_slice_idxs) + 1
+                min_core_slice_idx = min(core_slice_idxs) - first
+                max_core_slice_idx = max(core_slice_idxs) + 1 - first
                 return volume[:, :, min_core_slice_idx:max_core_slice_idx, :]
             else:
                 return None
@@ -205,40 +213,14 @@ class BTCSlices():
             left_pad_size = int(pad_size / 2.0)
             right_pad_size = pad_size - left_pad_size
 
-            vshape[1] = left_pad_size
-            left_pad = np.zeros(vshape)
-            vshape[1] = right_pad_size
-            right_pad = np.zeros(vshape)
-            return np.hstack((left_pad, volume, right_pad))
-
-        # Slightly modify intensity of given volume.
-        # The scope of modification can be set in btc_settings.py.
-        def modify_intensity(image):
-            temp = np.copy(image)
-            # Modify intensity in each channel respectively
-            for c in range(CHANNELS):
-                ctemp = np.reshape(temp[..., c], ((1, -1)))[0]
-                non_bg_index = np.where(ctemp > 0)
-                # Randomly generate the sign,
-                # if positive, increase intensity of each pixel;
-                # if negative, decrease intensity of each pixel
-                sign = np.random.randint(2, size=1)[0] * 2 - 1
-
-                for i in non_bg_index:
-                    # Randomly generate how much, in percentage, the intrensity
-                    # of a voxel will be modified
-                    scope = np.random.randint(10, 31, size=1)[0] / 100
-                    ctemp[i] = ctemp[i] * (1 + sign * scope)
-
-                temp[..., c] = np.reshape(ctemp, temp[..., c].shape)
-
-            return temp
+            pad_width = [(0, 0)] * len(vshape)
+            pad_width[1] = (left_pad_size, right_pad_size)
+            return np.pad(volume, pad_width, mode="constant")
 
         # The function to obtain the augmentations
         # of input slice to enlarge dataset
         def augmentation(image, grade):
-            slices = [image, np.fliplr(image)]
-            modins_slices = []
+            slices = flip(image[None], 1, [False, True], [0, 0])
 
             # Set the number of augmented slices to be generated
             if grade == GRADE_II:
@@ -246,29 +228,30 @@ class BTCSlices():
             elif grade == GRADE_III:
                 augment_num = 3
             elif grade == GRADE_IV:
-                return slices
+                return list(slices)
             else:
                 raise ValueError("Unknown grade.")
 
-            # Modify intensity of the slice selected randomly
-            for i in range(augment_num):
-                index = np.random.randint(2, size=1)[0]
-                modins_slices.append(modify_intensity(slices[index]))
-
-            slices += modins_slices
+            # Slightly modify intensity of the slices selected randomly
+            index = np.random.randint(2, size=augment_num)
+            modins_slices = jitter_intensity(slices[index], scope=[10, 30])
 
-            return slices
+            return list(slices) + list(modins_slices)
 
         print("Resize slices in " + case_name)
 
         # Load volume and its mask
-        case_path = os.path.join(self.full_dir, case_name)
-        mask_path = os.path.join(self.mask_dir, case_name)
-        volume = remove_edgespace(np.load(case_path))
-        mask = remove_edgespace(np.load(mask_path))
+        if volume is None:
+            case_path = os.path.join(self.full_dir, case_name)
+            mask_path = os.path.join(self.mask_dir, case_name)
+            with trace("load", reads=[mask_path]):
+                volume = open_volume(case_path)
+                mask = load_volume(mask_path)
+        mask = remove_edgespace(mask)
 
         # Obtain sub-volume that contains tumor's core
-        volume = extract_core_volume(volume, mask)
+        with trace("select"):
+            volume = extract_core_volume(volume, mask)
 
         if volume is None:
             return
@@ -291,22 +274,26 @@ class BTCSlices():
             print("The grade of case " + case_no + " is unknown")
             return
 
-        # Resize slices in sub-volumes and save it into folder
+        # Resize slices in sub-volumes and save it into folder,
+        # each slice is too small to be split into threads
         for i in range(vshape[2]):
             vslice = pad_volume[:, :, i, :]
-            resized_slice = zoom(vslice, zoom=factor, order=1, prefilter=False)
-            resized_slice = resized_slice.astype(vslice.dtype)
+            with trace("zoom"):
+                resized_slice = resample(vslice, factor, order=1,
+                                         output=vslice.dtype, threads=1)
 
             # Obtain the augmentations of resized slice
             # slices = augmentation(resized_slice, case_grade)'
             slices = [resized_slice]
             if case_grade != GRADE_IV:
-                slices += [np.fliplr(resized_slice)]
+                slices += [flip(resized_slice[None], 1)[0]]
 
             # Write file into folder
             for j in range(len(slices)):
                 save_file_name = str(i) + "_" + str(j) + TARGET_EXTENSION
-                np.save(os.path.join(save_dir, save_file_name), slices[j])
+                save_path = os.path.join(save_dir, save_file_name)
+                with trace("save", writes=[save_path]):
+                    np.save(save_path, slices[j])
 
         return
 
@@ -0,0 +1,280 @@
+# Brain Tumor Classification
+# Script for Artifact Store of Preprocessing
+
+#     ,,,         ,,,
+#   ;"   ';     ;'   ",
+#   ;  @.ss$$$$$$s.@  ;
+#   `s$$$$$$$$$$$$$$$'
+#   $$$$$$$$$$$$$$$$$$
+#  $$$$P""Y$$$Y""W$$$$$
+#  $$$$  p"$$$"q  $$$$$
+#  $$$$  .$$$$$.  $$$$'
+#   $$$DaU$$O$$DaU$$$'
+#    '$$$$'.^.'$$$$'
+#       '&$$$$$&'
+
+'''
+
+Class BTCStore
+
+-1- Key each job of a preprocessing stage by the stage name,
+    its parameters, its output paths and the content hashes
+    of its input files.
+-2- Skip jobs whose key has been recorded as done in the
+    manifest and whose outputs still exist.
+-3- Run the other jobs in multiple processes, retry failed
+    jobs and record them in the manifest instead of
+    aborting all processes.
+
+Layout of the manifest, store_dir/manifest.json:
+
+    {"files":  {path: [mtime, size, sha1], ...},
+     "stages": {stage: {job: {"key", "status",
+                              "error", "time"}, ...}, ...}}
+
+'''
+
+
+from __future__ import print_function
+
+import os
+import json
+import time
+import hashlib
+import traceback
+from multiprocessing import Pool, cpu_count
+
+
+# Helper function to run one job in a subprocess,
+# the exception is returned instead of being raised
+def run_job(arg):
+    idx, func, args = arg
+    start = time.time()
+    try:
+        func(*args)
+    except Exception:
+        return idx, traceback.format_exc(), time.time() - start
+    return idx, None, time.time() - start
+
+
+class BTCStore():
+
+    def __init__(self, store_dir=None):
+        '''__INIT__
+
+            Initialization of class BTCStore, load the manifest
+            if it exists in store_dir.
+
+            Input:
+            ------
+            - store_dir: path of the directory which keeps the
+                         manifest, if it is None, nothing will be
+                         saved, but failed jobs are still retried
+                         and reported
+
+        '''
+
+        self.store_dir = store_dir
+        self.manifest = {"files": {}, "stages": {}}
+
+        if store_dir is not None:
+            if not os.path.isdir(store_dir):
+                os.makedirs(store_dir)
+            self.manifest_path = os.path.join(store_dir, "manifest.json")
+            if os.path.isfile(self.manifest_path):
+                with open(self.manifest_path, "r") as f:
+                    self.manifest = json.load(f)
+
+        return
+
+    def save(self):
+        '''SAVE
+
+            Write the manifest into a temporary file and rename it,
+            a crash never leaves a partial manifest.
+
+        '''
+
+        if self.store_dir is None:
+            return
+
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.rename(temp_path, self.manifest_path)
+
+        return
+
+    def file_hash(self, path):
+        '''FILE_HASH
+
+            Compute SHA1 of the file's content. A file is hashed
+            again only if its mtime or size has been changed.
+            The hash of a directory is computed from the names
+            and hashes of all files in it.
+
+            Input:
+            ------
+            - path: path of file or directory
+
+            Output:
+            -------
+            - hex digest of SHA1
+
+        '''
+
+        if os.path.isdir(path):
+            items = [[name, self.file_hash(os.path.join(path, name))]
+                     for name in sorted(os.listdir(path))]
+            return hashlib.sha1(json.dumps(items).encode("utf-8")).hexdigest()
+
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        cached = self.manifest["files"].get(abs_path)
+        if cached is not None and cached[:2] == [stat.st_mtime, stat.st_size]:
+            return cached[2]
+
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        self.manifest["files"][abs_path] = [stat.st_mtime, stat.st_size, digest]
+
+        return digest
+
+    def job_key(self, stage, job):
+        '''JOB_KEY
+
+            Compute the key of a job from the stage name, its
+            parameters, the hashes of its inputs and its output paths.
+
+        '''
+
+        hashes = [self.file_hash(path) for path in job["inputs"]]
+        info = json.dumps([stage, job["paras"], hashes, job["outputs"]],
+                          sort_keys=True, default=str)
+        return hashlib.sha1(info.encode("utf-8")).hexdigest()
+
+    def is_done(self, stage, job, key):
+        '''IS_DONE
+
+            Check whether the job has been done with the same key,
+            and all its outputs still exist.
+
+        '''
+
+        record = self.manifest["stages"].get(stage, {}).get(job["name"])
+        if record is None or record["status"] != "done":
+            return False
+        if record["key"] != key:
+            return False
+        return all([os.path.exists(path) for path in job["outputs"]])
+
+    def record(self, stage, name, key, error=None, seconds=None):
+        '''RECORD
+
+            Record the job as done if error is None,
+            otherwise as failed with the error message.
+            The runtime of the job is kept in seconds.
+
+        '''
+
+        records = self.manifest["stages"].setdefault(stage, {})
+        records[name] = {"key": key,
+                         "status": "done" if error is None else "failed",
+                         "error": error,
+                         "seconds": seconds,
+                         "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+        self.save()
+
+        return
+
+    @staticmethod
+    def job(name, func, args, inputs=[], outputs=[], paras=None):
+        '''JOB
+
+            Generate one job.
+
+            Inputs:
+            -------
+            - name: unique name of the job in its stage
+            - func: function to be called as func(*args)
+            - args: arguments of func
+            - inputs: paths of input files or directories
+            - outputs: paths of files the job should write
+            - paras: parameters which affect outputs
+
+        '''
+
+        return {"name": name, "func": func, "args": args,
+                "inputs": inputs, "outputs": outputs, "paras": paras}
+
+    def run(self, stage, jobs, processes=-1, retries=1):
+        '''RUN
+
+            Run jobs which have not been done in multiple processes.
+            Jobs are started in the order of the list.
+            A job fails if it raises an exception or any of its
+            outputs does not exist. Failed jobs are retried at most
+            retries times, and then recorded as failed.
+            A job whose inputs are missing is recorded as failed
+            without being run.
+
+            Inputs:
+            -------
+            - stage: name of the stage
+            - jobs: list of jobs generated by BTCStore.job
+            - processes: number of processes, -1 to use all CPUs
+            - retries: times to retry failed jobs
+
+            Output:
+            -------
+            - names of failed jobs
+
+        '''
+
+        keys, pending = {}, []
+        for i, job in enumerate(jobs):
+            try:
+                keys[i] = self.job_key(stage, job)
+            except OSError as e:
+                self.record(stage, job["name"], None,
+                            "Missing input: " + str(e))
+                continue
+            if not self.is_done(stage, job, keys[i]):
+                pending.append(i)
+
+        print("{0}: {1} jobs, {2} to run".format(stage, len(jobs), len(pending)))
+        if processes == -1 or processes > cpu_count():
+            processes = cpu_count()
+
+        for attempt in range(retries + 1):
+            if len(pending) == 0:
+                break
+            if attempt > 0:
+                print("{0}: retry {1} failed jobs".format(stage, len(pending)))
+
+            pool = Pool(processes=processes)
+            paras = [[i, jobs[i]["func"], jobs[i]["args"]] for i in pending]
+            failed = []
+            for i, error, seconds in pool.imap_unordered(run_job, paras):
+                missing = [path for path in jobs[i]["outputs"]
+                           if not os.path.exists(path)]
+                if error is None and len(missing) > 0:
+                    error = "Missing output: " + ", ".join(missing)
+                self.record(stage, jobs[i]["name"], keys[i], error, seconds)
+                if error is not None:
+                    failed.append(i)
+            pool.close()
+            pool.join()
+            pending = failed
+
+        records = self.manifest["stages"].get(stage, {})
+        failed = [job["name"] for job in jobs
+                  if records.get(job["name"], {}).get("status") == "failed"]
+        for name in failed:
+            print("\tFailed on: " + name)
+            print(records[name]["error"])
+
+        return failed
@@ -30,7 +30,9 @@ Class BTCTFRecords
         dataset1 and dataset2;
     (3) Generate cases' names of two datasets
         respectively according to the label file;
-    (4) Extract relevant data to write TFRecords.
+    (4) Extract relevant data to write TFRecords, partial
+        patches recorded in the index file of BTCAugment
+        are loaded from their original patches.
 
 -2- Load batches and labels for training and validating from
     tfrecords.
@@ -48,6 +50,7 @@ from tqdm import *
 import pandas as pd
 import tensorflow as tf
 from btc_settings import *
+from btc_augment import load_partials
 
 
 class BTCTFRecords():
@@ -85,7 +88,8 @@ class BTCTFRecords():
 
             Inputs:
             -------
-            - input_dir: the path of directory where patches are saved in
+            - input_dir: the path of directory where patches are saved in,
+                         or where the index file of BTCAugment is
             - output_dir: the path of directory to write tfrecord files
             - temp_dir: the path of directory to save temporary files
             - label_file: the path of label file
@@ -115,6 +119,12 @@ class BTCTFRecords():
         # patches in two datasets
         self.data_num = {}
 
+        # Read the index of partial patches if it is exist
+        self.index = None
+        index_file = os.path.join(input_dir, AUGMENT_INDEX_FILE)
+        if os.path.isfile(index_file):
+            self.index = pd.read_csv(index_file)
+
         # TFRecords creation pipline
         self._check_case_no(input_dir)
         self._create_temp_files(temp_dir)
@@ -137,7 +147,10 @@ class BTCTFRecords():
         '''
 
         # Obtain serial numbers of cases
-        case_no = os.listdir(input_dir)
+        if self.index is not None:
+            case_no = self.index[CASE_NO].unique().tolist()
+        else:
+            case_no = os.listdir(input_dir)
 
         # Put unfound cases into list
         not_found_cases = []
@@ -293,20 +306,26 @@ class BTCTFRecords():
         grade3_num = 0
         grade4_num = 0
 
-        # For each case in list
-        for case in tqdm(cases):
-            # Generate paths for all data in one case
-            case_path = os.path.join(input_dir, case[0])
-            data_path = [os.path.join(case_path, p) for p in os.listdir(case_path)]
-
-            for dp in data_path:
+        # Function to load all data in one case
+        def load_case(case_no):
+            if self.index is not None:
+                for _, partial in load_partials(self.index, case_no):
+                    yield partial
+                return
 
+            # Generate paths for all data in one case
+            case_path = os.path.join(input_dir, case_no)
+            for p in os.listdir(case_path):
+                dp = os.path.join(case_path, p)
                 # If the data can not be found, skip to next iteration
-                if not os.path.isfile(dp):
-                    continue
+                if os.path.isfile(dp):
+                    yield np.load(dp)
+
+        # For each case in list
+        for case in tqdm(cases):
+            for data in load_case(case[0]):
 
-                # Read, normalize and convert data to binary
-                data = np.load(dp)
+                # Normalize and convert data to binary
                 data = normalize(data)
 
                 # Use one channel of data
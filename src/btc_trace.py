@@ -0,0 +1,391 @@
+# Brain Tumor Classification
+# Script for Tracing Stages of Preprocessing
+
+#     ,,,         ,,,
+#   ;"   ';     ;'   ",
+#   ;  @.ss$$$$$$s.@  ;
+#   `s$$$$$$$$$$$$$$$'
+#   $$$$$$$$$$$$$$$$$$
+#  $$$$P""Y$$$Y""W$$$$$
+#  $$$$  p"$$$"q  $$$$$
+#  $$$$  .$$$$$.  $$$$'
+#   $$$DaU$$O$$DaU$$$'
+#    '$$$$'.^.'$$$$'
+#       '&$$$$$&'
+
+'''
+
+Tracing of Multiprocessing Stages
+
+-1- Record spans in every worker: stage, subject, name,
+    start, end, bytes read and written, and RSS at the end.
+    Spans can be nested, such as "load", "zoom" and "save"
+    in the span of one subject.
+-2- Merge spans of all workers into one JSONL file and one
+    Chrome trace file, which can be opened in chrome://tracing.
+-3- Summarize per-stage totals, time of nested spans,
+    stragglers and utilization of workers.
+
+Tracing is disabled unless the environment variable BTC_TRACE
+is set to a directory, each process appends its spans to its
+own file in that directory. Workers forked by Pool inherit it.
+
+Usage example:
+
+    with trace("extract_tumor", case_no):
+        with trace("load", reads=[mask_path]):
+            mask = np.load(mask_path)
+        with trace("save") as span:
+            np.save(path, patch)
+            span.write(path)
+
+    BTC_TRACE=Temp/Trace python btc_patches.py
+    python btc_trace.py Temp/Trace
+
+'''
+
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+
+
+# Environment variable of the directory to save spans
+TRACE_ENV = "BTC_TRACE"
+
+# A span is a straggler if it is longer than
+# STRAGGLER_RATIO times the median of its stage
+STRAGGLER_RATIO = 2.0
+
+# Spans opened in each thread
+LOCAL = threading.local()
+
+
+def current_rss():
+    '''CURRENT_RSS
+
+        Return current RSS of this process in bytes,
+        or the peak RSS if /proc is not available.
+
+    '''
+
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Span(object):
+
+    def __init__(self, trace_dir, name, subject=None, reads=[], writes=[]):
+        '''__INIT__
+
+            A span of work in one process. The span which has
+            no parent is a stage, nested spans belong to the
+            stage of their parent.
+
+            Inputs:
+            -------
+            - trace_dir: directory to save spans
+            - name: name of the span
+            - subject: subject which is processed, a nested
+                       span takes the subject of its parent
+            - reads: paths of files which are read
+            - writes: paths of files which are written
+
+        '''
+
+        self.trace_dir = trace_dir
+        self.name = name
+        self.subject = subject
+        self.reads = list(reads)
+        self.writes = list(writes)
+        self.read_bytes = 0
+        self.write_bytes = 0
+
+        return
+
+    def read(self, path):
+        self.reads.append(path)
+        return
+
+    def write(self, path):
+        self.writes.append(path)
+        return
+
+    def __enter__(self):
+        stack = getattr(LOCAL, "stack", None)
+        if stack is None:
+            stack = LOCAL.stack = []
+
+        self.parent = stack[-1] if len(stack) > 0 else None
+        if self.parent is not None:
+            self.stage = self.parent.stage
+            if self.subject is None:
+                self.subject = self.parent.subject
+        else:
+            self.stage = self.name
+
+        stack.append(self)
+        self.start = time.time()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = time.time()
+        LOCAL.stack.pop()
+
+        # Outputs are written at the end of the span
+        self.read_bytes += sum([file_size(p) for p in self.reads])
+        self.write_bytes += sum([file_size(p) for p in self.writes])
+        if self.parent is not None:
+            self.parent.read_bytes += self.read_bytes
+            self.parent.write_bytes += self.write_bytes
+
+        record = {"stage": self.stage, "name": self.name,
+                  "subject": self.subject,
+                  "depth": len(LOCAL.stack),
+                  "pid": os.getpid(),
+                  "tid": threading.current_thread().ident,
+                  "start": self.start, "end": end,
+                  "read_bytes": self.read_bytes,
+                  "write_bytes": self.write_bytes,
+                  "rss": current_rss(),
+                  "error": None if exc_type is None else exc_type.__name__}
+
+        path = os.path.join(self.trace_dir,
+                            "spans-{}.jsonl".format(os.getpid()))
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+        # Exceptions are not suppressed
+        return False
+
+
+class NoSpan(object):
+
+    # Used while tracing is disabled, it does nothing
+
+    def read(self, path):
+        return
+
+    def write(self, path):
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+def trace(name, subject=None, reads=[], writes=[]):
+    '''TRACE
+
+        Open a span if BTC_TRACE is set, use it with "with".
+        Arguments are same as Span's.
+
+    '''
+
+    trace_dir = os.environ.get(TRACE_ENV)
+    if not trace_dir:
+        return NO_SPAN
+
+    if not os.path.isdir(trace_dir):
+        try:
+            os.makedirs(trace_dir)
+        except OSError:
+            # Created by another worker
+            pass
+
+    return Span(trace_dir, name, subject, reads, writes)
+
+
+def load_spans(trace_dir):
+    '''LOAD_SPANS
+
+        Load spans of all processes, sorted by start time.
+
+    '''
+
+    spans = []
+    for name in sorted(os.listdir(trace_dir)):
+        if not (name.startswith("spans-") and name.endswith(".jsonl")):
+            continue
+        with open(os.path.join(trace_dir, name), "r") as f:
+            spans += [json.loads(line) for line in f if line.strip()]
+
+    return sorted(spans, key=lambda s: s["start"])
+
+
+def summarize(spans):
+    '''SUMMARIZE
+
+        Summarize spans of each stage.
+
+        - count, total, mean and max time of subjects
+        - wall time from the first start to the last end
+        - workers: number of processes which ran the stage
+        - utilization: total time / (workers * wall time)
+        - bytes read and written, peak RSS of one process
+        - total time of each nested span, and time not in any
+          nested span, as "other"
+        - stragglers: subjects whose time is longer than
+          STRAGGLER_RATIO times the median
+
+        Input:
+        ------
+        - spans: list of spans
+
+        Output:
+        -------
+        - summary: dictionary of stages
+
+    '''
+
+    summary = {}
+    for stage in sorted(set([s["stage"] for s in spans])):
+        tops = [s for s in spans if s["stage"] == stage and s["depth"] == 0]
+        if len(tops) == 0:
+            continue
+
+        times = sorted([s["end"] - s["start"] for s in tops])
+        total = sum(times)
+        median = times[len(times) // 2]
+        wall = max([s["end"] for s in tops]) - min([s["start"] for s in tops])
+        workers = len(set([s["pid"] for s in tops]))
+
+        steps = {}
+        for s in spans:
+            if s["stage"] == stage and s["depth"] == 1:
+                steps[s["name"]] = steps.get(s["name"], 0) + s["end"] - s["start"]
+        steps["other"] = total - sum(steps.values())
+
+        stragglers = [[s["subject"], s["end"] - s["start"]] for s in tops
+                      if s["end"] - s["start"] > STRAGGLER_RATIO * median]
+
+        summary[stage] = {
+            "count": len(tops), "total": total, "mean": total / len(tops),
+            "median": median, "max": times[-1], "wall": wall,
+            "workers": workers,
+            "utilization": total / (workers * wall) if wall > 0 else 1.0,
+            "read_bytes": sum([s["read_bytes"] for s in tops]),
+            "write_bytes": sum([s["write_bytes"] for s in tops]),
+            "peak_rss": max([s["rss"] for s in spans if s["stage"] == stage]),
+            "errors": len([s for s in tops if s["error"] is not None]),
+            "steps": steps,
+            "stragglers": sorted(stragglers, key=lambda x: -x[1])}
+
+    return summary
+
+
+def format_summary(summary):
+    '''FORMAT_SUMMARY
+
+        Format the summary as a text table.
+
+    '''
+
+    mb = 1024.0 * 1024.0
+    lines = ["{:<24}{:>7}{:>10}{:>9}{:>9}{:>10}{:>9}{:>7}{:>10}{:>10}{:>9}".format(
+        "stage", "count", "total(s)", "mean(s)", "max(s)", "wall(s)",
+        "workers", "util", "read(MB)", "write(MB)", "rss(MB)")]
+    for stage, s in sorted(summary.items()):
+        lines.append("{:<24}{:>7}{:>10.2f}{:>9.2f}{:>9.2f}{:>10.2f}{:>9}"
+                     "{:>7.0%}{:>10.1f}{:>10.1f}{:>9.1f}".format(
+                         stage, s["count"], s["total"], s["mean"], s["max"],
+                         s["wall"], s["workers"], s["utilization"],
+                         s["read_bytes"] / mb, s["write_bytes"] / mb,
+                         s["peak_rss"] / mb))
+
+    for stage, s in sorted(summary.items()):
+        lines.append("")
+        lines.append(stage + ":")
+        for name, seconds in sorted(s["steps"].items(), key=lambda x: -x[1]):
+            ratio = seconds / s["total"] if s["total"] > 0 else 0
+            lines.append("  {:<22}{:>10.2f}s {:>6.1%}".format(name, seconds, ratio))
+        for subject, seconds in s["stragglers"]:
+            lines.append("  straggler {0}: {1:.2f}s, {2:.1f}x median".format(
+                subject, seconds, seconds / max(s["median"], 1e-9)))
+        if s["errors"] > 0:
+            lines.append("  {} subjects raised exceptions".format(s["errors"]))
+
+    return "\n".join(lines)
+
+
+def merge(trace_dir, output_dir=None):
+    '''MERGE
+
+        Merge spans of all processes and write outputs:
+        - trace.jsonl: one span in each line
+        - trace.json: Chrome trace, for chrome://tracing
+        - summary.txt: the summary table
+
+        Inputs:
+        -------
+        - trace_dir: directory of spans
+        - output_dir: directory of outputs, default is trace_dir
+
+        Output:
+        -------
+        - text of the summary table
+
+    '''
+
+    if output_dir is None:
+        output_dir = trace_dir
+
+    spans = load_spans(trace_dir)
+    if len(spans) == 0:
+        raise IOError("No span is found in " + trace_dir)
+    origin = spans[0]["start"]
+
+    with open(os.path.join(output_dir, "trace.jsonl"), "w") as f:
+        for span in spans:
+            f.write(json.dumps(span) + "\n")
+
+    events = []
+    for span in spans:
+        events.append({"name": span["name"], "cat": span["stage"], "ph": "X",
+                       "ts": (span["start"] - origin) * 1e6,
+                       "dur": (span["end"] - span["start"]) * 1e6,
+                       "pid": span["pid"], "tid": span["tid"],
+                       "args": {"subject": span["subject"],
+                                "read_bytes": span["read_bytes"],
+                                "write_bytes": span["write_bytes"],
+                                "rss": span["rss"],
+                                "error": span["error"]}})
+    with open(os.path.join(output_dir, "trace.json"), "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    text = format_summary(summarize(spans))
+    with open(os.path.join(output_dir, "summary.txt"), "w") as f:
+        f.write(text + "\n")
+
+    return text
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python btc_trace.py trace_dir [output_dir]")
+        sys.exit(1)
+
+    print(merge(*sys.argv[1:3]))
@@ -33,8 +33,11 @@ import os
 import warnings
 import numpy as np
 from btc_settings import *
+from btc_trace import trace
+from btc_chunks import load_volume
+from btc_augment_ops import flip
 from multiprocessing import Pool, cpu_count
-from scipy.ndimage.interpolation import zoom
+from btc_resample import resample, pool_threads
 
 
 # Ignore the warning caused by SciPy
@@ -44,12 +47,13 @@ warnings.simplefilter("ignore", UserWarning)
 # Helper function to do multiprocessing of
 # BTCVolumes._resize_volume
 def unwrap_resize_volume(arg, **kwarg):
-    return BTCVolumes._resize_volume(*arg, **kwarg)
+    with trace("resize_volume", arg[3]):
+        return BTCVolumes._resize_volume(*arg, **kwarg)
 
 
 class BTCVolumes():
 
-    def __init__(self, input_dir, output_dir):
+    def __init__(self, input_dir, output_dir, run=True):
         '''__INIT__
 
             Initialization of instance.
@@ -62,6 +66,9 @@ class BTCVolumes():
                          keeps preprocessed volume
             - output_dir: string, the path of the directory that
                           will store resized volumes
+            - run: whether to resize volumes now, default is True,
+                   BTCExtract sets it to False and calls
+                   BTCVolumes._resize_volume on cases it has loaded
 
         '''
 
@@ -75,9 +82,11 @@ class BTCVolumes():
 
         # Obtain volumes' serial numbers
         self.names = os.listdir(input_dir)
+        self.output_dir = output_dir
 
         # Multi-process on resizing volumes
-        self._resize_volume_multi(input_dir, output_dir)
+        if run:
+            self._resize_volume_multi(input_dir, output_dir)
 
         return
 
@@ -99,16 +108,18 @@ class BTCVolumes():
         input_paths = [os.path.join(input_dir, name) for name in self.names]
 
         print("\nResize brain volumes into same shape\n")
+        threads = pool_threads(len(self.names))
         paras = zip([self] * len(self.names),
                     input_paths,
                     [output_dir] * len(self.names),
-                    self.names)
+                    self.names,
+                    [threads] * len(self.names))
         pool = Pool(processes=cpu_count())
         pool.map(unwrap_resize_volume, paras)
 
         return
 
-    def _resize_volume(self, input_path, output_dir, name):
+    def _resize_volume(self, input_path, output_dir, name, threads=None):
         '''_RESIZE_VOLUME
 
             Perform resizing on one brain volume, and it will
@@ -116,23 +127,24 @@ class BTCVolumes():
 
             Inputs:
             -------
-            - input_dir: string, the path of the input volume
+            - input_path: string, the path of the input volume,
+                          or the volume if it has been loaded
             - output_dir: string, the path of the directory that
                           will store resized volume
             - name: string, the serial number of input volume
+            - threads: the number of threads of resampling,
+                       default is None, which uses all cores
 
         '''
 
-        # The function to obtain the horizontal mirror
-        # of input volume to enlarge dataset
-        def horizontal_mirror(volume):
-            return np.fliplr(volume)
-
         case_no = name.split(".")[0]
         print("Resize brain volume of " + case_no)
 
         # Load data from input path
-        volume = np.load(input_path)
+        if isinstance(input_path, str):
+            volume = load_volume(input_path)
+        else:
+            volume = input_path
         vshape = list(volume.shape)
 
         # Remove space around edge, which is zero background
@@ -149,24 +161,21 @@ class BTCVolumes():
         left_pad_size = int(pad_size / 2.0)
         right_pad_size = pad_size - left_pad_size
 
-        # Generate padding part
-        vshape[1] = left_pad_size
-        left_pad = np.zeros(vshape)
-        vshape[1] = right_pad_size
-        right_pad = np.zeros(vshape)
-
-        # Pad the volume with zero background, and get new shape
-        pad_volume = np.hstack((left_pad, volume, right_pad))
+        # Pad the volume with zero background in its dtype,
+        # and get new shape
+        pad_width = [(0, 0)] * len(vshape)
+        pad_width[1] = (left_pad_size, right_pad_size)
+        pad_volume = np.pad(volume, pad_width, mode="constant")
         vshape = list(pad_volume.shape)
 
         # Resize brain volume by interpolation
         factor = [ns / float(vs) for ns, vs in zip(VOLUME_SHAPE, vshape)]
-        resized_volume = zoom(pad_volume, zoom=factor, order=1, prefilter=False)
-        resized_volume = resized_volume.astype(volume.dtype)
+        resized_volume = resample(pad_volume, factor, order=1,
+                                  output=volume.dtype, threads=threads)
 
         # Obtain the horizontal mirror of resized volume
         # to carry out augmentation
-        volumes = [resized_volume, horizontal_mirror(resized_volume)]
+        volumes = [resized_volume, flip(resized_volume[None], 1)[0]]
 
         # Create folder to keep resized volume
         # if the folder is not exist
@@ -0,0 +1,68 @@
+# Script for testing loading of landmarks, files saved before
+# landmarks had a version, such as ones in Temp/Preprocessed,
+# are loaded with a computed version, which is the same as the
+# version of these landmarks saved by _save_landmarks
+
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, src_dir)
+from btc_settings import *
+from btc_preprocess import BTCPreprocess
+
+
+def raises(func, *args):
+    try:
+        func(*args)
+    except ValueError as e:
+        return str(e)
+    raise AssertionError("ValueError is not raised.")
+
+
+# Steps of landmarks are used without preprocessing
+prep = BTCPreprocess.__new__(BTCPreprocess)
+
+legacy_dir = os.path.join(src_dir, TEMP_FOLDER, PREPROCESSED_FOLDER)
+legacy, version = prep._load_landmarks(legacy_dir)
+assert sorted(legacy.keys()) == sorted(VOLUME_TYPES)
+assert len(version) == LANDMARKS_VERSION_LENGTH
+for vtype in VOLUME_TYPES:
+    path = os.path.join(legacy_dir, vtype + LANDMARKS_SUFFIX)
+    expected = pd.read_csv(path, index_col=0).values[0]
+    assert np.array_equal(legacy[vtype], expected)
+
+temp_dir = tempfile.mkdtemp()
+try:
+    # Saved with a version, loaded as the same
+    assert prep._save_landmarks(temp_dir, legacy) == version
+    loaded, loaded_version = prep._load_landmarks(temp_dir)
+    assert loaded_version == version
+    for vtype in VOLUME_TYPES:
+        assert np.array_equal(loaded[vtype], legacy[vtype])
+
+    # Only one file has no version
+    path = os.path.join(temp_dir, VOLUME_TYPES[0] + LANDMARKS_SUFFIX)
+    shutil.copy(os.path.join(legacy_dir, VOLUME_TYPES[0] + LANDMARKS_SUFFIX), path)
+    assert "have no version" in raises(prep._load_landmarks, temp_dir)
+
+    # Percentiles are different from PCTS
+    landmarks_df = pd.read_csv(path, index_col=0)
+    landmarks_df.drop(columns=PCTS_COLUMNS[-1]).to_csv(path)
+    assert "different from PCTS" in raises(prep._load_landmarks, temp_dir)
+
+    # Landmarks are modified after saving
+    prep._save_landmarks(temp_dir, legacy)
+    landmarks_df = pd.read_csv(path, index_col=0, dtype={LANDMARKS_VERSION: str})
+    landmarks_df[PCTS_COLUMNS[1]] += 1
+    landmarks_df.to_csv(path)
+    assert "do not match" in raises(prep._load_landmarks, temp_dir)
+finally:
+    shutil.rmtree(temp_dir)
+
+print("Landmarks with and without version are loaded.")
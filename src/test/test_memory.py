@@ -0,0 +1,38 @@
+# Script for testing memory of each stage on a small synthetic
+# cohort by BTCBenchmark, one worker of each stage should keep
+# its peak RSS, over the RSS after modules are imported, in the
+# budget of the stage in MEMORY_BUDGETS. Stages whose dependencies
+# cannot be imported are skipped
+
+
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from btc_settings import *
+from btc_benchmark import STAGES, BTCBenchmark
+
+
+SUBJECTS = 2
+WORKERS = 1
+
+
+work_dir = tempfile.mkdtemp()
+try:
+    bench = BTCBenchmark(work_dir)
+    for name in STAGES:
+        result = bench.run(name, SUBJECTS, WORKERS)
+        if result["status"] == "skipped":
+            print("Skip {0}: {1}".format(name, result["error"]))
+            continue
+
+        assert result["status"] == "done", result["error"]
+        assert result["worker_rss_bytes"] <= result["memory_budget_bytes"], \
+            "{0}: {1} > {2} bytes".format(name, result["worker_rss_bytes"],
+                                          result["memory_budget_bytes"])
+finally:
+    shutil.rmtree(work_dir)
+
+print("Memory of each stage is in its budget.")
@@ -0,0 +1,54 @@
+# Script for testing dilated and eroded masks computed
+# by distance transform in tumor regions, which should
+# equal to iterated dilatation and erosion of SciPy
+
+
+import os
+import sys
+import numpy as np
+import scipy.ndimage as sn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from btc_settings import *
+from btc_patches import roi_morphology
+
+
+kernel = sn.generate_binary_structure(3, 1)
+shape = [60, 70, 50]
+
+
+def check(mask, iterations=MORP_ITER_NUM):
+    begin, masks = roi_morphology(mask, iterations)
+    if begin is None:
+        assert not mask.any()
+        return
+
+    region = tuple([slice(b, b + s) for b, s in
+                    zip(begin, masks["original"].shape)])
+    dilated = sn.binary_dilation(mask, structure=kernel, iterations=iterations)
+    eroded = sn.binary_erosion(mask, structure=kernel, iterations=iterations)
+
+    # Nothing is out of the region
+    for full, roi in [(mask, masks["original"]), (dilated, masks["dilated"]),
+                      (eroded, masks["eroded"])]:
+        assert np.array_equal(full[region], roi)
+        assert full.sum() == roi.sum()
+
+
+np.random.seed(0)
+for i in range(50):
+    noise = sn.gaussian_filter(np.random.rand(*shape), np.random.uniform(1, 4))
+    mask = noise > np.percentile(noise, np.random.uniform(80, 99.9))
+    # Tumors touching borders of the volume
+    if i % 3 == 0:
+        mask[:np.random.randint(1, 20), :, -np.random.randint(1, 20):] = True
+    check(mask, np.random.randint(1, 8))
+
+check(np.zeros(shape, dtype=bool))
+check(np.ones(shape, dtype=bool))
+
+single = np.zeros(shape, dtype=bool)
+single[0, 35, 49] = True
+check(single)
+
+print("Morphology in tumor regions equals to iterated morphology.")
@@ -0,0 +1,142 @@
+# Script for testing the schedule of bias field correction
+# with a stand-in of N4BiasFieldCorrection set by BTC_N4,
+# which sleeps and exits with a given status. Jobs of larger
+# volumes should start first, no more than the scheduled number
+# of jobs run at once, each of them gets its number of ITK
+# threads, and a non-zero exit is recorded as failed
+
+
+import os
+import sys
+import stat
+import shutil
+import tempfile
+import numpy as np
+import nibabel as nib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from btc_settings import *
+import btc_store
+import btc_preprocess
+from btc_store import BTCStore
+from btc_preprocess import BTCPreprocess
+
+
+SLEEP = 0.5
+FAILED_STATUS = 3
+
+STAND_IN = '''#!{python}
+import os
+import sys
+import time
+import shutil
+
+args = sys.argv[1:]
+orig_path = args[args.index("--input-image") + 1]
+temp_path = args[args.index("--output") + 1]
+name = os.path.basename(orig_path)
+
+with open({log!r}, "a") as f:
+    f.write("{{0}} {{1}} {{2}} {{3}}\\n".format(
+            "start", name, time.time(), os.environ.get({env!r})))
+time.sleep({sleep})
+with open({log!r}, "a") as f:
+    f.write("{{0}} {{1}} {{2}} -\\n".format("end", name, time.time()))
+
+status = {failed!r}.get(name, 0)
+if status == 0:
+    shutil.copy(orig_path, temp_path)
+sys.exit(status)
+'''
+
+
+def read_log(log_path):
+    events = []
+    with open(log_path, "r") as f:
+        for line in f:
+            event, name, seconds, threads = line.split()
+            events.append((float(seconds), event, name, threads))
+    return sorted(events)
+
+
+# Schedule of a machine with 8 cpus, 2 jobs of 4 threads
+btc_store.cpu_count = lambda: 8
+btc_preprocess.cpu_count = lambda: 8
+
+work_dir = tempfile.mkdtemp()
+try:
+    input_dir = os.path.join(work_dir, "input")
+    temp_dir = os.path.join(work_dir, "temp")
+    log_path = os.path.join(work_dir, "n4.log")
+
+    # Each case has its own size
+    np.random.seed(0)
+    volume_no, sizes = [], {}
+    for i, side in enumerate([8, 24, 12, 20, 16]):
+        vno = "Case{0}".format(i)
+        os.makedirs(os.path.join(input_dir, vno))
+        volume_no.append(vno)
+        for vtype in VOLUME_TYPES:
+            name = vno + "_" + vtype + SOURCE_EXTENSION
+            volume = np.random.rand(side, side, side).astype(np.float32) * 100
+            nib.save(nib.Nifti1Image(volume, np.eye(4)),
+                     os.path.join(input_dir, vno, name))
+            sizes[name] = os.path.getsize(os.path.join(input_dir, vno, name))
+
+    failed_name = volume_no[2] + "_" + VOLUME_TYPES[1] + SOURCE_EXTENSION
+    stand_in = os.path.join(work_dir, "n4.py")
+    with open(stand_in, "w") as f:
+        f.write(STAND_IN.format(python=sys.executable, log=log_path,
+                                env=ITK_THREADS_ENV, sleep=SLEEP,
+                                failed={failed_name: FAILED_STATUS}))
+    os.chmod(stand_in, os.stat(stand_in).st_mode | stat.S_IEXEC)
+    os.environ[N4_COMMAND_ENV] = stand_in
+
+    # Steps of bias field correction are used without other stages
+    prep = BTCPreprocess.__new__(BTCPreprocess)
+    prep.volume_no = list(volume_no)
+    for vtype in VOLUME_TYPES:
+        os.makedirs(os.path.join(temp_dir, vtype))
+    processes, threads = prep._n4_schedule()
+    assert (processes, threads) == (2, 4)
+
+    store = BTCStore(temp_dir)
+    prep._bias_field_correction_multi(input_dir, temp_dir, store)
+    events = read_log(log_path)
+
+    # Larger volumes first, fewer than i + processes volumes are
+    # larger than the i-th job to start in the first attempt
+    started = []
+    for _, event, name, _ in events:
+        if event == "start" and name not in started:
+            started.append(name)
+    assert sorted(started) == sorted(sizes.keys())
+    for i, name in enumerate(started):
+        larger = [n for n in sizes if sizes[n] > sizes[name]]
+        assert len(larger) < i + processes
+
+    # No more than processes jobs at once
+    running, most = 0, 0
+    for _, event, _, _ in events:
+        running += 1 if event == "start" else -1
+        most = max(most, running)
+    assert most == processes
+
+    # Each job gets its number of ITK threads
+    assert all([t == str(threads) for _, event, _, t in events
+                if event == "start"])
+
+    # Non-zero exit is recorded as failed, others are done
+    records = store.manifest["stages"]["BiasFieldCorrection"]
+    for name in sizes:
+        if name == failed_name:
+            assert records[name]["status"] == "failed"
+            assert "status {0}".format(FAILED_STATUS) in records[name]["error"]
+        else:
+            assert records[name]["status"] == "done"
+    assert prep.volume_no == [vno for vno in volume_no
+                              if vno != volume_no[2]]
+finally:
+    shutil.rmtree(work_dir)
+
+print("N4 jobs are scheduled largest first with pinned ITK threads.")
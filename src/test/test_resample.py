@@ -0,0 +1,74 @@
+# Script for testing resampling in threads, which
+# should equal to scipy.ndimage.zoom, and timing both.
+# zoom in mirror mode is compared, which is the same as its
+# default constant mode inside the input, but never fills
+# the last row with zero due to rounding of coordinates
+
+
+import os
+import sys
+import time
+import numpy as np
+from scipy.ndimage import zoom
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from btc_settings import *
+from btc_resample import resample, pool_threads
+from multiprocessing import cpu_count
+
+
+def check(volume, factor, order, output=np.float32, threads=4):
+    start = time.time()
+    expected = zoom(volume, zoom=factor, order=order,
+                    prefilter=False, output=output, mode="mirror")
+    zoom_time = time.time() - start
+
+    start = time.time()
+    resampled = resample(volume, factor, order=order,
+                         output=output, threads=threads)
+    resample_time = time.time() - start
+
+    assert resampled.shape == expected.shape
+    assert resampled.dtype == expected.dtype
+
+    diff = np.abs(resampled.astype(np.float64) - expected)
+    if np.dtype(output).kind in "iu":
+        # Linear interpolation is computed in float32, values
+        # near .5 may be rounded to the other integer
+        assert diff.max() <= 1 and np.mean(diff > 0) < 1e-4
+    else:
+        assert np.allclose(resampled, expected, rtol=1e-5, atol=1e-4)
+
+    print("{0} order {1}: zoom {2:.3f}s, resample {3:.3f}s".format(
+          list(volume.shape), order, zoom_time, resample_time))
+
+
+np.random.seed(0)
+volume = (np.random.rand(150, 130, 100, CHANNELS) * 1000).astype(np.float32)
+
+# Volumes in BTCVolumes, in float32 and int16
+factor = [ns / float(vs) for ns, vs in zip(VOLUME_SHAPE, volume.shape)]
+check(volume, factor, 1)
+check(volume.astype(np.int16), factor, 1, np.int16)
+
+# Tumor patches in BTCPatches, splines also span channels
+factor = [ns / float(vs) for ns, vs in zip(PATCH_SHAPE, volume.shape)]
+check(volume, factor, ZOOM_ORDER)
+check(volume[:30, :20, :25], [2, 2.5, 2, 1], ZOOM_ORDER)
+
+# Slices in BTCSlices and 2D slices
+factor = [ns / float(vs) for ns, vs in zip(SLICE_SHAPE, volume[:, :, 0].shape)]
+check(volume[:, :, 0], factor, 1)
+check(volume[:60, :70, 0, 0], [224 / 60.0, 224 / 70.0], 1)
+
+# Fewer rows than threads, and a single thread
+check(volume[:2, :20, :25], [1, 2, 1, 1], 1)
+check(volume[:40], [0.5, 0.5, 0.5, 1], 1, threads=1)
+
+# Pool processes x threads is no more than cpus
+assert pool_threads(1) == cpu_count()
+assert pool_threads(cpu_count() * 2) == 1
+assert pool_threads(10, processes=1) == cpu_count()
+assert pool_threads(0) == cpu_count()
+
+print("Resampling equals to zoom.")
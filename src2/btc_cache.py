@@ -0,0 +1,108 @@
+from __future__ import print_function
+
+
+import os
+import json
+import hashlib
+import numpy as np
+
+
+# Entries are evicted at least once every EVICT_INTERVAL writes
+# of one process, since other processes write to the cache too
+EVICT_INTERVAL = 16
+
+
+class BTCVolumeCache(object):
+
+    def __init__(self, cache_dir, max_size_gb=20):
+        '''__INIT__
+
+            On-disk cache of loaded and normalized volumes.
+            Each entry is one .npy file keyed by the source path,
+            its mtime and size, and the loading parameters.
+            Entries are reopened with mmap_mode="r", and the least
+            recently used ones are removed once the total size is
+            larger than max_size_gb. The total size is tracked in
+            memory, the directory is only listed while evicting.
+        '''
+
+        self.cache_dir = cache_dir
+        self.max_size = int(max_size_gb * 1024 ** 3)
+        self.size, self.writes = None, 0
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        return
+
+    def load(self, path, loader, paras=None):
+        '''LOAD
+
+            Return the cached array of path if it exists, otherwise
+            call loader(path), save the output and return it.
+        '''
+
+        cache_path = os.path.join(self.cache_dir,
+                                  self.get_key(path, paras) + ".npy")
+
+        try:
+            # Touch entry to mark it as recently used, an entry
+            # removed by another process is regarded as a miss
+            os.utime(cache_path, None)
+            return np.load(cache_path, mmap_mode="r")
+        except OSError:
+            pass
+
+        volume = loader(path)
+
+        # Write to a temporary file first so that an interrupted
+        # run or a concurrent reader never sees a partial entry
+        temp_path = cache_path + "." + str(os.getpid()) + ".tmp"
+        with open(temp_path, "wb") as f:
+            np.save(f, volume)
+        os.rename(temp_path, cache_path)
+
+        # The entry may be evicted by another process at once,
+        # so the loaded volume is returned rather than the file
+        if self.size is None:
+            self.size = self._evict()
+        else:
+            self.size += volume.nbytes
+            self.writes += 1
+            if self.size > self.max_size or self.writes >= EVICT_INTERVAL:
+                self.size, self.writes = self._evict(), 0
+
+        return volume
+
+    def _evict(self):
+        # Remove least recently used entries, return the total size
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npy"):
+                continue
+            entry_path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(entry_path)
+            except OSError:
+                continue
+            entries.append([stat.st_mtime, stat.st_size, entry_path])
+
+        entries.sort()
+        total_size = sum([e[1] for e in entries])
+        for _, size, entry_path in entries[:-1]:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            total_size -= size
+
+        return total_size
+
+    @staticmethod
+    def get_key(path, paras=None):
+        stat = os.stat(path)
+        info = json.dumps([os.path.abspath(path), stat.st_mtime,
+                           stat.st_size, paras], sort_keys=True)
+        return hashlib.sha1(info.encode("utf-8")).hexdigest()
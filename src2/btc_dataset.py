@@ -2,11 +2,102 @@ from __future__ import print_function
 
 
 import os
+import tempfile
 import numpy as np
 import pandas as pd
 import nibabel as nib
+from functools import partial
 from random import seed, shuffle
-from keras.utils import to_categorical
+from btc_loader import BTCLoader
+from btc_shards import BTCShards
+from btc_cache import BTCVolumeCache
+from btc_augment_ops import flip
+from keras.utils import Sequence, to_categorical
+
+
+# Parameters of BTCDataset.load_volume, part of the cache key
+VOLUME_PARAS = {"orientation": "transpose-flipud",
+                "normalization": "foreground-zscore",
+                "dtype": "float32"}
+
+
+class BTCSequence(Sequence):
+
+    def __init__(self, x, y, batch_size=16,
+                 shuffle=False, random_state=0,
+                 sampling=None):
+        '''__INIT__
+
+            x can be an array or a memory-mapped array, only the
+            requested batch is copied into memory. LGG samples
+            (label 0) are never copied for augmentation, the flip
+            is applied when a batch is assembled.
+
+            sampling: None, each sample once per epoch;
+                      "duplicate", LGG samples appear once more
+                      flipped;
+                      "balanced", each epoch draws samples with
+                      weights inverse to class frequency, and LGG
+                      samples are flipped at random.
+        '''
+
+        self.x = x
+        self.y = y
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.sampling = sampling
+        self.rng = np.random.RandomState(random_state)
+
+        self.labels = np.argmax(self.y, axis=1)
+        self._set_samples()
+
+        return
+
+    def _set_samples(self):
+        index = np.arange(len(self.labels))
+        is_lgg = self.labels == 0
+
+        if self.sampling == "duplicate":
+            samples = np.concatenate([index, index[is_lgg]])
+            flips = np.concatenate([np.zeros(len(index), dtype=bool),
+                                    np.ones(np.sum(is_lgg), dtype=bool)])
+        elif self.sampling == "balanced":
+            counts = np.bincount(self.labels)
+            weights = 1.0 / counts[self.labels]
+            samples = self.rng.choice(index, size=len(index),
+                                      p=weights / np.sum(weights))
+            flips = np.logical_and(is_lgg[samples],
+                                   self.rng.rand(len(samples)) < 0.5)
+        else:
+            samples = index
+            flips = np.zeros(len(index), dtype=bool)
+
+        if self.shuffle:
+            order = self.rng.permutation(len(samples))
+            samples, flips = samples[order], flips[order]
+
+        self.samples, self.flips = samples, flips
+        return
+
+    def __len__(self):
+        return int(np.ceil(len(self.samples) / float(self.batch_size)))
+
+    def __getitem__(self, idx):
+        batch = slice(idx * self.batch_size, (idx + 1) * self.batch_size)
+        samples, flips = self.samples[batch], self.flips[batch]
+
+        # Sorted indices keep reads sequential on disk
+        order = np.argsort(samples, kind="mergesort")
+        samples, flips = samples[order], flips[order]
+
+        # Same as np.fliplr on flipped volumes
+        batch_x = flip(self.x, 1, flips, samples)
+        return batch_x, self.y[samples]
+
+    def on_epoch_end(self):
+        if self.shuffle or self.sampling == "balanced":
+            self._set_samples()
+        return
 
 
 class BTCDataset(object):
@@ -18,14 +109,37 @@ class BTCDataset(object):
                  valid_prop=0.2,
                  random_state=0,
                  is_augment=True,
+                 sampling="duplicate",
                  save_split=False,
                  save_dir=None,
                  pre_split=False,
                  pre_trainset_path=None,
                  pre_validset_path=None,
                  pre_testset_path=None,
-                 data_format=".nii.gz"):
+                 data_format=".nii.gz",
+                 load_mode="memory",
+                 memmap_dir=None,
+                 batch_size=16,
+                 cache_dir=None,
+                 cache_size=20,
+                 processes=-1,
+                 index_path=None):
         '''__INIT__
+
+            sampling: how training samples are drawn if is_augment,
+                      "duplicate" or "balanced", see BTCSequence.
+            load_mode: "memory" loads each split into one array,
+                       "sequence" writes each split into a memory-mapped
+                       .npy file in memmap_dir and provides train_seq,
+                       valid_seq and test_seq for fit_generator.
+            cache_dir: if given, normalized volumes are cached in it,
+                       at most cache_size GB, and reused in later runs.
+            processes: number of processes to decode volumes,
+                       -1 to use all CPUs.
+            index_path: index.csv of shards written by BTCShards.pack,
+                        if given, splits are resolved against it and
+                        volumes are read from shards instead of
+                        hgg_dir and lgg_dir.
         '''
 
         self.hgg_dir = hgg_dir
@@ -36,15 +150,30 @@ class BTCDataset(object):
         self.valid_prop = valid_prop
         self.random_state = int(random_state)
         self.is_augment = is_augment
+        self.sampling = sampling if is_augment else None
 
         self.pre_trainset = pre_trainset_path
         self.pre_validset = pre_validset_path
         self.pre_testset = pre_testset_path
         self.data_format = data_format
 
+        self.load_mode = load_mode
+        self.batch_size = batch_size
+        self.memmap_dir = memmap_dir
+
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = BTCVolumeCache(cache_dir, cache_size)
+        self.processes = processes
+
+        self.shards = None
+        if index_path is not None:
+            self.shards = BTCShards(index_path)
+
         self.train_x, self.train_y = None, None
         self.valid_x, self.valid_y = None, None
         self.test_x, self.test_y = None, None
+        self.train_seq, self.valid_seq, self.test_seq = None, None, None
 
         trainset, validset, testset = \
             self._get_pre_datasplit() if pre_split else \
@@ -62,7 +191,8 @@ class BTCDataset(object):
         paras = {"hgg_dir": self.hgg_dir,
                  "lgg_dir": self.lgg_dir,
                  "data_format": self.data_format,
-                 "csv_path": None}
+                 "csv_path": None,
+                 "shards": self.shards}
 
         paras["csv_path"] = self.pre_trainset
         trainset = self.load_datasplit(**paras)
@@ -79,7 +209,8 @@ class BTCDataset(object):
         paras = {"label": None,
                  "dir_path": None,
                  "volume_type": self.volume_type,
-                 "random_state": self.random_state}
+                 "random_state": self.random_state,
+                 "shards": self.shards}
 
         paras["label"], paras["dir_path"] = 1, self.hgg_dir
         hgg_subjects = self.get_subjects_path(**paras)
@@ -105,18 +236,54 @@ class BTCDataset(object):
 
     def _load_dataset(self, trainset, validset, testset):
 
-        self.test_x, test_y = self.load_data(testset, "testset")
+        if self.load_mode == "sequence":
+            self._load_sequences(trainset, validset, testset)
+            return
+
+        self.test_x, test_y = self.load_data(testset, "testset",
+                                             self.cache, self.processes,
+                                             self.shards)
         self.test_y = to_categorical(test_y, num_classes=2)
 
-        self.valid_x, valid_y = self.load_data(validset, "validset")
+        self.valid_x, valid_y = self.load_data(validset, "validset",
+                                               self.cache, self.processes,
+                                               self.shards)
         self.valid_y = to_categorical(valid_y, num_classes=2)
 
-        train_x, train_y = self.load_data(trainset, "trainset")
-        if self.is_augment:
-            train_x, train_y = self.augment(train_x, train_y)
+        train_x, train_y = self.load_data(trainset, "trainset",
+                                          self.cache, self.processes,
+                                          self.shards)
         self.train_x = train_x
         self.train_y = to_categorical(train_y, num_classes=2)
 
+        # Augment LGG samples while assembling batches,
+        # rather than appending flipped copies to train_x
+        if self.sampling is not None:
+            self.train_seq = BTCSequence(self.train_x, self.train_y,
+                                         self.batch_size, True,
+                                         self.random_state, self.sampling)
+
+        return
+
+    def _load_sequences(self, trainset, validset, testset):
+        if self.memmap_dir is None:
+            self.memmap_dir = tempfile.mkdtemp(prefix="btc_memmap_")
+        if not os.path.isdir(self.memmap_dir):
+            os.makedirs(self.memmap_dir)
+
+        def flow(dataset, mode, shuffle=False, sampling=None):
+            x_path = os.path.join(self.memmap_dir, mode + "_x.npy")
+            y = self.load_data_to_memmap(dataset, mode, x_path,
+                                         self.cache, self.processes,
+                                         self.shards)
+            y = to_categorical(y, num_classes=2)
+            x = np.load(x_path, mmap_mode="r")
+            return BTCSequence(x, y, self.batch_size, shuffle,
+                               self.random_state, sampling)
+
+        self.test_seq = flow(testset, "testset")
+        self.valid_seq = flow(validset, "validset")
+        self.train_seq = flow(trainset, "trainset", True, self.sampling)
         return
 
     def _save_dataset(self, trainset, validset, testset):
@@ -133,14 +300,21 @@ class BTCDataset(object):
 
     @staticmethod
     def load_datasplit(hgg_dir, lgg_dir, csv_path,
-                       data_format=".nii.gz"):
+                       data_format=".nii.gz", shards=None):
         '''LOAD_DATASPLIT
+
+            If shards is given, return IDs instead of paths.
         '''
         df = pd.read_csv(csv_path)
         IDs = df["ID"].values.tolist()
         labels = df["label"].values.tolist()
         info = []
         for ID, label in zip(IDs, labels):
+            if shards is not None:
+                if ID not in shards:
+                    raise KeyError(ID + " is not in " + shards.index_path)
+                info.append([ID, label])
+                continue
             target_dir = hgg_dir if label else lgg_dir
             path = os.path.join(target_dir, ID[:-5],
                                 ID + data_format)
@@ -160,7 +334,11 @@ class BTCDataset(object):
 
     @staticmethod
     def get_subjects_path(dir_path, volume_type, label,
-                          random_state=0):
+                          random_state=0, shards=None):
+        if shards is not None:
+            return shards.get_subjects_path(volume_type, label,
+                                            random_state)
+
         subjects = os.listdir(dir_path)
         seed(random_state)
         shuffle(subjects)
@@ -187,43 +365,58 @@ class BTCDataset(object):
         return trainset, validset, testset
 
     @staticmethod
-    def load_data(dataset, mode):
-        x, y = [], []
-        print("Loading {} data ...".format(mode))
-        for subject in dataset:
-            volume_path, label = subject[0], subject[1]
+    def load_volume(volume_path, cache=None, shards=None):
+        if shards is not None:
+            # Reading from shards is as cheap as reading from cache
+            volume = shards.load(volume_path)
+        elif cache is not None:
+            return cache.load(volume_path, BTCDataset.load_volume,
+                              VOLUME_PARAS)
+        else:
             volume = nib.load(volume_path).get_data()
-            volume = np.transpose(volume, axes=[1, 0, 2])
-            volume = np.flipud(volume)
 
-            volume_obj = volume[volume > 0]
-            obj_mean = np.mean(volume_obj)
-            obj_std = np.std(volume_obj)
-            volume = (volume - obj_mean) / obj_std
+        volume = np.transpose(volume, axes=[1, 0, 2])
+        volume = np.flipud(volume)
 
-            volume = np.expand_dims(volume, axis=3)
-            x.append(volume.astype(np.float32))
-            y.append(label)
+        volume_obj = volume[volume > 0]
+        obj_mean = np.mean(volume_obj)
+        obj_std = np.std(volume_obj)
+        volume = (volume - obj_mean) / obj_std
 
-        x = np.array(x)
-        y = np.array(y).reshape((-1, 1))
+        volume = np.expand_dims(volume, axis=3)
+        return volume.astype(np.float32)
+
+    @staticmethod
+    def load_data(dataset, mode, cache=None, processes=-1, shards=None):
+        print("Loading {} data ...".format(mode))
+        paths = [subject[0] for subject in dataset]
+        labels = [subject[1] for subject in dataset]
+
+        loader = partial(BTCDataset.load_volume,
+                         cache=cache, shards=shards)
+        x, _ = BTCLoader(processes).load(paths, loader)
+        y = np.array(labels).reshape((-1, 1))
 
         return x, y
 
     @staticmethod
-    def augment(train_x, train_y):
-        print("Do Augmentation on LGG Samples ...")
-        train_x_aug, train_y_aug = [], []
-        for i in range(len(train_y)):
-            train_x_aug.append(train_x[i])
-            train_y_aug.append(train_y[i])
-            if train_y[i] == 0:
-                train_x_aug.append(np.fliplr(train_x[i]))
-                train_y_aug.append(np.array([0]))
-        train_x = np.array(train_x_aug)
-        train_y = np.array(train_y_aug).reshape((-1, 1))
+    def load_data_to_memmap(dataset, mode, to_path,
+                            cache=None, processes=-1, shards=None):
+        '''LOAD_DATA_TO_MEMMAP
+
+            Write volumes into a memory-mapped .npy file
+            instead of stacking them in memory.
+        '''
+        print("Loading {} data into {} ...".format(mode, to_path))
+        paths = [subject[0] for subject in dataset]
+        labels = [subject[1] for subject in dataset]
 
-        return train_x, train_y
+        loader = partial(BTCDataset.load_volume,
+                         cache=cache, shards=shards)
+        x, _ = BTCLoader(processes).load(paths, loader, to_path)
+        del x
+
+        return np.array(labels).reshape((-1, 1))
 
 
 if __name__ == "__main__":
@@ -249,3 +442,26 @@ if __name__ == "__main__":
                       pre_trainset_path="DataSplit/trainset.csv",
                       pre_validset_path="DataSplit/validset.csv",
                       pre_testset_path="DataSplit/testset.csv")
+
+    # Stream batches from memory-mapped files instead
+    data = BTCDataset(hgg_dir, lgg_dir,
+                      volume_type="t1ce",
+                      pre_split=True,
+                      pre_trainset_path="DataSplit/trainset.csv",
+                      pre_validset_path="DataSplit/validset.csv",
+                      pre_testset_path="DataSplit/testset.csv",
+                      load_mode="sequence",
+                      memmap_dir="Memmap",
+                      batch_size=16,
+                      cache_dir="VolumeCache")
+
+    # Resolve splits and read volumes from packed shards,
+    # see btc_shards.py
+    data = BTCDataset(hgg_dir, lgg_dir,
+                      volume_type="t1ce",
+                      pre_split=True,
+                      pre_trainset_path="DataSplit/trainset.csv",
+                      pre_validset_path="DataSplit/validset.csv",
+                      pre_testset_path="DataSplit/testset.csv",
+                      index_path=os.path.join(data_dir, "SegTrimmedShards",
+                                              "index.csv"))
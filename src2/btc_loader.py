@@ -0,0 +1,101 @@
+from __future__ import print_function
+
+
+import time
+import numpy as np
+from multiprocessing import Pool, RawArray, cpu_count
+
+
+# Output array and loader of each worker process,
+# set by init_worker when the pool starts
+WORKER = {}
+
+
+def init_worker(buffer, to_path, dtype, shape, loader):
+    if to_path is not None:
+        WORKER["x"] = np.load(to_path, mmap_mode="r+")
+    else:
+        WORKER["x"] = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+    WORKER["loader"] = loader
+    return
+
+
+def unwrap_load_one(arg, **kwarg):
+    return BTCLoader._load_one(*arg, **kwarg)
+
+
+class BTCLoader(object):
+
+    def __init__(self, processes=-1):
+        '''__INIT__
+
+            Decode volumes in a process pool, one task per subject.
+            Each worker writes its volume into one preallocated
+            array, either a shared memory buffer or a memory-mapped
+            .npy file, so the final list-to-array copy is skipped.
+        '''
+
+        if processes == -1 or processes > cpu_count():
+            processes = cpu_count()
+        self.processes = processes
+        return
+
+    def load(self, paths, loader, to_path=None):
+        '''LOAD
+
+            Return an array with loader(paths[i]) in x[i], and the
+            decoding time of each path in seconds.
+            The first path is decoded here to size the output.
+        '''
+
+        if len(paths) == 0:
+            return np.zeros([0]), []
+
+        start = time.time()
+        first = np.asarray(loader(paths[0]))
+        times = [0.0] * len(paths)
+        times[0] = time.time() - start
+
+        dtype, shape = first.dtype, [len(paths)] + list(first.shape)
+        buffer = None
+        if to_path is not None:
+            x = np.lib.format.open_memmap(to_path, mode="w+",
+                                          dtype=dtype, shape=tuple(shape))
+        else:
+            buffer = RawArray("b", int(np.prod(shape)) * dtype.itemsize)
+            x = np.frombuffer(buffer, dtype=dtype).reshape(shape)
+        x[0] = first
+        del first
+
+        if to_path is not None:
+            # Workers open the file by themselves
+            x.flush()
+
+        pool = Pool(processes=self.processes,
+                    initializer=init_worker,
+                    initargs=(buffer, to_path, dtype, shape, loader))
+        paras = zip([self] * (len(paths) - 1),
+                    range(1, len(paths)), paths[1:])
+        for i, t in pool.imap_unordered(unwrap_load_one, paras):
+            times[i] = t
+        pool.close()
+        pool.join()
+
+        self.print_times(paths, times)
+        return x, times
+
+    def _load_one(self, i, path):
+        start = time.time()
+        WORKER["x"][i] = WORKER["loader"](path)
+        if isinstance(WORKER["x"], np.memmap):
+            WORKER["x"].flush()
+        decode_time = time.time() - start
+        print("\tDecoded {0} in {1:.2f}s".format(path, decode_time))
+        return i, decode_time
+
+    @staticmethod
+    def print_times(paths, times):
+        print("Decoded {0} volumes with {1:.2f}s in total, "
+              "{2:.2f}s on average, {3:.2f}s at most".format(
+                  len(paths), np.sum(times), np.mean(times), np.max(times)))
+        return
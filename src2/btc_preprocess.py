@@ -5,8 +5,10 @@ import os
 import warnings
 import numpy as np
 import nibabel as nib
-from multiprocessing import Pool, cpu_count
-from scipy.ndimage.interpolation import zoom
+from btc_store import BTCStore
+from btc_trace import trace
+from btc_geometry import square_crop
+from btc_resample import resample, pool_threads
 
 
 # Ignore the warning caused by SciPy
@@ -14,44 +16,192 @@ warnings.simplefilter("ignore", UserWarning)
 
 
 def unwrap_preprocess(arg, **kwarg):
-    return BTCPreprocess._preprocess(*arg, **kwarg)
+    with trace("preprocess", arg[1]):
+        return BTCPreprocess._preprocess(*arg, **kwarg)
+
+
+def unwrap_preprocess_subject(arg, **kwarg):
+    with trace("preprocess_subject", arg[1][1]):
+        return BTCPreprocess._preprocess_subject(*arg, **kwarg)
 
 
 class BTCPreprocess(object):
 
-    def __init__(self, input_dirs, output_dirs, volume_type=None):
-        self.in_paths, self.out_paths, self.mask_paths = \
-            self.generate_paths(input_dirs, output_dirs, volume_type)
-        print(len(self.in_paths), len(self.out_paths), len(self.mask_paths))
+    def __init__(self, input_dirs, output_dirs=None, volume_type=None,
+                 store_dir=None):
+        '''__INIT__
+
+            output_dirs: used by preprocess, not needed if
+                         only preprocess_variants is called.
+            store_dir: folder of the manifest of outputs, scans
+                       which have been preprocessed with the same
+                       inputs and settings are skipped, see BTCStore.
+        '''
+
+        self.input_dirs = input_dirs
+        self.volume_type = volume_type
+        self.store_dir = store_dir
+        # Threads of resample in each process, set by the pool
+        self.threads = None
+
+        if output_dirs is not None:
+            self.in_paths, self.out_paths, self.mask_paths = \
+                self.generate_paths(input_dirs, output_dirs, volume_type)
+            print(len(self.in_paths), len(self.out_paths),
+                  len(self.mask_paths))
         return
 
     def preprocess(self, non_mask_coeff=0.333, is_mask=True, processes=-1):
         print("Preprocessing on the sample in BraTS dataset.\n")
-        num = len(self.in_paths)
-        paras = zip([self] * num, self.in_paths, self.out_paths, self.mask_paths,
-                    [non_mask_coeff] * num, [is_mask] * num)
-        if processes == -1 or processes > cpu_count():
-            processes = cpu_count()
-        pool = Pool(processes=processes)
-        pool.map(unwrap_preprocess, paras)
+        store = BTCStore(self.store_dir)
+        jobs = []
+        for in_path, to_path, mask_path in zip(self.in_paths, self.out_paths,
+                                               self.mask_paths):
+            inputs = [in_path]
+            if is_mask and mask_path is not None:
+                inputs.append(mask_path)
+            paras = [self, in_path, to_path, mask_path,
+                     non_mask_coeff, is_mask]
+            jobs.append(store.job(in_path, unwrap_preprocess, [paras],
+                                  inputs, [to_path],
+                                  [non_mask_coeff, is_mask]))
+        self.threads = pool_threads(len(jobs), processes)
+        store.run("Preprocess", jobs, processes)
         return
 
     def _preprocess(self, in_path, to_path, mask_path,
                     non_mask_coeff=0.333, is_mask=True):
         try:
             print("Rescaling on: " + in_path)
-            volume = self.load_nii(in_path)
+            with trace("load", reads=[in_path]):
+                volume = self.load_nii(in_path)
             if is_mask:
-                mask = self.load_nii(mask_path)
-                volume = self.segment(volume, mask, non_mask_coeff)
-            volume = self.trim(volume)
-            volume = self.resize(volume, [112, 112, 96])
-            self.save2nii(to_path, volume)
+                with trace("load", reads=[mask_path]):
+                    mask = self.load_nii(mask_path)
+                with trace("segment"):
+                    volume = self.segment(volume, mask, non_mask_coeff)
+            with trace("trim"):
+                volume = self.trim(volume)
+            with trace("zoom"):
+                volume = self.resize(volume, [112, 112, 96], self.threads)
+            with trace("save", writes=[to_path]):
+                self.save2nii(to_path, volume)
         except RuntimeError:
             print("\tFailed to rescal:" + in_path)
             return
         return
 
+    def preprocess_variants(self, variants, processes=-1):
+        '''PREPROCESS_VARIANTS
+
+            Generate several outputs in one pass: each scan and
+            the mask of a subject are loaded only once.
+
+            Inputs:
+            -------
+            - variants: list of dictionaries, each has
+                        "output_dirs": one for each input dir,
+                        "is_mask": default True,
+                        "non_mask_coeff": default 0.333,
+                        "target_shape": default [112, 112, 96].
+            - processes: number of processes, one subject per job.
+
+        '''
+
+        print("Preprocessing on the sample in BraTS dataset.\n")
+        store = BTCStore(self.store_dir)
+        is_mask = any([v.get("is_mask", True) for v in variants])
+        jobs = []
+        for subject in self.generate_subjects(self.input_dirs,
+                                              self.volume_type):
+            dir_idx, subject_dir, scan_names, mask_path = subject
+            inputs = [os.path.join(subject_dir, n) for n in scan_names]
+            if is_mask and mask_path is not None:
+                inputs.append(mask_path)
+            outputs = [os.path.join(v["output_dirs"][dir_idx],
+                                    os.path.basename(subject_dir), n)
+                       for v in variants for n in scan_names]
+            paras = [self, subject, variants]
+            jobs.append(store.job(subject_dir, unwrap_preprocess_subject,
+                                  [paras], inputs, outputs, variants))
+        self.threads = pool_threads(len(jobs), processes)
+        store.run("PreprocessVariants", jobs, processes)
+        return
+
+    def _preprocess_subject(self, subject, variants):
+        dir_idx, subject_dir, scan_names, mask_path = subject
+        subject_name = os.path.basename(subject_dir)
+
+        to_dirs = []
+        for variant in variants:
+            to_dir = os.path.join(variant["output_dirs"][dir_idx],
+                                  subject_name)
+            if not os.path.isdir(to_dir):
+                os.makedirs(to_dir)
+            to_dirs.append(to_dir)
+
+        mask = None
+        for scan_name in scan_names:
+            in_path = os.path.join(subject_dir, scan_name)
+            try:
+                print("Rescaling on: " + in_path)
+                with trace("load", reads=[in_path]):
+                    volume = self.load_nii(in_path)
+
+                # Variants with the same segmentation share
+                # one trimmed volume, only target shapes differ
+                trims = {}
+                for variant, to_dir in zip(variants, to_dirs):
+                    is_mask = variant.get("is_mask", True)
+                    coeff = variant.get("non_mask_coeff", 0.333)
+                    seg_key = (is_mask, coeff if is_mask else None)
+
+                    if seg_key not in trims:
+                        segged = volume
+                        if is_mask:
+                            if mask is None:
+                                with trace("load", reads=[mask_path]):
+                                    mask = self.load_nii(mask_path)
+                            with trace("segment"):
+                                segged = self.segment(volume, mask, coeff)
+                        with trace("trim"):
+                            trims[seg_key] = self.trim(segged)
+
+                    target_shape = variant.get("target_shape", [112, 112, 96])
+                    with trace("zoom"):
+                        resized = self.resize(trims[seg_key], target_shape,
+                                              self.threads)
+                    to_path = os.path.join(to_dir, scan_name)
+                    with trace("save", writes=[to_path]):
+                        self.save2nii(to_path, resized)
+            except RuntimeError:
+                print("\tFailed to rescal:" + in_path)
+                continue
+        return
+
+    @staticmethod
+    def generate_subjects(in_dirs, volume_type=None):
+        subjects = []
+        for dir_idx, in_dir in enumerate(in_dirs):
+            if not os.path.isdir(in_dir):
+                print("Input folder {} is not exist.".format(in_dir))
+                continue
+
+            for subject in os.listdir(in_dir):
+                subject_dir = os.path.join(in_dir, subject)
+                scan_names, mask_path = [], None
+                for scan_name in os.listdir(subject_dir):
+                    if "seg" in scan_name:
+                        mask_path = os.path.join(subject_dir, scan_name)
+                        continue
+                    if volume_type is not None:
+                        if volume_type not in scan_name:
+                            continue
+                    scan_names.append(scan_name)
+                subjects.append([dir_idx, subject_dir, scan_names, mask_path])
+
+        return subjects
+
     @staticmethod
     def generate_paths(in_dirs, out_dirs, volume_type=None):
         def create_dir(path):
@@ -97,53 +247,29 @@ class BTCPreprocess(object):
     @staticmethod
     def segment(volume, mask, non_mask_coeff=0.333):
 
-        if np.min(volume) != 0:
-            volume -= np.min(volume)
+        # volume is not changed, it may be used by other variants
+        min_value = np.min(volume)
+        if min_value != 0:
+            segged = volume - min_value
+        else:
+            segged = np.copy(volume)
 
-        non_mask_idx = np.where(mask == 0)
-        segged = np.copy(volume)
-        segged[non_mask_idx] = segged[non_mask_idx] * non_mask_coeff
+        non_mask = mask == 0
+        segged[non_mask] = segged[non_mask] * non_mask_coeff
 
         return segged
 
     @staticmethod
     def trim(volume):
-        non_zero_slices = [i for i in range(volume.shape[-1])
-                           if np.sum(volume[..., i]) > 0]
-        volume = volume[..., non_zero_slices]
-
-        row_begins, row_ends = [], []
-        col_begins, col_ends = [], []
-        for i in range(volume.shape[-1]):
-            non_zero_pixels = np.where(volume > 0)
-            row_begins.append(np.min(non_zero_pixels[0]))
-            row_ends.append(np.max(non_zero_pixels[0]))
-            col_begins.append(np.min(non_zero_pixels[1]))
-            col_ends.append(np.max(non_zero_pixels[1]))
-
-        row_begin, row_end = min(row_begins), max(row_ends)
-        col_begin, col_end = min(col_begins), max(col_ends)
-
-        rows_num = row_end - row_begin
-        cols_num = col_end - col_begin
-        more_col_len = rows_num - cols_num
-        more_col_len_left = more_col_len // 2
-        more_col_len_right = more_col_len - more_col_len_left
-        col_begin -= more_col_len_left
-        col_end += more_col_len_right
-        len_of_side = rows_num + 1
-
-        trimmed = np.zeros([len_of_side, len_of_side, volume.shape[-1]])
-        for i in range(volume.shape[-1]):
-            trimmed[..., i] = volume[row_begin:row_end + 1,
-                                     col_begin:col_end + 1, i]
-        return trimmed
+        # A view of volume, no copy
+        return square_crop(volume)
 
     @staticmethod
-    def resize(trimmed, target_shape):
+    def resize(trimmed, target_shape, threads=None):
         old_shape = list(trimmed.shape)
         factor = [n / float(o) for n, o in zip(target_shape, old_shape)]
-        resized = zoom(trimmed, zoom=factor, order=1, prefilter=False)
+        resized = resample(trimmed, factor, order=1, output=np.float32,
+                           threads=threads)
         resized = resized[:, 8:104, :]
         return resized
 
@@ -164,22 +290,15 @@ if __name__ == "__main__":
     lgg_input_dir = os.path.join(data_dir, "LGG")
     input_dirs = [hgg_input_dir, lgg_input_dir]
 
-    # Enhanced Tumor
-    is_mask = True
-    non_mask_coeff = 0.333
-    hgg_output_dir = os.path.join(data_dir, "HGGSegTrimmed")
-    lgg_output_dir = os.path.join(data_dir, "LGGSegTrimmed")
-    output_dirs = [hgg_output_dir, lgg_output_dir]
-
-    prep = BTCPreprocess(input_dirs, output_dirs, "t1ce")
-    prep.preprocess(non_mask_coeff=non_mask_coeff,
-                    is_mask=is_mask, processes=-1)
-
-    # Non-Enhanced Tumor
-    is_mask = False
-    hgg_output_dir = os.path.join(data_dir, "HGGTrimmed")
-    lgg_output_dir = os.path.join(data_dir, "LGGTrimmed")
-    output_dirs = [hgg_output_dir, lgg_output_dir]
-
-    prep = BTCPreprocess(input_dirs, output_dirs, "t1ce")
-    prep.preprocess(is_mask=is_mask, processes=-1)
+    # Enhanced Tumor and Non-Enhanced Tumor in one pass
+    variants = [{"output_dirs": [os.path.join(data_dir, "HGGSegTrimmed"),
+                                 os.path.join(data_dir, "LGGSegTrimmed")],
+                 "is_mask": True,
+                 "non_mask_coeff": 0.333},
+                {"output_dirs": [os.path.join(data_dir, "HGGTrimmed"),
+                                 os.path.join(data_dir, "LGGTrimmed")],
+                 "is_mask": False}]
+
+    prep = BTCPreprocess(input_dirs, volume_type="t1ce",
+                         store_dir=os.path.join(data_dir, "PreprocessStore"))
+    prep.preprocess_variants(variants, processes=-1)
@@ -0,0 +1,178 @@
+from __future__ import print_function
+
+
+import os
+import numpy as np
+import pandas as pd
+import nibabel as nib
+from random import seed, shuffle
+from multiprocessing import Pool, cpu_count
+
+
+# Views start at multiples of the page size
+ALIGNMENT = 4096
+INDEX_COLUMNS = ["ID", "subject", "label", "modality",
+                 "shard", "offset", "shape", "dtype"]
+
+
+def load_raw(path):
+    return nib.load(path).get_data()
+
+
+class BTCShards(object):
+
+    def __init__(self, index_path):
+        '''__INIT__
+
+            Read volumes packed by BTCShards.pack.
+            Shards are memory-mapped when they are first used,
+            and volumes are returned as read-only views into them,
+            so a random access costs page faults instead of a full
+            gzip decode.
+        '''
+
+        self.index_path = index_path
+        self.shards_dir = os.path.dirname(os.path.abspath(index_path))
+        self.index = pd.read_csv(index_path, dtype={"ID": str,
+                                                    "subject": str})
+        self.rows = {ID: i for i, ID in enumerate(self.index["ID"])}
+        self.shards = {}
+        return
+
+    def __getstate__(self):
+        # Memory maps are opened again in each worker process
+        state = self.__dict__.copy()
+        state["shards"] = {}
+        return state
+
+    def __contains__(self, ID):
+        return ID in self.rows
+
+    def load(self, ID):
+        '''LOAD
+
+            Return the volume of ID as a zero-copy view.
+        '''
+
+        row = self.index.iloc[self.rows[ID]]
+        shard = row["shard"]
+        if shard not in self.shards:
+            shard_path = os.path.join(self.shards_dir, shard)
+            self.shards[shard] = np.memmap(shard_path, dtype=np.uint8,
+                                           mode="r")
+        shape = [int(s) for s in row["shape"].split("x")]
+        return np.ndarray(shape=shape, dtype=np.dtype(row["dtype"]),
+                          buffer=self.shards[shard],
+                          offset=int(row["offset"]))
+
+    def get_subjects_path(self, volume_type, label, random_state=0):
+        '''GET_SUBJECTS_PATH
+
+            Same as BTCDataset.get_subjects_path, but subjects and
+            scans are found in the index rather than by os.listdir.
+            Return [[ID, label], ...].
+        '''
+
+        rows = self.index[self.index["label"] == label]
+        subjects = list(pd.unique(rows["subject"]))
+        seed(random_state)
+        shuffle(subjects)
+        scans = rows.groupby("subject", sort=False)["ID"]
+        subjects_paths = []
+        for subject in subjects:
+            for ID in scans.get_group(subject):
+                if volume_type not in ID:
+                    continue
+                subjects_paths.append([ID, label])
+        return subjects_paths
+
+    @staticmethod
+    def pack(input_dirs, labels, to_dir, volume_type=None,
+             shard_size=2, processes=-1):
+        '''PACK
+
+            Write scans in input_dirs, whose layout is
+            input_dir/subject/scan.nii.gz, into int16 shard files
+            of at most shard_size GB in to_dir, and an index.csv
+            with ID, subject, label, modality, shard, offset, shape
+            and dtype of each scan.
+
+            Inputs:
+            -------
+            - input_dirs: list of cohort folders, such as
+                          [HGGSegTrimmed, LGGSegTrimmed]
+            - labels: label of each cohort, such as [1, 0]
+            - to_dir: folder to save shards and index
+            - volume_type: only pack scans whose name contains it,
+                           pack all scans if None
+            - shard_size: maximum size of a shard in GB
+            - processes: number of processes to decode scans
+
+        '''
+
+        if not os.path.isdir(to_dir):
+            os.makedirs(to_dir)
+
+        paths, rows = [], []
+        for input_dir, label in zip(input_dirs, labels):
+            for subject in os.listdir(input_dir):
+                subject_dir = os.path.join(input_dir, subject)
+                for scan_name in os.listdir(subject_dir):
+                    if volume_type is not None and \
+                       volume_type not in scan_name:
+                        continue
+                    ID = scan_name.split(".")[0]
+                    paths.append(os.path.join(subject_dir, scan_name))
+                    rows.append([ID, subject, label, ID.split("_")[-1]])
+
+        if processes == -1 or processes > cpu_count():
+            processes = cpu_count()
+        pool = Pool(processes=processes)
+
+        max_size = int(shard_size * 1024 ** 3)
+        shard_idx, shard_file, offset = -1, None, max_size
+        for row, path, volume in zip(rows, paths,
+                                     pool.imap(load_raw, paths)):
+            packed = volume.astype(np.int16)
+            if not np.array_equal(packed, volume):
+                raise ValueError("Cannot be stored as int16: " + path)
+
+            if offset + packed.nbytes > max_size and offset > 0:
+                if shard_file is not None:
+                    shard_file.close()
+                shard_idx += 1
+                shard_name = "shard_{0:03d}.bin".format(shard_idx)
+                shard_file = open(os.path.join(to_dir, shard_name), "wb")
+                offset = 0
+
+            print("Packing {} into {}".format(path, shard_name))
+            shard_file.write(np.ascontiguousarray(packed).tobytes())
+            row += [shard_name, offset,
+                    "x".join([str(s) for s in packed.shape]),
+                    packed.dtype.str]
+
+            offset += packed.nbytes
+            padding = -offset % ALIGNMENT
+            shard_file.write(b"\0" * padding)
+            offset += padding
+
+        pool.close()
+        pool.join()
+        if shard_file is not None:
+            shard_file.close()
+
+        index_path = os.path.join(to_dir, "index.csv")
+        df = pd.DataFrame(data=rows, columns=INDEX_COLUMNS)
+        df.to_csv(index_path, index=False)
+        return index_path
+
+
+if __name__ == "__main__":
+
+    parent_dir = os.path.dirname(os.getcwd())
+    data_dir = os.path.join(parent_dir, "data", "BraTS")
+    hgg_dir = os.path.join(data_dir, "HGGSegTrimmed")
+    lgg_dir = os.path.join(data_dir, "LGGSegTrimmed")
+    shards_dir = os.path.join(data_dir, "SegTrimmedShards")
+
+    BTCShards.pack([hgg_dir, lgg_dir], [1, 0], shards_dir)
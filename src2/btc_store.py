@@ -0,0 +1,156 @@
+from __future__ import print_function
+
+
+import os
+import json
+import time
+import hashlib
+import traceback
+from multiprocessing import Pool, cpu_count
+
+
+def run_job(arg):
+    idx, func, args = arg
+    try:
+        func(*args)
+    except Exception:
+        return idx, traceback.format_exc()
+    return idx, None
+
+
+class BTCStore(object):
+
+    def __init__(self, store_dir=None):
+        '''__INIT__
+
+            Record outputs of preprocessing stages in
+            store_dir/manifest.json. A job is keyed by its stage,
+            parameters, output paths and the content hashes of its
+            input files. A re-run skips jobs whose key is recorded as
+            done and whose outputs still exist. Jobs that raise or do
+            not write their outputs are retried, then recorded as
+            failed and run again next time.
+            If store_dir is None, nothing is saved.
+        '''
+
+        self.store_dir = store_dir
+        self.manifest = {"files": {}, "stages": {}}
+
+        if store_dir is not None:
+            if not os.path.isdir(store_dir):
+                os.makedirs(store_dir)
+            self.manifest_path = os.path.join(store_dir, "manifest.json")
+            if os.path.isfile(self.manifest_path):
+                with open(self.manifest_path, "r") as f:
+                    self.manifest = json.load(f)
+        return
+
+    def save(self):
+        if self.store_dir is None:
+            return
+
+        # Never leave a partial manifest after a crash
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.manifest, f, indent=1, sort_keys=True)
+        os.rename(temp_path, self.manifest_path)
+        return
+
+    def file_hash(self, path):
+        if os.path.isdir(path):
+            items = [[name, self.file_hash(os.path.join(path, name))]
+                     for name in sorted(os.listdir(path))]
+            return hashlib.sha1(json.dumps(items).encode("utf-8")).hexdigest()
+
+        # Files are hashed again only if mtime or size changed
+        stat = os.stat(path)
+        abs_path = os.path.abspath(path)
+        cached = self.manifest["files"].get(abs_path)
+        if cached is not None and cached[:2] == [stat.st_mtime, stat.st_size]:
+            return cached[2]
+
+        sha1 = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        self.manifest["files"][abs_path] = [stat.st_mtime, stat.st_size, digest]
+        return digest
+
+    def job_key(self, stage, job):
+        hashes = [self.file_hash(path) for path in job["inputs"]]
+        info = json.dumps([stage, job["paras"], hashes, job["outputs"]],
+                          sort_keys=True, default=str)
+        return hashlib.sha1(info.encode("utf-8")).hexdigest()
+
+    def is_done(self, stage, job, key):
+        record = self.manifest["stages"].get(stage, {}).get(job["name"])
+        if record is None or record["status"] != "done":
+            return False
+        if record["key"] != key:
+            return False
+        return all([os.path.exists(path) for path in job["outputs"]])
+
+    def record(self, stage, name, key, error=None):
+        records = self.manifest["stages"].setdefault(stage, {})
+        records[name] = {"key": key,
+                         "status": "done" if error is None else "failed",
+                         "error": error,
+                         "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+        self.save()
+        return
+
+    @staticmethod
+    def job(name, func, args, inputs=[], outputs=[], paras=None):
+        return {"name": name, "func": func, "args": args,
+                "inputs": inputs, "outputs": outputs, "paras": paras}
+
+    def run(self, stage, jobs, processes=-1, retries=1):
+        '''RUN
+
+            Run jobs which are not done, return names of failed jobs.
+        '''
+
+        keys, pending = {}, []
+        for i, job in enumerate(jobs):
+            try:
+                keys[i] = self.job_key(stage, job)
+            except OSError as e:
+                self.record(stage, job["name"], None,
+                            "Missing input: " + str(e))
+                continue
+            if not self.is_done(stage, job, keys[i]):
+                pending.append(i)
+
+        print("{0}: {1} jobs, {2} to run".format(stage, len(jobs), len(pending)))
+        if processes == -1 or processes > cpu_count():
+            processes = cpu_count()
+
+        for attempt in range(retries + 1):
+            if len(pending) == 0:
+                break
+            if attempt > 0:
+                print("{0}: retry {1} failed jobs".format(stage, len(pending)))
+
+            pool = Pool(processes=processes)
+            paras = [[i, jobs[i]["func"], jobs[i]["args"]] for i in pending]
+            failed = []
+            for i, error in pool.imap_unordered(run_job, paras):
+                missing = [path for path in jobs[i]["outputs"]
+                           if not os.path.exists(path)]
+                if error is None and len(missing) > 0:
+                    error = "Missing output: " + ", ".join(missing)
+                self.record(stage, jobs[i]["name"], keys[i], error)
+                if error is not None:
+                    failed.append(i)
+            pool.close()
+            pool.join()
+            pending = failed
+
+        records = self.manifest["stages"].get(stage, {})
+        failed = [job["name"] for job in jobs
+                  if records.get(job["name"], {}).get("status") == "failed"]
+        for name in failed:
+            print("\tFailed on: " + name)
+            print(records[name]["error"])
+        return failed
@@ -0,0 +1,280 @@
+from __future__ import print_function
+
+
+import os
+import sys
+import json
+import time
+import resource
+import threading
+
+
+# Opt-in tracing of multiprocessing stages. If the environment
+# variable BTC_TRACE is set to a directory, each process appends
+# spans (stage, subject, name, start, end, bytes read and written,
+# RSS) to its own file there, workers forked by Pool inherit it.
+#
+#     with trace("preprocess", subject):
+#         with trace("load", reads=[in_path]):
+#             volume = load_nii(in_path)
+#
+# python btc_trace.py trace_dir merges spans of all processes into
+# trace.jsonl, trace.json (Chrome trace) and summary.txt.
+
+TRACE_ENV = "BTC_TRACE"
+
+# Longer than STRAGGLER_RATIO times the median of its stage
+STRAGGLER_RATIO = 2.0
+
+LOCAL = threading.local()
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # Peak RSS, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+class Span(object):
+
+    def __init__(self, trace_dir, name, subject=None, reads=[], writes=[]):
+        '''__INIT__
+
+            A span without parent is a stage, nested spans belong
+            to the stage and the subject of their parent. Sizes of
+            reads and writes are counted when the span ends.
+        '''
+
+        self.trace_dir = trace_dir
+        self.name = name
+        self.subject = subject
+        self.reads = list(reads)
+        self.writes = list(writes)
+        self.read_bytes = 0
+        self.write_bytes = 0
+        return
+
+    def read(self, path):
+        self.reads.append(path)
+        return
+
+    def write(self, path):
+        self.writes.append(path)
+        return
+
+    def __enter__(self):
+        stack = getattr(LOCAL, "stack", None)
+        if stack is None:
+            stack = LOCAL.stack = []
+
+        self.parent = stack[-1] if len(stack) > 0 else None
+        if self.parent is not None:
+            self.stage = self.parent.stage
+            if self.subject is None:
+                self.subject = self.parent.subject
+        else:
+            self.stage = self.name
+
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        end = time.time()
+        LOCAL.stack.pop()
+
+        self.read_bytes += sum([file_size(p) for p in self.reads])
+        self.write_bytes += sum([file_size(p) for p in self.writes])
+        if self.parent is not None:
+            self.parent.read_bytes += self.read_bytes
+            self.parent.write_bytes += self.write_bytes
+
+        record = {"stage": self.stage, "name": self.name,
+                  "subject": self.subject,
+                  "depth": len(LOCAL.stack),
+                  "pid": os.getpid(),
+                  "tid": threading.current_thread().ident,
+                  "start": self.start, "end": end,
+                  "read_bytes": self.read_bytes,
+                  "write_bytes": self.write_bytes,
+                  "rss": current_rss(),
+                  "error": None if exc_type is None else exc_type.__name__}
+
+        path = os.path.join(self.trace_dir,
+                            "spans-{}.jsonl".format(os.getpid()))
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+        return False
+
+
+class NoSpan(object):
+
+    def read(self, path):
+        return
+
+    def write(self, path):
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+def trace(name, subject=None, reads=[], writes=[]):
+    trace_dir = os.environ.get(TRACE_ENV)
+    if not trace_dir:
+        return NO_SPAN
+
+    if not os.path.isdir(trace_dir):
+        try:
+            os.makedirs(trace_dir)
+        except OSError:
+            # Created by another worker
+            pass
+    return Span(trace_dir, name, subject, reads, writes)
+
+
+def load_spans(trace_dir):
+    spans = []
+    for name in sorted(os.listdir(trace_dir)):
+        if not (name.startswith("spans-") and name.endswith(".jsonl")):
+            continue
+        with open(os.path.join(trace_dir, name), "r") as f:
+            spans += [json.loads(line) for line in f if line.strip()]
+    return sorted(spans, key=lambda s: s["start"])
+
+
+def summarize(spans):
+    '''SUMMARIZE
+
+        For each stage: count, total, mean and max time of subjects,
+        wall time, number of worker processes, utilization as
+        total / (workers * wall), bytes read and written, peak RSS,
+        time of nested steps ("other" is time out of any step),
+        and stragglers.
+    '''
+
+    summary = {}
+    for stage in sorted(set([s["stage"] for s in spans])):
+        tops = [s for s in spans if s["stage"] == stage and s["depth"] == 0]
+        if len(tops) == 0:
+            continue
+
+        times = sorted([s["end"] - s["start"] for s in tops])
+        total = sum(times)
+        median = times[len(times) // 2]
+        wall = max([s["end"] for s in tops]) - min([s["start"] for s in tops])
+        workers = len(set([s["pid"] for s in tops]))
+
+        steps = {}
+        for s in spans:
+            if s["stage"] == stage and s["depth"] == 1:
+                steps[s["name"]] = steps.get(s["name"], 0) + s["end"] - s["start"]
+        steps["other"] = total - sum(steps.values())
+
+        stragglers = [[s["subject"], s["end"] - s["start"]] for s in tops
+                      if s["end"] - s["start"] > STRAGGLER_RATIO * median]
+
+        summary[stage] = {
+            "count": len(tops), "total": total, "mean": total / len(tops),
+            "median": median, "max": times[-1], "wall": wall,
+            "workers": workers,
+            "utilization": total / (workers * wall) if wall > 0 else 1.0,
+            "read_bytes": sum([s["read_bytes"] for s in tops]),
+            "write_bytes": sum([s["write_bytes"] for s in tops]),
+            "peak_rss": max([s["rss"] for s in spans if s["stage"] == stage]),
+            "errors": len([s for s in tops if s["error"] is not None]),
+            "steps": steps,
+            "stragglers": sorted(stragglers, key=lambda x: -x[1])}
+    return summary
+
+
+def format_summary(summary):
+    mb = 1024.0 * 1024.0
+    lines = ["{:<24}{:>7}{:>10}{:>9}{:>9}{:>10}{:>9}{:>7}{:>10}{:>10}{:>9}".format(
+        "stage", "count", "total(s)", "mean(s)", "max(s)", "wall(s)",
+        "workers", "util", "read(MB)", "write(MB)", "rss(MB)")]
+    for stage, s in sorted(summary.items()):
+        lines.append("{:<24}{:>7}{:>10.2f}{:>9.2f}{:>9.2f}{:>10.2f}{:>9}"
+                     "{:>7.0%}{:>10.1f}{:>10.1f}{:>9.1f}".format(
+                         stage, s["count"], s["total"], s["mean"], s["max"],
+                         s["wall"], s["workers"], s["utilization"],
+                         s["read_bytes"] / mb, s["write_bytes"] / mb,
+                         s["peak_rss"] / mb))
+
+    for stage, s in sorted(summary.items()):
+        lines.append("")
+        lines.append(stage + ":")
+        for name, seconds in sorted(s["steps"].items(), key=lambda x: -x[1]):
+            ratio = seconds / s["total"] if s["total"] > 0 else 0
+            lines.append("  {:<22}{:>10.2f}s {:>6.1%}".format(name, seconds, ratio))
+        for subject, seconds in s["stragglers"]:
+            lines.append("  straggler {0}: {1:.2f}s, {2:.1f}x median".format(
+                subject, seconds, seconds / max(s["median"], 1e-9)))
+        if s["errors"] > 0:
+            lines.append("  {} subjects raised exceptions".format(s["errors"]))
+    return "\n".join(lines)
+
+
+def merge(trace_dir, output_dir=None):
+    '''MERGE
+
+        Write trace.jsonl, trace.json (chrome://tracing) and
+        summary.txt into output_dir, default is trace_dir.
+        Return the text of the summary.
+    '''
+
+    if output_dir is None:
+        output_dir = trace_dir
+
+    spans = load_spans(trace_dir)
+    if len(spans) == 0:
+        raise IOError("No span is found in " + trace_dir)
+    origin = spans[0]["start"]
+
+    with open(os.path.join(output_dir, "trace.jsonl"), "w") as f:
+        for span in spans:
+            f.write(json.dumps(span) + "\n")
+
+    events = []
+    for span in spans:
+        events.append({"name": span["name"], "cat": span["stage"], "ph": "X",
+                       "ts": (span["start"] - origin) * 1e6,
+                       "dur": (span["end"] - span["start"]) * 1e6,
+                       "pid": span["pid"], "tid": span["tid"],
+                       "args": {"subject": span["subject"],
+                                "read_bytes": span["read_bytes"],
+                                "write_bytes": span["write_bytes"],
+                                "rss": span["rss"],
+                                "error": span["error"]}})
+    with open(os.path.join(output_dir, "trace.json"), "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    text = format_summary(summarize(spans))
+    with open(os.path.join(output_dir, "summary.txt"), "w") as f:
+        f.write(text + "\n")
+    return text
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2:
+        print("Usage: python btc_trace.py trace_dir [output_dir]")
+        sys.exit(1)
+
+    print(merge(*sys.argv[1:3]))
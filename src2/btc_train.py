@@ -51,6 +51,10 @@ class BTCTrain(object):
         self.lr_start = self.paras["lr_start"]
         self.epochs_num = self.paras["epochs_num"]
         self.batch_size = self.paras["batch_size"]
+
+        # Parameters to feed BTCSequence in "sequence" load mode
+        self.workers = self.paras.get("workers", 4)
+        self.max_queue_size = self.paras.get("max_queue_size", 8)
         return
 
     def _load_model(self):
@@ -94,22 +98,65 @@ class BTCTrain(object):
 
     def _print_score(self):
 
-        def evaluate(x, y, data_str):
-            score = self.model.evaluate(x, y, self.batch_size, 0)
+        def evaluate(seq, x, y, data_str):
+            if seq is not None:
+                score = self.model.evaluate_generator(
+                    seq, workers=self.workers,
+                    max_queue_size=self.max_queue_size)
+            else:
+                score = self.model.evaluate(x, y, self.batch_size, 0)
             print(data_str + " Set: Loss: {0:.4f}, Accuracy: {1:.4f}".format(
                   score[0], score[1]))
             return
 
-        evaluate(self.data.train_x, self.data.train_y, "Training")
-        evaluate(self.data.valid_x, self.data.valid_y, "Validation")
-        evaluate(self.data.test_x, self.data.test_y, "Testing")
+        evaluate(self.data.train_seq, self.data.train_x,
+                 self.data.train_y, "Training")
+        evaluate(self.data.valid_seq, self.data.valid_x,
+                 self.data.valid_y, "Validation")
+        evaluate(self.data.test_seq, self.data.test_x,
+                 self.data.test_y, "Testing")
+
+        return
+
+    def _fit(self):
+        if self.data.train_seq is None:
+            self.model.fit(self.data.train_x, self.data.train_y,
+                           batch_size=self.batch_size,
+                           epochs=self.epochs_num,
+                           validation_data=(self.data.valid_x,
+                                            self.data.valid_y),
+                           shuffle=True,
+                           callbacks=self.callbacks)
+            return
 
+        validation_data = self.data.valid_seq
+        if validation_data is None:
+            validation_data = (self.data.valid_x, self.data.valid_y)
+
+        # Batches are assembled by background workers,
+        # at most max_queue_size of them are kept in memory
+        self.model.fit_generator(self.data.train_seq,
+                                 epochs=self.epochs_num,
+                                 validation_data=validation_data,
+                                 callbacks=self.callbacks,
+                                 workers=self.workers,
+                                 max_queue_size=self.max_queue_size,
+                                 shuffle=False)
         return
 
     def run(self, data):
 
         self.data = data
 
+        # Sequences assemble batches in the size given to BTCDataset,
+        # which fit_generator cannot change
+        has_seq = any([seq is not None for seq in
+                       [data.train_seq, data.valid_seq, data.test_seq]])
+        if has_seq and data.batch_size != self.batch_size:
+            raise ValueError("Batch size of dataset ({0}) is different from "
+                             "batch_size in paras ({1}).".format(
+                                 data.batch_size, self.batch_size))
+
         self._load_model()
         self._set_optimizer()
 
@@ -119,13 +166,7 @@ class BTCTrain(object):
         self.model.summary()
 
         self._set_callbacks()
-        self.model.fit(self.data.train_x, self.data.train_y,
-                       batch_size=self.batch_size,
-                       epochs=self.epochs_num,
-                       validation_data=(self.data.valid_x,
-                                        self.data.valid_y),
-                       shuffle=True,
-                       callbacks=self.callbacks)
+        self._fit()
 
         self.model.save(self.last_weights_path)
         self._print_score()
@@ -157,15 +198,18 @@ if __name__ == "__main__":
     hgg_dir = os.path.join(data_dir, "HGGSegTrimmed")
     lgg_dir = os.path.join(data_dir, "LGGSegTrimmed")
 
+    paras_name = "paras-1"
+    paras_json_path = "paras.json"
+    paras = BTCTrain.load_paras(paras_json_path, paras_name)
+
     data = BTCDataset(hgg_dir, lgg_dir,
                       volume_type="t1ce",
                       pre_split=True,
                       pre_trainset_path="DataSplit/trainset.csv",
                       pre_validset_path="DataSplit/validset.csv",
-                      pre_testset_path="DataSplit/testset.csv")
+                      pre_testset_path="DataSplit/testset.csv",
+                      batch_size=paras["batch_size"])
 
-    paras_name = "paras-1"
-    paras_json_path = "paras.json"
     weights_save_dir = os.path.join(parent_dir, "weights")
     logs_save_dir = os.path.join(parent_dir, "logs")
 